@@ -0,0 +1,314 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+"""Benchmark iotlab-ssh commands against a fake IoT-LAB topology.
+
+For each number of nodes, a fake topology is started (see
+fake_topology.py) and the commands are run on its nodes in a separate
+process, each command `--repeat` times, wait-for-boot once.
+
+Latency percentiles of the phases of each command on the hosts (connect,
+command, upload, boot...), from the timings of the commands, wall time,
+connections opened and peak memory are printed, and saved as JSON with
+`--output`. With `--baseline`, a previous output, host phases slower than
+the baseline by more than `--tolerance` make the benchmark fail.
+"""
+
+from __future__ import print_function
+
+import argparse
+import binascii
+import json
+import logging
+import os
+import resource
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from iotlabsshcli.sshlib.timing import percentile, summarize
+
+_FAKE_TOPOLOGY = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                              'fake_topology.py')
+_NODE = 'node-a8-{}.{}.iot-lab.info'
+PHASES = ('wait-for-boot', 'copy-file', 'flash-m3', 'reset-m3', 'run-cmd')
+
+
+def _peak_memory():
+    """Return the peak resident memory of this process in KiB."""
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage // 1024 if sys.platform == 'darwin' else usage
+
+
+def measure(scenario):
+    """Run the phases of scenario on the fake topology, return measures."""
+    # pylint:disable=import-outside-toplevel
+    from iotlabsshcli import open_a8
+    from iotlabsshcli.sshlib import get_backend
+    # pssh patches the process with gevent, it must come before paramiko
+    get_backend(scenario['backend'])
+    import paramiko
+    # Refused probes of booting nodes are logged as errors
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+
+    config_ssh = {'user': 'benchmark', 'exp_id': 0,
+                  'frontend': scenario['frontend'], 'port': scenario['port'],
+                  'pkey': paramiko.RSAKey.generate(1024),
+                  'backend': scenario['backend'],
+                  'fanout': scenario['fanout'],
+                  'compress': scenario['compress']}
+    if scenario['retry']:
+        # Simulated failures are non-zero exit codes
+        config_ssh['retry'] = {'max_attempts': scenario['retry'],
+                               'retry_on': ['connection', 'exit']}
+    sites = [str(site) for site in range(1, scenario['sites'] + 1)]
+    nodes = [_NODE.format(num, sites[num % len(sites)])
+             for num in range(1, scenario['nodes'] + 1)]
+    firmware = os.path.join(os.environ['IOTLABSSHCLI_CACHE'], 'fw.elf')
+    with open(firmware, 'wb') as firmware_fd:
+        # Hex digits of random bytes, compressible as firmwares are
+        firmware_fd.write(binascii.hexlify(
+            os.urandom(scenario['firmware_size'] // 2)))
+    connections = None
+    if scenario['reuse'] and scenario['backend'] == 'pssh':
+        # Only the pssh backend shares a pool, the asyncio one keeps its
+        # connections while a command runs
+        from iotlabsshcli.sshlib.pool import ConnectionPool
+        connections = ConnectionPool()
+
+    commands = {
+        'wait-for-boot': lambda: open_a8.wait_for_boot(
+            config_ssh, nodes, scenario['max_wait'],
+            connections=connections, timings=True),
+        'copy-file': lambda: open_a8.copy_file(
+            config_ssh, nodes, firmware, connections=connections,
+            timings=True),
+        'flash-m3': lambda: open_a8.flash_m3(
+            config_ssh, nodes, firmware, connections=connections,
+            timings=True),
+        'reset-m3': lambda: open_a8.reset_m3(
+            config_ssh, nodes, connections=connections, timings=True),
+        'run-cmd': lambda: open_a8.run_cmd(
+            config_ssh, nodes, 'uname -a', connections=connections,
+            timings=True),
+    }
+
+    measures = {}
+    start = time.time()
+    for phase in scenario['phases']:
+        wall_times = []
+        # Phase durations of each host, for each run
+        host_durations = {}
+        failed = 0
+        repeat = 1 if phase == 'wait-for-boot' else scenario['repeat']
+        for run in range(repeat):
+            # A new experiment each time, without files known as uploaded
+            config_ssh['exp_id'] += 1
+            shutil.rmtree(os.path.join(os.environ['IOTLABSSHCLI_CACHE'],
+                                       'uploads'), ignore_errors=True)
+            phase_start = time.time()
+            result = commands[phase]()[phase]
+            wall_times.append(time.time() - phase_start)
+            failed = max(failed, len(result.get('1', [])))
+            for host, durations in result['timings']['hosts'].items():
+                host_durations[(run, host)] = durations
+        measures[phase] = summarize(host_durations)
+        measures[phase]['wall_time'] = round(
+            percentile(sorted(wall_times), 50), 3)
+        measures[phase]['failed'] = failed
+    measures['wall_time'] = round(time.time() - start, 3)
+    if connections is not None:
+        connections.close()
+    measures['peak_memory'] = _peak_memory()
+    return measures
+
+
+def run_scenario(opts, nodes):
+    """Start a fake topology and measure the commands on nodes nodes."""
+    args = [sys.executable, _FAKE_TOPOLOGY, '--sites', str(opts.sites),
+            '--latency', str(opts.latency),
+            '--failure-rate', str(opts.failure_rate),
+            '--boot-delay', str(opts.boot_delay), '--seed', str(opts.seed)]
+    if opts.bandwidth:
+        args += ['--bandwidth', str(opts.bandwidth)]
+    if opts.max_startups:
+        args += ['--max-startups', str(opts.max_startups)]
+    cache_dir = tempfile.mkdtemp(prefix='iotlabsshcli-benchmark-')
+    env = dict(os.environ, IOTLABSSHCLI_CACHE=cache_dir)
+    topology = subprocess.Popen(args, stdout=subprocess.PIPE,
+                                universal_newlines=True)
+    try:
+        scenario = json.loads(topology.stdout.readline())
+        scenario.update(nodes=nodes, sites=opts.sites, phases=opts.phases,
+                        repeat=opts.repeat, max_wait=opts.max_wait,
+                        firmware_size=opts.firmware_size, reuse=opts.reuse,
+                        backend=opts.backend, fanout=opts.fanout,
+                        retry=opts.retry, compress=opts.compress)
+        # Run apart, so that peak memory is the one of this scenario
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__),
+             '--scenario', json.dumps(scenario)],
+            env=env, universal_newlines=True)
+        measures = json.loads(output.splitlines()[-1])
+    finally:
+        topology.send_signal(signal.SIGTERM)
+        stats = topology.communicate()[0].splitlines()
+        shutil.rmtree(cache_dir)
+    measures['connections'] = json.loads(stats[-1])
+    return measures
+
+
+def regressions(results, baseline, tolerance):
+    """Return the host phases of commands slower than in baseline by more
+    than tolerance.
+
+    >>> baseline = {'10': {'run-cmd': {'command': {'median': 1.0}}}}
+    >>> regressions({'10': {'run-cmd': {'command': {'median': 1.1}}}},
+    ...             baseline, 0.2)
+    []
+    >>> regressions({'10': {'run-cmd': {'command': {'median': 1.5},
+    ...                                 'wall_time': 3.0}}}, baseline, 0.2)
+    [('10', 'run-cmd', 'command', 1.0, 1.5)]
+    """
+    slower = []
+    for nodes, measures in sorted(results.items()):
+        for phase in PHASES:
+            for name, summary in sorted(measures.get(phase, {}).items()):
+                try:
+                    before = baseline[nodes][phase][name]['median']
+                    after = summary['median']
+                except (KeyError, TypeError):
+                    continue
+                if after > before * (1 + tolerance):
+                    slower.append((nodes, phase, name, before, after))
+    return slower
+
+
+def print_results(results):
+    """Print results as a table."""
+    row = '{:>6} {:<14} {:<8} {:>8} {:>8} {:>8} {:>8}'
+    print(row.format('nodes', 'command', 'phase', 'min', 'median', 'p95',
+                     'max'))
+    for nodes, measures in sorted(results.items(), key=lambda r: int(r[0])):
+        for phase in PHASES:
+            if phase not in measures:
+                continue
+            phase_measures = measures[phase]
+            for name, summary in sorted(phase_measures.items()):
+                if isinstance(summary, dict):
+                    print(row.format(nodes, phase, name, *[
+                        summary[key]
+                        for key in ('min', 'median', 'p95', 'max')]))
+            print('{:>6} {:<14} wall time {} s, {} failed'.format(
+                nodes, phase, phase_measures['wall_time'],
+                phase_measures['failed']))
+        connections = measures['connections']
+        print('{:>6} wall time {} s, peak memory {} KiB, connections: '
+              '{} frontend, {} node, {} reset'.format(
+                  nodes, measures['wall_time'], measures['peak_memory'],
+                  connections['frontend_connections'],
+                  connections['node_connections'],
+                  connections['reset_connections']))
+
+
+def parse_args(args=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--nodes', default='10,100,1000',
+                        type=lambda arg: [int(n) for n in arg.split(',')],
+                        help='comma separated numbers of nodes to measure')
+    parser.add_argument('--sites', type=int, default=1,
+                        help='number of sites the nodes are spread on')
+    parser.add_argument('--phases', default=','.join(PHASES),
+                        type=lambda arg: arg.split(','),
+                        help='comma separated commands to measure')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of runs of each command')
+    parser.add_argument('--reuse', action='store_true',
+                        help='keep connections open between phases')
+    parser.add_argument('--backend', choices=('pssh', 'asyncio'),
+                        default='pssh', help='SSH backend to measure')
+    parser.add_argument('--fanout', action='store_true',
+                        help='run node commands from the frontends')
+    parser.add_argument('--compress', action='store_true',
+                        help='copy files compressed')
+    parser.add_argument('--retry', type=int, default=None,
+                        metavar='ATTEMPTS',
+                        help='attempt failed hosts up to ATTEMPTS times')
+    parser.add_argument('--latency', type=float, default=0.005,
+                        help='seconds added to each connection and command')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='bytes per second of each copy')
+    parser.add_argument('--failure-rate', type=float, default=0,
+                        help='probability of a node command to fail')
+    parser.add_argument('--boot-delay', type=float, default=5,
+                        help='seconds after which all nodes are booted')
+    parser.add_argument('--max-startups', type=int, default=None,
+                        help='frontend connections negotiated at once, '
+                             'beyond which they are reset')
+    parser.add_argument('--max-wait', type=int, default=120,
+                        help='wait-for-boot max wait')
+    parser.add_argument('--firmware-size', type=int, default=128 * 1024,
+                        help='size of the copied and flashed file')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='random seed of the fake topology')
+    parser.add_argument('--output', help='save results as JSON there')
+    parser.add_argument('--baseline', help='results to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slow down compared to the baseline')
+    parser.add_argument('--scenario', help=argparse.SUPPRESS)
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    """Run the benchmark, return 1 on regression."""
+    opts = parse_args(args)
+    if opts.scenario:
+        print(json.dumps(measure(json.loads(opts.scenario))))
+        return 0
+
+    results = {}
+    for nodes in opts.nodes:
+        results[str(nodes)] = run_scenario(opts, nodes)
+    print_results(results)
+    if opts.output:
+        with open(opts.output, 'w') as output:
+            json.dump({'settings': vars(opts), 'results': results}, output,
+                      indent=4, sort_keys=True)
+
+    if opts.baseline:
+        with open(opts.baseline) as baseline:
+            baseline = json.load(baseline)['results']
+        slower = regressions(results, baseline, opts.tolerance)
+        for nodes, phase, name, before, after in slower:
+            print('Regression: {} {} on {} nodes, median {} s -> {} s'.format(
+                phase, name, nodes, before, after))
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+# -*- coding:utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+"""Fake IoT-LAB site frontend proxying to simulated A8 nodes.
+
+Serve SSH on 127.0.0.<N> as the frontend of site N: commands are run
+by pretending, files copied with scp or sent compressed on standard input
+are read and only their name kept, and 'direct-tcpip' channels to any node
+are served by a simulated node SSH server over the channel itself, as the
+real frontends proxy the nodes.
+
+Node commands sent to the frontend with the fan-out helper of
+iotlabsshcli are run by pretending too, once the helper was copied.
+
+Latency is added to each connection and command, copies are throttled
+to bandwidth, node commands fail with failure rate and nodes are only
+reachable once booted, boot delay after start at the latest.
+
+The frontend host name template and port are printed as a JSON line
+once ready, statistics as another JSON line once terminated with SIGTERM
+or SIGINT.
+"""
+
+from gevent import monkey
+monkey.patch_all()
+
+# pylint:disable=wrong-import-position
+import argparse  # noqa: E402
+import base64  # noqa: E402
+import json  # noqa: E402
+import logging  # noqa: E402
+import random  # noqa: E402
+import signal  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+
+import gevent  # noqa: E402
+import gevent.pool  # noqa: E402
+from gevent.event import Event  # noqa: E402
+from gevent.server import StreamServer  # noqa: E402
+import paramiko  # noqa: E402
+
+try:
+    from gevent import signal_handler
+except ImportError:  # gevent < 1.5
+    from gevent import signal as signal_handler
+
+_FRONTEND = 'frontend'
+_FRONTEND_ADDRESS = '127.0.0.{}'
+_SHELL = '$SHELL -c "'
+_UPTIME = ' 12:00:00 up 1 min,  0 users,  load average: 0.00, 0.00, 0.00\n'
+_CHUNK_SIZE = 32768
+_FANOUT_HELPER = '/.fanout-'
+_DECOMPRESS = ('gzip -dc ', 'zstd -dcq ')
+_HELPER_MISSING = 100
+
+
+def _unwrap(command):
+    """Return command without the shell pssh runs it with.
+
+    >>> _unwrap('$SHELL -c "uptime"')
+    'uptime'
+    >>> _unwrap('scp -t ~/A8/.iotlabsshcli/fw.elf')
+    'scp -t ~/A8/.iotlabsshcli/fw.elf'
+    """
+    if command.startswith(_SHELL) and command.endswith('"'):
+        return command[len(_SHELL):-1]
+    return command
+
+
+class Topology(object):
+    """Simulated frontend and nodes behaviour, with its statistics."""
+
+    # pylint:disable=too-many-arguments
+    def __init__(self, latency=0, bandwidth=None, failure_rate=0,
+                 boot_delay=0, seed=None, max_startups=None):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.boot_delay = boot_delay
+        self.max_startups = max_startups
+        self.random = random.Random(seed)
+        self.host_key = paramiko.RSAKey.generate(2048)
+        self.started = time.time()
+        self._boot_times = {}
+        self._startups = 0
+        self.files = set()
+        self.stats = {'frontend_connections': 0, 'node_connections': 0,
+                      'refused_connections': 0, 'reset_connections': 0,
+                      'commands': 0, 'failed_commands': 0,
+                      'bytes_received': 0, 'bytes_sent': 0}
+
+    def booted(self, node):
+        """Return True if node is booted."""
+        if node not in self._boot_times:
+            delay = self.boot_delay * self.random.uniform(0.5, 1)
+            self._boot_times[node] = self.started + delay
+        return time.time() >= self._boot_times[node]
+
+    def serve(self, sock, host=_FRONTEND):
+        """Serve SSH on sock as host until the connection is closed."""
+        server = _Server(self, host)
+        if host == _FRONTEND:
+            transport = self._start_frontend(sock, server)
+        else:
+            transport = self._start(sock, server, 'node')
+        if transport is None:
+            return
+        while transport.is_active():
+            channel = transport.accept(timeout=1)
+            if channel is None:
+                continue
+            node = server.tunnels.pop(channel.get_id(), None)
+            if node is not None:
+                gevent.spawn(self.serve, _Tunnel(channel), node)
+        transport.close()
+
+    def _start_frontend(self, sock, server):
+        """Negotiate a frontend connection, if under max_startups."""
+        if self.max_startups is None:
+            return self._start(sock, server, 'frontend')
+        # Like sshd MaxStartups, connections beyond the number of
+        # connections being negotiated are reset
+        if self._startups >= self.max_startups:
+            self.stats['reset_connections'] += 1
+            sock.close()
+            return None
+        self._startups += 1
+        try:
+            return self._start(sock, server, 'frontend')
+        finally:
+            self._startups -= 1
+
+    def _start(self, sock, server, kind):
+        """Negotiate an SSH connection, return its transport or None."""
+        gevent.sleep(self.latency)
+        self.stats['{}_connections'.format(kind)] += 1
+        transport = paramiko.Transport(sock)
+        transport.add_server_key(self.host_key)
+        try:
+            transport.start_server(server=server)
+        except (paramiko.SSHException, EOFError):
+            # Clients only probing the SSH banner
+            return None
+        return transport
+
+    def run(self, host, command, channel):
+        """Pretend to run command on host, return its exit status."""
+        self.stats['commands'] += 1
+        gevent.sleep(self.latency)
+        if command.startswith('scp -t'):
+            self.files.add(command.split()[-1].strip("'"))
+            return self._scp_sink(channel)
+        if command.startswith(_DECOMPRESS):
+            # Compressed copy, decompressed to a temporary file then moved
+            self.files.add(command.split(' mv ')[1].split()[1])
+            return self._stdin_sink(channel)
+        if host == _FRONTEND and _FANOUT_HELPER in command:
+            return self._fanout(command, channel)
+        status, stdout, stderr = self._result(host, command)
+        self._send(channel, stdout, stderr)
+        return status
+
+    def _result(self, host, command):
+        """Return exit status, stdout and stderr of command on host."""
+        if command.startswith('test '):
+            # No file is kept, so no remote digest check succeeds
+            return 1, '', ''
+        if host != _FRONTEND and self.random.random() < self.failure_rate:
+            self.stats['failed_commands'] += 1
+            return 1, '', 'simulated failure\n'
+        if command == 'uptime':
+            return 0, _UPTIME, ''
+        return 0, '{}: {}\n'.format(host, command), ''
+
+    def _send(self, channel, stdout, stderr=''):
+        self.stats['bytes_sent'] += len(stdout) + len(stderr)
+        if stdout:
+            channel.sendall(stdout)
+        if stderr:
+            channel.sendall_stderr(stderr)
+
+    def _fanout(self, command, channel):
+        """Pretend to run the fan-out helper, nodes being close by."""
+        helper, request = command.split()[-2:]
+        if helper not in self.files:
+            return _HELPER_MISSING
+        request = json.loads(base64.urlsafe_b64decode(
+            request.encode('ascii')).decode('utf-8'))
+
+        def _node(node):
+            start = time.time()
+            if self.booted(node):
+                self.stats['node_connections'] += 1
+                self.stats['commands'] += 1
+                status, stdout, stderr = self._result(node,
+                                                      request['command'])
+            else:
+                self.stats['refused_connections'] += 1
+                status, stdout, stderr = None, '', ''
+            line = {'host': node, 'exit_code': status,
+                    'duration': round(time.time() - start, 3)}
+            if request['capture']:
+                line.update(stdout=stdout, stderr=stderr)
+            self._send(channel, json.dumps(line) + '\n')
+
+        gevent.pool.Pool(request['parallel']).map(_node, request['nodes'])
+        return 0
+
+    def _scp_sink(self, channel):
+        """Receive files sent by scp, return the scp exit status."""
+        reader = channel.makefile('rb')
+        channel.sendall(b'\0')
+        while True:
+            line = reader.readline()
+            if not line:
+                return 0
+            if line[:1] == b'C':
+                channel.sendall(b'\0')
+                # File data is followed by a null byte
+                remaining = int(line.split()[1]) + 1
+                while remaining:
+                    data = reader.read(min(remaining, _CHUNK_SIZE))
+                    if not data:
+                        return 1
+                    remaining -= len(data)
+                    self._receive(len(data))
+            channel.sendall(b'\0')
+
+    def _stdin_sink(self, channel):
+        """Receive standard input until its end, return exit status 0."""
+        while True:
+            data = channel.recv(_CHUNK_SIZE)
+            if not data:
+                return 0
+            self._receive(len(data))
+
+    def _receive(self, size):
+        """Account size bytes received, throttled to bandwidth."""
+        self.stats['bytes_received'] += size
+        if self.bandwidth:
+            gevent.sleep(float(size) / self.bandwidth)
+
+
+class _Tunnel(object):  # pylint:disable=too-few-public-methods
+    """Channel carrying a node connection, as its socket.
+
+    Clients may close the frontend connection before the node one ends,
+    closing the channel then fails.
+    """
+
+    def __init__(self, channel):
+        self._channel = channel
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+    def close(self):
+        """Close the channel unless its connection is already closed."""
+        try:
+            self._channel.close()
+        except EOFError:
+            pass
+
+
+class _Server(paramiko.ServerInterface):
+    """Accept any public key, sessions and tunnels to booted nodes."""
+
+    def __init__(self, topology, host):
+        self.topology = topology
+        self.host = host
+        self.tunnels = {}
+
+    def get_allowed_auths(self, username):
+        return 'publickey'
+
+    def check_auth_publickey(self, username, key):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        if kind == 'session':
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_direct_tcpip_request(self, chanid, origin,
+                                           destination):
+        if self.host != _FRONTEND:
+            return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+        node = destination[0]
+        if not self.topology.booted(node):
+            self.topology.stats['refused_connections'] += 1
+            return paramiko.OPEN_FAILED_CONNECT_FAILED
+        self.tunnels[chanid] = node
+        return paramiko.OPEN_SUCCEEDED
+
+    # pylint:disable=too-many-arguments
+    def check_channel_pty_request(self, channel, term, width, height,
+                                  pixelwidth, pixelheight, modes):
+        return True
+
+    def check_channel_exec_request(self, channel, command):
+        command = _unwrap(command.decode('utf-8'))
+        gevent.spawn(self._exec, channel, command)
+        return True
+
+    def _exec(self, channel, command):
+        """Run command on channel and close it."""
+        status = self.topology.run(self.host, command, channel)
+        channel.send_exit_status(status)
+        channel.close()
+
+
+def parse_args(args=None):
+    """Parse command line arguments."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sites', type=int, default=1,
+                        help='number of sites, each with its own frontend')
+    parser.add_argument('--port', type=int, default=0,
+                        help='listening port, any free port by default')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='seconds added to each connection and command')
+    parser.add_argument('--bandwidth', type=float, default=None,
+                        help='bytes per second of each copy, unlimited '
+                             'by default')
+    parser.add_argument('--failure-rate', type=float, default=0,
+                        help='probability of a node command to fail')
+    parser.add_argument('--boot-delay', type=float, default=0,
+                        help='seconds after which all nodes are booted')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='random seed, for reproducible failures')
+    parser.add_argument('--max-startups', type=int, default=None,
+                        help='reset frontend connections beyond this '
+                             'number of connections being negotiated')
+    return parser.parse_args(args)
+
+
+def main(args=None):
+    """Serve the fake topology until terminated."""
+    opts = parse_args(args)
+    # Probes and closed tunnels make paramiko log errors
+    logging.getLogger('paramiko').setLevel(logging.CRITICAL)
+
+    topology = Topology(opts.latency, opts.bandwidth, opts.failure_rate,
+                        opts.boot_delay, opts.seed, opts.max_startups)
+    servers = []
+    port = opts.port
+    for site in range(1, opts.sites + 1):
+        # Frontends share the port of the first one
+        server = StreamServer((_FRONTEND_ADDRESS.format(site), port),
+                              lambda sock, _: topology.serve(sock))
+        server.start()
+        port = server.server_port
+        servers.append(server)
+
+    stopped = Event()
+    signal_handler(signal.SIGTERM, stopped.set)
+    signal_handler(signal.SIGINT, stopped.set)
+    print(json.dumps({'frontend': _FRONTEND_ADDRESS, 'port': port}))
+    sys.stdout.flush()
+
+    stopped.wait()
+    for server in servers:
+        server.stop()
+    print(json.dumps(topology.stats, sort_keys=True))
+    sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
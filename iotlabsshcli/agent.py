@@ -0,0 +1,101 @@
+# -*- coding:utf-8 -*-
+"""iotlabsshcli agent keeping SSH connections open between commands."""
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import os
+import json
+import time
+
+import gevent
+from gevent import socket
+from gevent.server import StreamServer
+
+from iotlabsshcli.agent_client import DEFAULT_IDLE_TIMEOUT
+from iotlabsshcli.commands import parse_step
+from iotlabsshcli.plan import run_step
+from iotlabsshcli.sshlib.pool import ConnectionPool
+
+
+class Agent(object):
+    """Run commands received on a Unix socket over shared connections.
+
+    Requests and responses are one JSON line each. A request gives the
+    'config_ssh', 'nodes' and 'step' to run, as in plan files, the
+    response its 'result' or an 'error' message.
+    The agent stops once idle for `idle_timeout` seconds.
+    """
+
+    def __init__(self, path, idle_timeout=DEFAULT_IDLE_TIMEOUT):
+        self.path = path
+        self.idle_timeout = idle_timeout
+        self.connections = ConnectionPool(max_idle=idle_timeout)
+        self.last_request = time.time()
+        self.running = 0
+
+    def serve(self):
+        """Serve requests until idle for idle_timeout seconds."""
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        listener.bind(self.path)
+        os.chmod(self.path, 0o600)
+        listener.listen(128)
+        server = StreamServer(listener, self.handle)
+        server.start()
+        try:
+            while self.running or not self.idle():
+                gevent.sleep(min(1, self.idle_timeout))
+        finally:
+            server.stop()
+            self.connections.close()
+            os.remove(self.path)
+
+    def idle(self):
+        """Return True if no request came for idle_timeout seconds."""
+        return time.time() - self.last_request > self.idle_timeout
+
+    def handle(self, sock, _):
+        """Answer one request."""
+        self.running += 1
+        try:
+            rfile = sock.makefile('rb')
+            line = rfile.readline()
+            rfile.close()
+            try:
+                request = json.loads(line.decode('utf-8'))
+                response = {'result': self.execute(request)}
+            except Exception as exc:  # pylint:disable=broad-except
+                response = {'error': '{}: {}'.format(type(exc).__name__,
+                                                     exc)}
+            sock.sendall((json.dumps(response) + '\n').encode('utf-8'))
+        finally:
+            self.running -= 1
+            self.last_request = time.time()
+            sock.close()
+
+    def execute(self, request):
+        """Run the step of request."""
+        command, kwargs = parse_step(request['step'])
+        return run_step(request['config_ssh'], request['nodes'], command,
+                        kwargs, connections=self.connections)
@@ -0,0 +1,72 @@
+# -*- coding:utf-8 -*-
+"""iotlabsshcli client forwarding commands to a local agent."""
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import os
+import json
+import socket
+
+from iotlabsshcli.cache import cache_path
+
+# Seconds without command after which the agent stops
+DEFAULT_IDLE_TIMEOUT = 600
+
+
+def agent_path(user):
+    """Return the Unix socket path of the agent of user."""
+    return cache_path('agent-{}.sock'.format(user))
+
+
+def send(path, request):
+    """Send request to the agent listening on path, return its response.
+
+    Return None if no agent listens on path.
+    """
+    if not os.path.exists(path):
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        try:
+            sock.connect(path)
+        except socket.error:
+            # Stale socket of a stopped agent
+            return None
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        chunks = []
+        for chunk in iter(lambda: sock.recv(65536), b''):
+            chunks.append(chunk)
+    finally:
+        sock.close()
+    return json.loads(b''.join(chunks).decode('utf-8'))
+
+
+def forward(path, config_ssh, nodes, step):
+    """Run step on nodes through the agent listening on path.
+
+    Return the command result or None if no agent listens on path.
+    """
+    response = send(path, {'config_ssh': config_ssh, 'nodes': nodes,
+                           'step': step})
+    if response is None:
+        return None
+    if 'error' in response:
+        raise RuntimeError('Agent: {}'.format(response['error']))
+    return response['result']
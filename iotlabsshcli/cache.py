@@ -0,0 +1,215 @@
+# -*- coding:utf-8 -*-
+"""iotlabsshcli local cache of data known about the testbed."""
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import os
+import json
+import time
+import hashlib
+import tempfile
+
+CACHE_DIR = os.environ.get(
+    'IOTLABSSHCLI_CACHE',
+    os.path.join(os.path.expanduser('~'), '.cache', 'iotlabsshcli'))
+# Seconds experiment information is used without asking the REST API
+DEFAULT_EXPERIMENT_TTL = 300
+# Seconds uploaded files are known to be on the frontends without checking
+DEFAULT_UPLOAD_TTL = 60
+
+
+def cache_path(*names):
+    """Return path of names in the cache directory."""
+    return os.path.join(CACHE_DIR, *names)
+
+
+def read_json(path, default=None):
+    """Return content of JSON file or default if missing or corrupted."""
+    try:
+        with open(path) as json_fd:
+            return json.load(json_fd)
+    except (IOError, OSError, ValueError):
+        return default
+
+
+def write_json(path, data):
+    """Atomically replace path content with data as JSON."""
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(tmp_fd, 'w') as json_fd:
+            json.dump(data, json_fd, sort_keys=True)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def file_digest(path, block_size=65536):
+    """Return sha256 hex digest of file content."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file_fd:
+        for block in iter(lambda: file_fd.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+class UploadCache(object):
+    """Digests of the files uploaded on the frontends by a user.
+
+    Local digests are computed once per file, the manifest records the
+    files known to be on each frontend so they are not checked again for
+    `ttl` seconds. Remote paths are in the home directory of the user,
+    shared by all their experiments and machines, so entries expire.
+    """
+
+    def __init__(self, user, ttl=DEFAULT_UPLOAD_TTL):
+        self.path = cache_path('uploads', '{}.json'.format(user))
+        self.ttl = ttl
+        self._digests = {}
+        self._manifest = None
+
+    def digest(self, src):
+        """Return the digest of the local file src."""
+        if src not in self._digests:
+            self._digests[src] = file_digest(src)
+        return self._digests[src]
+
+    @property
+    def manifest(self):
+        """Digests of files with their time per frontend and remote path."""
+        if self._manifest is None:
+            self._manifest = read_json(self.path, {})
+        return self._manifest
+
+    def is_fresh(self, frontend, dst, digest):
+        """Return True if dst was known to have digest on frontend less
+        than ttl seconds ago."""
+        entry = self.manifest.get(frontend, {}).get(dst)
+        return (isinstance(entry, dict) and entry['digest'] == digest and
+                time.time() - entry['time'] <= self.ttl)
+
+    def add(self, frontend, dst, digest):
+        """Record dst has digest on frontend, now."""
+        if self.is_fresh(frontend, dst, digest):
+            return
+        self.manifest.setdefault(frontend, {})[dst] = {
+            'digest': digest, 'time': time.time()}
+        write_json(self.path, self.manifest)
+
+
+class FirmwareState(object):
+    """Digests of the firmwares flashed on the M3 of the nodes of an
+    experiment.
+
+    Nodes are recorded once flashed successfully, and forgotten when a
+    flash fails as the content of their M3 is then unknown. Records only
+    label skipped nodes, the marker on the nodes decides what is flashed.
+    """
+
+    def __init__(self, exp_id):
+        self.path = cache_path('flashed', '{}.json'.format(exp_id))
+        self._nodes = None
+
+    @property
+    def nodes(self):
+        """Digest of the firmware flashed per node."""
+        if self._nodes is None:
+            self._nodes = read_json(self.path, {})
+        return self._nodes
+
+    def is_flashed(self, node, digest):
+        """Return True if node is known to have the firmware digest."""
+        return self.nodes.get(node) == digest
+
+    def update(self, flashed, failed, digest):
+        """Record nodes flashed with digest, forget the failed ones."""
+        nodes = dict(self.nodes)
+        nodes.update((node, digest) for node in flashed)
+        for node in failed:
+            nodes.pop(node, None)
+        if nodes != self.nodes:
+            self._nodes = nodes
+            write_json(self.path, nodes)
+
+
+class ExperimentCache(object):
+    """Current experiment id and nodes of experiments of a user.
+
+    Entries older than `ttl` seconds are ignored, `forget` drops one entry
+    and `invalidate` all entries of the user.
+    """
+
+    def __init__(self, user, ttl=DEFAULT_EXPERIMENT_TTL):
+        self.path = cache_path('experiments', '{}.json'.format(user))
+        self.ttl = ttl
+        self._entries = None
+
+    @property
+    def entries(self):
+        """Cached values with their time, per key."""
+        if self._entries is None:
+            self._entries = read_json(self.path, {})
+        return self._entries
+
+    def get(self, key):
+        """Return value of key if not expired, else None."""
+        entry = self.entries.get(key)
+        if entry is None or time.time() - entry['time'] > self.ttl:
+            return None
+        return entry['value']
+
+    def set(self, key, value):
+        """Store value of key."""
+        self.entries[key] = {'value': value, 'time': time.time()}
+        write_json(self.path, self.entries)
+
+    def forget(self, key):
+        """Drop entry of key."""
+        if self.entries.pop(key, None) is not None:
+            write_json(self.path, self.entries)
+
+    def invalidate(self):
+        """Drop all entries."""
+        self._entries = {}
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def current_experiment(self):
+        """Return cached id of the running experiment or None."""
+        return self.get('current')
+
+    def set_current_experiment(self, exp_id):
+        """Store id of the running experiment."""
+        self.set('current', exp_id)
+
+    def forget_current_experiment(self):
+        """Drop id of the running experiment, which may have ended."""
+        self.forget('current')
+
+    def nodes(self, exp_id):
+        """Return cached nodes of experiment exp_id or None."""
+        return self.get('nodes/{}'.format(exp_id))
+
+    def set_nodes(self, exp_id, nodes):
+        """Store nodes of experiment exp_id."""
+        self.set('nodes/{}'.format(exp_id), nodes)
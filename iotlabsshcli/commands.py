@@ -0,0 +1,76 @@
+# -*- coding:utf-8 -*-
+"""iotlabsshcli commands arguments, shared by plan files and the agent."""
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import os.path
+
+# Required and optional keys of steps per command, named after the
+# command line arguments
+STEPS = {
+    'flash-m3': (('firmware',), ('compact', 'force')),
+    'reset-m3': ((), ()),
+    'wait-for-boot': ((), ('max_wait',)),
+    'run-script': (('script',), ('frontend',)),
+    'run-cmd': (('cmd',), ('frontend', 'capture', 'capture_dir')),
+    'copy-file': (('file_path',), ('delta',)),
+}
+# Step keys differing from the open_a8 functions arguments
+_STEP_ARGS = {'frontend': 'run_on_frontend', 'capture': 'capture_size'}
+# Step keys holding local paths
+_PATH_KEYS = ('firmware', 'script', 'file_path', 'capture_dir')
+
+
+def parse_step(step):
+    """Return (command, open_a8 function kwargs) of a step.
+
+    >>> parse_step({'command': 'run-cmd', 'cmd': 'ls', 'frontend': True})
+    ('run-cmd', {'cmd': 'ls', 'run_on_frontend': True})
+    >>> parse_step({'command': 'uname'})
+    Traceback (most recent call last):
+    ...
+    ValueError: Invalid step {'command': 'uname'}
+    >>> parse_step({'command': 'flash-m3'})  # doctest: +ELLIPSIS
+    Traceback (most recent call last):
+    ...
+    ValueError: Invalid flash-m3 step, requires ['firmware'], accepts [...]
+    """
+    if not isinstance(step, dict) or step.get('command') not in STEPS:
+        raise ValueError('Invalid step {}'.format(step))
+    required, optional = STEPS[step['command']]
+    keys = set(step) - set(['command'])
+    if not set(required) <= keys or keys - set(required + optional):
+        raise ValueError('Invalid {} step, requires {}, accepts {}'.format(
+            step['command'], list(required), list(optional)))
+    kwargs = dict((_STEP_ARGS.get(key, key), value)
+                  for key, value in step.items() if key != 'command')
+    return step['command'], kwargs
+
+
+def step_from_opts(opts):
+    """Return the step of a parsed command line, with absolute paths."""
+    required, optional = STEPS[opts.command]
+    step = {'command': opts.command}
+    for key in required + optional:
+        value = getattr(opts, key)
+        if key in _PATH_KEYS and value is not None:
+            value = os.path.abspath(value)
+        step[key] = value
+    return step
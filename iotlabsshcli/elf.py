@@ -0,0 +1,152 @@
+# -*- coding:utf-8 -*-
+"""iotlabsshcli compaction of firmware ELF files before upload."""
+
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import os
+import shutil
+import struct
+import tempfile
+
+from .cache import cache_path, file_digest
+
+_ELF_MAGIC = b'\x7fELF'
+# ELF header and program header layouts per EI_CLASS, 32 or 64 bits
+_HEADER = {1: '16sHHIIIIIHHHHHH', 2: '16sHHIQQQIHHHHHH'}
+_PROGRAM_HEADER = {1: 'IIIIIIII', 2: 'IIQQQQQQ'}
+_ENDIAN = {1: '<', 2: '>'}
+_PT_LOAD = 1
+# Alignment of segments in the file, the ELF one is for paging loaders
+_SEGMENT_ALIGN = 4
+
+
+class _Segment(object):  # pylint:disable=too-few-public-methods
+    """Loadable segment of an ELF file, with its content."""
+
+    def __init__(self, elf_class, fields, data):
+        if elf_class == 1:
+            (self.type, self.offset, self.vaddr, self.paddr, self.filesz,
+             self.memsz, self.flags, self.align) = fields
+        else:
+            (self.type, self.flags, self.offset, self.vaddr, self.paddr,
+             self.filesz, self.memsz, self.align) = fields
+        self.data = data[self.offset:self.offset + self.filesz]
+
+    def pack(self, elf_class, endian):
+        """Return the program header of the segment."""
+        if elf_class == 1:
+            fields = (self.type, self.offset, self.vaddr, self.paddr,
+                      self.filesz, self.memsz, self.flags, self.align)
+        else:
+            fields = (self.type, self.flags, self.offset, self.vaddr,
+                      self.paddr, self.filesz, self.memsz, self.align)
+        return struct.pack(endian + _PROGRAM_HEADER[elf_class], *fields)
+
+
+def _read(data):
+    """Return ELF class, endianness, header fields and loadable segments."""
+    if data[:4] != _ELF_MAGIC or len(data) < 6:
+        raise ValueError('Not an ELF file')
+    elf_class, encoding = bytearray(data[4:6])
+    if elf_class not in _HEADER or encoding not in _ENDIAN:
+        raise ValueError('Unsupported ELF class or encoding')
+    endian = _ENDIAN[encoding]
+    header_fmt = endian + _HEADER[elf_class]
+    header = list(struct.unpack_from(header_fmt, data))
+    phoff, phentsize, phnum = header[5], header[9], header[10]
+    segments = []
+    for index in range(phnum):
+        fields = struct.unpack_from(endian + _PROGRAM_HEADER[elf_class],
+                                    data, phoff + index * phentsize)
+        if fields[0] == _PT_LOAD:
+            segments.append(_Segment(elf_class, fields, data))
+    return elf_class, endian, header, segments
+
+
+def compact(data):
+    """Return ELF data with only its loadable segments.
+
+    Sections, symbols and debug information are dropped, segments keep
+    their addresses and content: a flasher loading segments writes the
+    same bytes. Raise ValueError if data is not an ELF file.
+    """
+    elf_class, endian, header, segments = _read(data)
+    header_size = struct.calcsize(endian + _HEADER[elf_class])
+    phentsize = struct.calcsize(endian + _PROGRAM_HEADER[elf_class])
+    offset = header_size + phentsize * len(segments)
+    for segment in segments:
+        if segment.align > 1:
+            segment.align = min(segment.align, _SEGMENT_ALIGN)
+            # File offset and address stay congruent modulo alignment
+            offset += (segment.vaddr - offset) % segment.align
+        segment.offset = offset
+        offset += segment.filesz
+
+    # No section headers: e_shoff, e_shentsize, e_shnum and e_shstrndx
+    header[5:7] = [header_size, 0]
+    header[8:14] = [header_size, phentsize, len(segments), 0, 0, 0]
+    out = [struct.pack(endian + _HEADER[elf_class], *header)]
+    out.extend(segment.pack(elf_class, endian) for segment in segments)
+    position = header_size + phentsize * len(segments)
+    for segment in segments:
+        out.append(b'\0' * (segment.offset - position))
+        out.append(segment.data)
+        position = segment.offset + segment.filesz
+    return b''.join(out)
+
+
+def segments(data):
+    """Return (address, content) of the loadable segments of ELF data."""
+    return [(segment.paddr, segment.data) for segment in _read(data)[3]]
+
+
+def compact_firmware(path):
+    """Return the path of the compacted copy of firmware path.
+
+    Copies are cached by digest of the source, with the same file name.
+    Files that are not ELF, or that no compaction makes smaller, are
+    returned as is.
+    """
+    dst = cache_path('firmwares', file_digest(path), os.path.basename(path))
+    if os.path.exists(dst):
+        return dst
+    with open(path, 'rb') as firmware_fd:
+        data = firmware_fd.read()
+    try:
+        compacted = compact(data)
+    except (ValueError, struct.error):
+        return path
+    if len(compacted) >= len(data):
+        return path
+
+    directory = os.path.dirname(dst)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    tmp_dir = tempfile.mkdtemp(dir=directory)
+    try:
+        tmp_path = os.path.join(tmp_dir, os.path.basename(path))
+        with open(tmp_path, 'wb') as compact_fd:
+            compact_fd.write(compacted)
+        os.rename(tmp_path, dst)
+    finally:
+        shutil.rmtree(tmp_dir)
+    return dst
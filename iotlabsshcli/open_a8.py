@@ -1,5 +1,14 @@
 # -*- coding:utf-8 -*-
-"""iotlabsshcli parser for Open A8 cli."""
+"""iotlabsshcli parser for Open A8 cli.
+
+Commands give the final exit code of each host to their optional
+`on_host(host, exit_code)` callback as soon as it is known, before
+returning the result of all hosts.
+
+Commands take the nodes of several experiments as a dict of nodes per
+experiment id. They run once on all of them, sharing connections and
+limits per site, and return their result per experiment id.
+"""
 
 # This file is a part of IoT-LAB ssh-cli-tools
 # Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
@@ -22,10 +31,15 @@
 
 from __future__ import print_function
 
+import functools
 import os.path
 
 from collections import OrderedDict
-from iotlabsshcli.sshlib import OpenA8Ssh, OpenA8SshAuthenticationException
+from iotlabsshcli.cache import UploadCache, FirmwareState
+from iotlabsshcli.elf import compact_firmware
+from iotlabsshcli.sshlib import get_backend, OpenA8SshAuthenticationException
+from iotlabsshcli.sshlib import Pipeline
+from iotlabsshcli.sshlib import OutputCapture, DEFAULT_CAPTURE_SIZE
 
 
 def _nodes_grouped(nodes):
@@ -53,149 +67,345 @@ def _nodes_grouped(nodes):
     return result
 
 
+def _ssh(config_ssh, groups, **kwargs):
+    """Return the SSH backend of config_ssh 'backend' for groups."""
+    backend = get_backend(config_ssh.get('backend'))
+    return backend(config_ssh, groups, **kwargs)
+
+
+def _on_ready(on_host):
+    """Return the boot callback giving booted nodes to on_host, if any."""
+    if on_host is None:
+        return None
+    return lambda node, latency: on_host(node, 0)
+
+
+def _experiments(config_ssh, nodes):
+    """Return nodes per experiment id, from config_ssh 'experiments' when
+    run on several experiments.
+    """
+    return (config_ssh.get('experiments') or
+            OrderedDict([(config_ssh['exp_id'], nodes)]))
+
+
+def _hosts_of(config_ssh, nodes):
+    """Return nodes and the frontends of their sites.
+
+    >>> sorted(_hosts_of({}, ['node-a8-1.lille.iot-lab.info']))
+    ['lille.iot-lab.info', 'node-a8-1.lille.iot-lab.info']
+    """
+    frontend = config_ssh.get('frontend', '{}.iot-lab.info')
+    return set(nodes) | set(frontend.format(site)
+                            for site in _nodes_grouped(nodes))
+
+
+def _split_result(result, hosts):
+    """Return the entries of a command result about hosts.
+
+    Timings, measured on all hosts together, are kept whole.
+
+    >>> sorted(_split_result({'0': ['node-1', 'node-2'], '1': ['node-3'],
+    ...                       'latency': {'node-1': 1.5, 'node-3': 2.0}},
+    ...                      set(['node-1', 'node-4'])).items())
+    [('0', ['node-1']), ('latency', {'node-1': 1.5})]
+    """
+    split = {}
+    for name, values in result.items():
+        if name == 'timings':
+            split[name] = values
+            continue
+        if isinstance(values, dict):
+            values = dict((host, value) for host, value in values.items()
+                          if host in hosts)
+        else:
+            values = [host for host in values if host in hosts]
+        if values:
+            split[name] = values
+    return split
+
+
+def _per_experiment(command):
+    """Let command run on nodes given per experiment id.
+
+    Command runs once on the nodes of all experiments, its result being
+    split per experiment id. Experiments share the files uploaded to the
+    frontends.
+    """
+    @functools.wraps(command)
+    def _command(config_ssh, nodes, *args, **kwargs):
+        if not isinstance(nodes, dict):
+            return command(config_ssh, nodes, *args, **kwargs)
+        config_ssh = dict(config_ssh, exp_id=next(iter(nodes)),
+                          experiments=nodes)
+        result = command(config_ssh,
+                         [node for exp_nodes in nodes.values()
+                          for node in exp_nodes],
+                         *args, **kwargs)
+        return OrderedDict(
+            (exp_id, dict((name, _split_result(
+                values, _hosts_of(config_ssh, exp_nodes)))
+                for name, values in result.items()))
+            for exp_id, exp_nodes in nodes.items())
+    return _command
+
+
 _MKDIR_DST_CMD = 'mkdir -p {}'
 _UPDATE_M3_CMD = 'source /etc/profile && /usr/bin/flash_a8_m3 {}'
-_RESET_M3_CMD = 'source /etc/profile && /usr/bin/reset_a8_m3'
+# Digest of the firmware last flashed by flash_m3, lost on node reboot
+_M3_MARKER = '/tmp/iotlabsshcli_m3_firmware'
+# Marker is removed before flashing and only written once flash succeeded
+_FLASH_M3_CMD = 'rm -f {marker}; {update} && echo {digest} > {marker}'
+_SKIPPED_M3 = 'M3 firmware already flashed'
+_SKIP_M3_CMD = ('if grep -qsx {digest} {marker}; then echo {skipped}; '
+                'else {flash}; fi')
+_RESET_M3_CMD = ('rm -f {}; source /etc/profile && /usr/bin/reset_a8_m3'
+                 .format(_M3_MARKER))
 _MAKE_EXECUTABLE_CMD = 'chmod +x {}'
 _RUN_SCRIPT_CMD = 'screen -S {screen} -dm bash -c \"{path}\"'
 _QUIT_SCRIPT_CMD = 'screen -X -S {screen} quit'
 
 
-def flash_m3(config_ssh, nodes, firmware, verbose=False):
-    """Flash the firmware of M3 of open A8 nodes."""
+def _flash_m3_cmd(remote_fw, digest, force=False):
+    """Return the command flashing remote_fw and recording its digest.
+
+    Unless forced, nodes already recording digest print _SKIPPED_M3
+    instead.
+    """
+    flash = _FLASH_M3_CMD.format(marker=_M3_MARKER, digest=digest,
+                                 update=_UPDATE_M3_CMD.format(remote_fw))
+    if force:
+        return flash
+    return _SKIP_M3_CMD.format(marker=_M3_MARKER, digest=digest,
+                               skipped=_SKIPPED_M3, flash=flash)
+
+
+def _skipped_on_node(hosts, capture):
+    """Return the hosts of which captured output is _SKIPPED_M3."""
+    output = capture.result()
+    return [host for host in hosts
+            if output.get(host, {}).get('stdout', '').strip() == _SKIPPED_M3]
+
+
+# pylint: disable=too-many-arguments,too-many-locals
+@_per_experiment
+def flash_m3(config_ssh, nodes, firmware, compact=False, force=False,
+             verbose=False, connections=None, timings=False, on_host=None):
+    """Flash the firmware of M3 of open A8 nodes.
+
+    With compact, only the loadable segments of the firmware ELF are
+    uploaded and flashed, which is what ends up on the M3.
+
+    Nodes whose marker shows they already carry the same firmware are
+    not flashed again unless forced. They are given in 'skipped' instead
+    of '0', with 'local' if the firmware was also recorded locally for
+    the experiment, 'node' otherwise. This label is informational only,
+    the node marker alone decides whether a node is flashed.
+    """
     # Configure ssh and remote firmware names.
-    groups = _nodes_grouped(nodes)
-    ssh = OpenA8Ssh(config_ssh, groups, verbose=verbose)
+    if compact:
+        firmware = compact_firmware(firmware)
     remote_fw = os.path.join('~/A8/.iotlabsshcli', os.path.basename(firmware))
-
-    # Create firmware destination directory
-    try:
-        ssh.run(_MKDIR_DST_CMD.format(os.path.dirname(remote_fw)),
-                with_proxy=False)
-    except OpenA8SshAuthenticationException as exc:
-        print(exc.msg)
-        result = {"1": nodes}
-    else:
+    upload_cache = UploadCache(config_ssh['user'])
+    digest = upload_cache.digest(firmware)
+    states = [(FirmwareState(exp_id), exp_nodes) for exp_id, exp_nodes
+              in _experiments(config_ssh, nodes).items()]
+    # Output of skipped nodes is only _SKIPPED_M3
+    capture = OutputCapture(max_bytes=2 * len(_SKIPPED_M3))
+
+    with _ssh(config_ssh, _nodes_grouped(nodes), verbose=verbose,
+              upload_cache=upload_cache, connections=connections,
+              timings=timings) as ssh:
+        pipeline = Pipeline(ssh)
+        # Create firmware destination directory
+        pipeline.run(_MKDIR_DST_CMD.format(os.path.dirname(remote_fw)),
+                     with_proxy=False)
         # Copy firmware on sites.
-        ssh.scp(firmware, remote_fw)
-
-        # Run firmware update.
-        result = ssh.run(_UPDATE_M3_CMD.format(remote_fw))
-
+        pipeline.upload(firmware, remote_fw)
+        # Run firmware update, unless the node marker shows it is done.
+        pipeline.run(_flash_m3_cmd(remote_fw, digest, force),
+                     capture=capture)
+        try:
+            result = pipeline.execute(on_host)
+        except OpenA8SshAuthenticationException as exc:
+            print(exc.msg)
+            result = {"1": nodes}
+
+    flashed = result.pop('0', [])
+    skipped = OrderedDict((node, 'node')
+                          for node in _skipped_on_node(flashed, capture))
+    flashed = [node for node in flashed if node not in skipped]
+    for state, exp_nodes in states:
+        exp_nodes = set(exp_nodes)
+        # Local records are only reported once confirmed by the node
+        skipped.update([(node, 'local') for node in skipped
+                        if node in exp_nodes and
+                        state.is_flashed(node, digest)])
+        state.update([node for node in flashed + list(skipped)
+                      if node in exp_nodes],
+                     [node for node in result.get('1', [])
+                      if node in exp_nodes], digest)
+    if flashed:
+        result['0'] = flashed
+    if skipped:
+        result['skipped'] = dict(skipped)
     return {"flash-m3": result}
 
 
-def reset_m3(config_ssh, nodes, verbose=False):
+@_per_experiment
+def reset_m3(config_ssh, nodes, verbose=False, connections=None,
+             timings=False, on_host=None):
     """Reset the M3 of open A8 nodes."""
 
     # Configure ssh.
     groups = _nodes_grouped(nodes)
-    ssh = OpenA8Ssh(config_ssh, groups, verbose=verbose)
 
-    # Run M3 reset command.
-    try:
-        result = ssh.run(_RESET_M3_CMD)
-    except OpenA8SshAuthenticationException as exc:
-        print(exc.msg)
-        result = {"1": nodes}
+    with _ssh(config_ssh, groups, verbose=verbose,
+              connections=connections, timings=timings) as ssh:
+        # Run M3 reset command.
+        try:
+            result = ssh.run(_RESET_M3_CMD, on_host=on_host)
+        except OpenA8SshAuthenticationException as exc:
+            print(exc.msg)
+            result = {"1": nodes}
 
     return {"reset-m3": result}
 
 
-def wait_for_boot(config_ssh, nodes, max_wait=120, verbose=False):
+# pylint: disable=too-many-arguments
+@_per_experiment
+def wait_for_boot(config_ssh, nodes, max_wait=120, verbose=False,
+                  connections=None, timings=False, on_host=None):
     """Reset the M3 of open A8 nodes."""
 
     # Configure ssh.
     groups = _nodes_grouped(nodes)
-    ssh = OpenA8Ssh(config_ssh, groups, verbose=verbose)
 
-    # Wait for A8 boot
-    try:
-        result = ssh.wait(max_wait)
-    except OpenA8SshAuthenticationException as exc:
-        print(exc.msg)
-        result = {"1": nodes}
+    with _ssh(config_ssh, groups, verbose=verbose,
+              connections=connections, timings=timings) as ssh:
+        # Wait for A8 boot
+        try:
+            result = ssh.wait(max_wait, on_ready=_on_ready(on_host))
+        except OpenA8SshAuthenticationException as exc:
+            print(exc.msg)
+            result = {"1": nodes}
 
     return {"wait-for-boot": result}
 
 
-def run_cmd(config_ssh, nodes, cmd, run_on_frontend=False, verbose=False):
-    """ Run a command on the A8 nodes or on the SSH frontend. """
+# pylint: disable=too-many-arguments
+@_per_experiment
+def run_cmd(config_ssh, nodes, cmd, run_on_frontend=False, verbose=False,
+            capture_size=None, capture_dir=None, connections=None,
+            timings=False, on_host=None):
+    """ Run a command on the A8 nodes or on the SSH frontend.
+
+    With capture_size, the last capture_size bytes of output of each host
+    are returned, 0 meaning DEFAULT_CAPTURE_SIZE. With capture_dir, the
+    whole output is also saved there.
+    """
 
     # Configure ssh.
     groups = _nodes_grouped(nodes)
-    ssh = OpenA8Ssh(config_ssh, groups, verbose=verbose)
-    try:
-        result = ssh.run(cmd, with_proxy=not run_on_frontend)
-    except OpenA8SshAuthenticationException as exc:
-        print(exc.msg)
-        result = {"1": nodes}
+    capture = None
+    if capture_size is not None or capture_dir is not None:
+        capture = OutputCapture(capture_size or DEFAULT_CAPTURE_SIZE,
+                                capture_dir)
+
+    with _ssh(config_ssh, groups, verbose=verbose,
+              connections=connections, timings=timings) as ssh:
+        try:
+            result = ssh.run(cmd, with_proxy=not run_on_frontend,
+                             capture=capture, on_host=on_host)
+        except OpenA8SshAuthenticationException as exc:
+            print(exc.msg)
+            result = {"1": nodes}
 
     return {"run-cmd": result}
 
 
-def copy_file(config_ssh, nodes, file_path, verbose=False):
+# pylint: disable=too-many-arguments
+@_per_experiment
+def copy_file(config_ssh, nodes, file_path, delta=False, verbose=False,
+              connections=None, timings=False, on_host=None):
     """ Copy a file on the A8 SSH frontend(s) directory(es)
     (~/A8/.iotlabsshcli/)
+
+    With delta, only the blocks changed since the previous copy are sent.
     """
 
     # Configure ssh.
     groups = _nodes_grouped(nodes)
-    ssh = OpenA8Ssh(config_ssh, groups, verbose=verbose)
     remote_file = os.path.join('~/A8/.iotlabsshcli',
                                os.path.basename(file_path))
-    try:
+    upload_cache = UploadCache(config_ssh['user'])
+
+    with _ssh(config_ssh, groups, verbose=verbose,
+              upload_cache=upload_cache, connections=connections,
+              timings=timings) as ssh:
+        pipeline = Pipeline(ssh)
         # Create file destination directory
-        ssh.run(_MKDIR_DST_CMD.format(os.path.dirname(remote_file)),
-                with_proxy=False)
-    except OpenA8SshAuthenticationException as exc:
-        print(exc.msg)
-        result = {"1": nodes}
-    else:
+        pipeline.run(_MKDIR_DST_CMD.format(os.path.dirname(remote_file)),
+                     with_proxy=False)
         # Copy file on sites.
-        result = ssh.scp(file_path, remote_file)
+        pipeline.upload(file_path, remote_file, delta=delta)
+        try:
+            result = pipeline.execute(on_host)
+        except OpenA8SshAuthenticationException as exc:
+            print(exc.msg)
+            result = {"1": nodes}
 
     return {"copy-file": result}
 
 
+# pylint: disable=too-many-arguments
+@_per_experiment
 def run_script(config_ssh, nodes, script, run_on_frontend=False,
-               verbose=False):
+               verbose=False, connections=None, timings=False,
+               on_host=None):
     """Run a script in background on the A8 nodes
     or on the SSH frontend
+
+    Each experiment runs the script in its own screen session.
     """
 
     # Configure ssh.
     groups = _nodes_grouped(nodes)
-    ssh = OpenA8Ssh(config_ssh, groups, verbose=verbose)
+    experiments = _experiments(config_ssh, nodes)
 
-    screen = '{user}-{exp_id}'.format(**config_ssh)
     remote_script = os.path.join('~/A8/.iotlabsshcli',
                                  os.path.basename(script))
-    script_data = {'screen': screen,
-                   'path': remote_script}
     with_proxy = False
+    upload_cache = UploadCache(config_ssh['user'])
 
-    try:
+    with _ssh(config_ssh, groups, verbose=verbose,
+              upload_cache=upload_cache, connections=connections,
+              timings=timings) as ssh:
+        pipeline = Pipeline(ssh)
         # Create destination directory
-        ssh.run(_MKDIR_DST_CMD.format(os.path.dirname(remote_script)),
-                with_proxy=with_proxy)
-    except OpenA8SshAuthenticationException as exc:
-        print(exc.msg)
-        result = {"1": nodes}
-    else:
+        pipeline.run(_MKDIR_DST_CMD.format(os.path.dirname(remote_script)),
+                     with_proxy=with_proxy)
         # Copy script on sites.
-        ssh.scp(script, remote_script)
-
+        pipeline.upload(script, remote_script)
         # Make script executable
-        ssh.run(_MAKE_EXECUTABLE_CMD.format(remote_script),
-                with_proxy=with_proxy)
-
-        # Kill any running script
-        ssh.run(_QUIT_SCRIPT_CMD.format(**script_data),
-                with_proxy=not run_on_frontend)
-
-        # Run script
-        result = ssh.run(_RUN_SCRIPT_CMD.format(**script_data),
-                         with_proxy=not run_on_frontend, use_pty=False)
+        pipeline.run(_MAKE_EXECUTABLE_CMD.format(remote_script),
+                     with_proxy=with_proxy)
+        for exp_id, exp_nodes in experiments.items():
+            script_data = {'screen': '{}-{}'.format(config_ssh['user'],
+                                                    exp_id),
+                           'path': remote_script}
+            hosts = exp_nodes if len(experiments) > 1 else None
+            # Kill any running script
+            pipeline.run(_QUIT_SCRIPT_CMD.format(**script_data),
+                         with_proxy=not run_on_frontend, check=False,
+                         hosts=hosts, use_pty=False)
+            # Run script
+            pipeline.run(_RUN_SCRIPT_CMD.format(**script_data),
+                         with_proxy=not run_on_frontend, hosts=hosts,
+                         use_pty=False)
+        try:
+            result = pipeline.execute(on_host)
+        except OpenA8SshAuthenticationException as exc:
+            print(exc.msg)
+            result = {"1": nodes}
 
     return {"run-script": result}
@@ -23,12 +23,18 @@
 
 import sys
 import argparse
+import threading
+from collections import OrderedDict
 from iotlabcli import auth
 from iotlabcli import helpers
 from iotlabcli import rest
 from iotlabcli.parser import common
 from iotlabcli.parser.common import _get_experiment_nodes_list
-import iotlabsshcli.open_a8
+import iotlabsshcli
+from iotlabsshcli.cache import ExperimentCache, DEFAULT_EXPERIMENT_TTL
+from iotlabsshcli.commands import STEPS, step_from_opts
+from iotlabsshcli.stream import NodeStream, dumps
+from iotlabsshcli import agent_client
 
 
 def parse_options():
@@ -44,8 +50,41 @@ def parse_options():
         parents=[parent_parser],
     )
 
-    common.add_expid_arg(parser)
+    parser.add_argument('-i', '--id', dest='experiment_id', type=int,
+                        action='append',
+                        help='experiment id submission, repeat it to run '
+                             'the command on several experiments at once')
     common.add_output_formatter(parser)
+    parser.add_argument('--cache-ttl', metavar='SECONDS', type=int,
+                        default=DEFAULT_EXPERIMENT_TTL,
+                        help='Reuse experiment id and nodes fetched less '
+                             'than SECONDS ago (default %(default)s)')
+    parser.add_argument('--refresh-cache', action='store_true',
+                        help='Fetch experiment id and nodes again')
+    parser.add_argument('--no-agent', action='store_true',
+                        help='Run commands in this process even if an '
+                             'agent is running')
+    parser.add_argument('--backend', choices=('pssh', 'asyncio'),
+                        help='SSH library running the commands (default '
+                             'IOTLABSSHCLI_BACKEND or pssh), asyncio '
+                             'requires asyncssh')
+    parser.add_argument('--fanout', action='store_true',
+                        help='Run node commands from the frontends, with '
+                             'a helper copied there')
+    parser.add_argument('--compress', action='store_true',
+                        help='Copy files compressed when it shrinks them, '
+                             'decompressed and checked on the frontends')
+    parser.add_argument('--retry', metavar='ATTEMPTS', type=int,
+                        help='Attempt failed hosts again, up to ATTEMPTS '
+                             'times in all')
+    parser.add_argument('--retry-on', choices=('connection', 'exit'),
+                        action='append',
+                        help='Failures attempted again with --retry, '
+                             'unreachable hosts (connection) by default, '
+                             'non-zero exit codes too with exit')
+    parser.add_argument('--retry-deadline', metavar='SECONDS', type=float,
+                        help='Start no attempt SECONDS after the command '
+                             'started')
 
     subparsers = parser.add_subparsers(dest='command')
     subparsers.required = True  # needed for python 3.
@@ -56,6 +95,13 @@ def parse_options():
                                           help='Flash the M3 firmware of A8 '
                                                'nodes')
     update_parser.add_argument('firmware', help='firmware elf path.')
+    update_parser.add_argument('--compact', action='store_true',
+                               help='Only upload the loadable segments of '
+                                    'the firmware, without debug '
+                                    'information')
+    update_parser.add_argument('--force', action='store_true',
+                               help='Flash nodes already flashed with the '
+                                    'same firmware')
     # nodes list or exclude list
     common.add_nodes_selection_list(update_parser)
 
@@ -96,6 +142,13 @@ def parse_options():
     run_cmd_parser.add_argument('cmd', help='Command')
     run_cmd_parser.add_argument('--frontend', action='store_true',
                                 help='Execution on SSH frontend')
+    run_cmd_parser.add_argument('--capture', metavar='BYTES', type=int,
+                                nargs='?', const=0,
+                                help='Return the last BYTES of output of '
+                                     'each node (default 64 KiB)')
+    run_cmd_parser.add_argument('--capture-dir', metavar='DIR',
+                                help='Save the whole output of each node '
+                                     'in DIR (implies --capture)')
     # nodes list or exclude list
     common.add_nodes_selection_list(run_cmd_parser)
 
@@ -106,63 +159,285 @@ def parse_options():
                                                   ' SSH frontend directory'
                                                   ' (~/A8/.iotlabsshcli/)')
     copy_file_parser.add_argument('file_path', help='File path')
+    copy_file_parser.add_argument('--delta', action='store_true',
+                                  help='Only send the blocks changed since '
+                                       'the previous copy')
     # nodes list or exclude list
     common.add_nodes_selection_list(copy_file_parser)
 
+    # plan parser
+    plan_parser = subparsers.add_parser('plan',
+                                        parents=[parent_parser],
+                                        help='Run the steps of a JSON or YAML'
+                                             ' plan file in turn, each on '
+                                             'the nodes successful at the '
+                                             'previous one')
+    plan_parser.add_argument('plan_file', help='Plan file path')
+    # nodes list or exclude list
+    common.add_nodes_selection_list(plan_parser)
+
+    # agent parser
+    agent_parser = subparsers.add_parser('agent',
+                                         parents=[parent_parser],
+                                         help='Run an agent keeping SSH '
+                                              'connections open for the '
+                                              'next commands')
+    agent_parser.add_argument('--idle-timeout', type=int,
+                              default=agent_client.DEFAULT_IDLE_TIMEOUT,
+                              help='Stop after this many seconds without '
+                                   'command (default %(default)s)')
+
     parser.add_argument('--verbose',
                         action='store_true',
                         help='Set verbose output')
+    parser.add_argument('--timings',
+                        action='store_true',
+                        help='Add the duration of each phase per host and '
+                             'per site to the result')
+    parser.add_argument('--stream',
+                        action='store_true',
+                        help='Print a JSON line per host as soon as it is '
+                             'done, then the result on one line')
 
     return parser
 
 
+def command_uses_agent(opts):
+    """Return True if command may be forwarded to an agent.
+
+    Verbose commands run locally to show hosts output, commands with
+    timings to measure them, streamed commands to report hosts as they
+    are done, commands with another backend than the pssh one of the
+    agent, and commands on several experiments.
+    """
+    return opts.command in STEPS and not (
+        opts.no_agent or opts.verbose or opts.timings or opts.stream or
+        opts.backend not in (None, 'pssh') or
+        len(set(opts.experiment_id or [])) > 1)
+
+
 def open_a8_parse_and_run(opts):
     """Parse namespace 'opts' object and execute M3 fw update action."""
     user, passwd = auth.get_user_credentials(opts.username, opts.password)
+    if opts.command == 'agent':
+        # pylint:disable=import-outside-toplevel
+        from iotlabsshcli.agent import Agent
+        Agent(agent_client.agent_path(user), opts.idle_timeout).serve()
+        return {'agent': 'stopped'}
+
     api = rest.Api(user, passwd)
-    exp_id = helpers.get_current_experiment(api, opts.experiment_id)
+    cache = ExperimentCache(user, ttl=opts.cache_ttl)
+    if opts.refresh_cache:
+        cache.invalidate()
+
+    exp_ids = list(OrderedDict.fromkeys(opts.experiment_id or []))
+    if not exp_ids:
+        exp_id = cache.current_experiment()
+        if exp_id is None:
+            exp_id = helpers.get_current_experiment(api, None)
+            cache.set_current_experiment(exp_id)
+        exp_ids = [exp_id]
 
     config_ssh = {
         'user': user,
-        'exp_id': exp_id
+        'exp_id': exp_ids[0]
     }
+    if opts.backend is not None:
+        config_ssh['backend'] = opts.backend
+    if opts.fanout:
+        config_ssh['fanout'] = True
+    if opts.compress:
+        config_ssh['compress'] = True
+    if opts.retry:
+        config_ssh['retry'] = {'max_attempts': opts.retry,
+                               'retry_on': opts.retry_on or ['connection'],
+                               'deadline': opts.retry_deadline}
+
+    experiments = _experiments_nodes(api, cache, exp_ids, opts)
+    # Several experiments are given per experiment id, results too
+    nodes = experiments if len(experiments) > 1 else experiments[exp_ids[0]]
+
+    result = None
+    if command_uses_agent(opts):
+        result = agent_client.forward(agent_client.agent_path(user),
+                                      config_ssh, nodes,
+                                      step_from_opts(opts))
+    if result is None:
+        result = _run_local(opts, config_ssh, nodes)
+    if not opts.experiment_id and _all_hosts_failed(result):
+        # The cached current experiment may have ended since
+        cache.forget_current_experiment()
+    return result
+
+
+def _run_local(opts, config_ssh, nodes):
+    """Run the command of opts in this process, streaming hosts status
+    if asked.
+    """
+    if not opts.stream:
+        return _run_command(opts, config_ssh, nodes)
+    # Hosts are printed as they are done, the result on the last line
+    stream = NodeStream()
+    opts.format = opts.format or dumps
+    result = _run_command(opts, config_ssh, nodes, stream)
+    for exp_result in (result.values() if isinstance(nodes, dict)
+                       else [result]):
+        stream.finish(exp_result)
+    return result
 
+
+def _all_hosts_failed(result):
+    """Return True if hosts failed in the result of a command and none
+    succeeded or was skipped, looking at the first step of plans.
+
+    >>> _all_hosts_failed({'reset-m3': {'1': ['node-a8-1']}})
+    True
+    >>> _all_hosts_failed({'flash-m3': {'1': ['node-a8-1'],
+    ...                                 'skipped': {'node-a8-2': 'node'}}})
+    False
+    >>> _all_hosts_failed({'plan': [{'reset-m3': {'1': ['node-a8-1']}},
+    ...                             {'run-cmd': {}}]})
+    True
+    >>> _all_hosts_failed({'reset-m3': {}})
+    False
+    """
+    for name, status in result.items():
+        if name == 'plan':
+            return bool(status) and _all_hosts_failed(status[0])
+        return (isinstance(status, dict) and bool(status.get('1')) and
+                not (status.get('0') or status.get('skipped')))
+    return False
+
+
+def _concurrently(func, args):
+    """Return [func(arg) for arg in args], called in one thread each.
+
+    The first exception, in args order, is re-raised.
+    """
+    results = [None] * len(args)
+    errors = [None] * len(args)
+
+    def _call(index):
+        try:
+            results[index] = func(args[index])
+        except Exception as err:  # pylint:disable=broad-except
+            errors[index] = err
+
+    threads = [threading.Thread(target=_call, args=(index,))
+               for index in range(len(args))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for error in errors:
+        if error is not None:
+            raise error
+    return results
+
+
+def _experiment_nodes(api, cache, exp_id, opts, several=False):
+    """Return the A8 nodes of experiment exp_id selected by opts, and its
+    nodes if fetched from the REST API.
+
+    On several experiments, nodes given with -l are only kept in the
+    experiment they belong to.
+    """
     nodes = common.list_nodes(api, exp_id, opts.nodes_list,
                               opts.exclude_nodes_list)
-
+    fetched = None
     # Only if nodes_list or exclude_nodes_list is not specify (nodes = [])
-    if not nodes:
-        nodes = _get_experiment_nodes_list(api, exp_id)
+    if not nodes or (several and opts.nodes_list):
+        exp_nodes = cache.nodes(exp_id)
+        if not exp_nodes:
+            exp_nodes = fetched = _get_experiment_nodes_list(api, exp_id)
+        if nodes:
+            exp_nodes = set(exp_nodes)
+            nodes = [node for node in nodes if node in exp_nodes]
+        else:
+            nodes = exp_nodes
 
     # Only keep A8 nodes
-    nodes = ["node-{0}".format(node)
-             for node in nodes if node.startswith('a8')]
+    return (["node-{0}".format(node)
+             for node in nodes if node.startswith('a8')], fetched)
+
+
+def _experiments_nodes(api, cache, exp_ids, opts):
+    """Return A8 nodes per experiment id, experiments being resolved
+    concurrently.
+    """
+    if len(exp_ids) == 1:
+        resolved = [_experiment_nodes(api, cache, exp_ids[0], opts)]
+    else:
+        resolved = _concurrently(
+            lambda exp_id: _experiment_nodes(api, cache, exp_id, opts,
+                                             several=True),
+            exp_ids)
+    experiments = OrderedDict()
+    for exp_id, (nodes, fetched) in zip(exp_ids, resolved):
+        # Cache is only written from this thread
+        if fetched:
+            cache.set_nodes(exp_id, fetched)
+        experiments[exp_id] = nodes
+    return experiments
+
+
+def _run_command(opts, config_ssh, nodes, stream=None):
+    """Run the command of opts, hosts status written to stream if any."""
+    # SSH libraries are only loaded to run a command
+    from iotlabsshcli import open_a8  # pylint:disable=import-outside-toplevel
 
     command = opts.command
+    on_host = None
+    if stream is not None and command != 'plan':
+        on_host = stream.on_host(command)
     if command == 'reset-m3':
-        return iotlabsshcli.open_a8.reset_m3(config_ssh, nodes,
-                                             verbose=opts.verbose)
+        return open_a8.reset_m3(config_ssh, nodes,
+                                verbose=opts.verbose,
+                                timings=opts.timings,
+                                on_host=on_host)
     elif command == 'flash-m3':
-        return iotlabsshcli.open_a8.flash_m3(config_ssh, nodes, opts.firmware,
-                                             verbose=opts.verbose)
+        return open_a8.flash_m3(config_ssh, nodes, opts.firmware,
+                                opts.compact, opts.force,
+                                verbose=opts.verbose,
+                                timings=opts.timings,
+                                on_host=on_host)
     elif command == 'wait-for-boot':
-        return iotlabsshcli.open_a8.wait_for_boot(config_ssh, nodes,
-                                                  max_wait=opts.max_wait,
-                                                  verbose=opts.verbose)
+        return open_a8.wait_for_boot(config_ssh, nodes,
+                                     max_wait=opts.max_wait,
+                                     verbose=opts.verbose,
+                                     timings=opts.timings,
+                                     on_host=on_host)
     elif command == 'run-script':
-        return iotlabsshcli.open_a8.run_script(config_ssh, nodes,
-                                               opts.script,
-                                               opts.frontend,
-                                               verbose=opts.verbose)
+        return open_a8.run_script(config_ssh, nodes,
+                                  opts.script,
+                                  opts.frontend,
+                                  verbose=opts.verbose,
+                                  timings=opts.timings,
+                                  on_host=on_host)
     elif command == 'run-cmd':
-        return iotlabsshcli.open_a8.run_cmd(config_ssh, nodes,
-                                            opts.cmd,
-                                            opts.frontend,
-                                            verbose=opts.verbose)
+        return open_a8.run_cmd(config_ssh, nodes,
+                               opts.cmd,
+                               opts.frontend,
+                               verbose=opts.verbose,
+                               capture_size=opts.capture,
+                               capture_dir=opts.capture_dir,
+                               timings=opts.timings,
+                               on_host=on_host)
     elif command == 'copy-file':
-        return iotlabsshcli.open_a8.copy_file(config_ssh, nodes,
-                                              opts.file_path,
-                                              verbose=opts.verbose)
+        return open_a8.copy_file(config_ssh, nodes,
+                                 opts.file_path,
+                                 opts.delta,
+                                 verbose=opts.verbose,
+                                 timings=opts.timings,
+                                 on_host=on_host)
+    elif command == 'plan':
+        from iotlabsshcli import plan  # pylint:disable=import-outside-toplevel
+        return plan.run_plan(config_ssh, nodes,
+                             plan.load_plan(opts.plan_file),
+                             verbose=opts.verbose,
+                             timings=opts.timings,
+                             on_step=None if stream is None
+                             else stream.on_host)
     else:  # pragma: no cover
         raise ValueError('Unknown command {0}'.format(command))
 
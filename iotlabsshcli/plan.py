@@ -0,0 +1,115 @@
+# -*- coding:utf-8 -*-
+"""iotlabsshcli plan of commands run in one process."""
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import json
+import os.path
+
+from collections import OrderedDict
+from iotlabsshcli import open_a8
+from iotlabsshcli.commands import parse_step
+from iotlabsshcli.sshlib.pool import ConnectionPool
+
+
+def load_plan(path):
+    """Return the steps of a JSON plan file, or YAML one if PyYAML is
+    installed.
+    """
+    with open(path) as plan_fd:
+        content = plan_fd.read()
+    if os.path.splitext(path)[1] in ('.yml', '.yaml'):
+        try:
+            import yaml  # pylint:disable=import-outside-toplevel
+        except ImportError:
+            raise ValueError('PyYAML is required to read {}'.format(path))
+        steps = yaml.safe_load(content)
+    else:
+        steps = json.loads(content)
+    if not isinstance(steps, list):
+        raise ValueError('Plan {} is not a list of steps'.format(path))
+    return [parse_step(step) for step in steps]
+
+
+def _successful_nodes(nodes, result):
+    """Return nodes successful or skipped in result, directly or through
+    their frontend.
+
+    >>> nodes = ['node-a8-1.saclay.iot-lab.info',
+    ...          'node-a8-2.saclay.iot-lab.info',
+    ...          'node-a8-1.lille.iot-lab.info']
+    >>> _successful_nodes(nodes, {'0': ['node-a8-2.saclay.iot-lab.info']})
+    ['node-a8-2.saclay.iot-lab.info']
+    >>> _successful_nodes(nodes, {'0': ['lille.iot-lab.info']})
+    ['node-a8-1.lille.iot-lab.info']
+    >>> _successful_nodes(nodes, {'skipped': {
+    ...     'node-a8-1.saclay.iot-lab.info': 'local'}})
+    ['node-a8-1.saclay.iot-lab.info']
+    """
+    success = set(result.get('0', [])) | set(result.get('skipped', {}))
+    return [node for node in nodes
+            if node in success or node.split('.', 1)[1] in success]
+
+
+# pylint: disable=too-many-arguments
+def run_step(config_ssh, nodes, command, kwargs, verbose=False,
+             connections=None, timings=False, on_host=None):
+    """Run the open_a8 function of command, with kwargs from parse_step."""
+    function = getattr(open_a8, command.replace('-', '_'))
+    return function(config_ssh, nodes, verbose=verbose,
+                    connections=connections, timings=timings,
+                    on_host=on_host, **kwargs)
+
+
+# pylint: disable=too-many-arguments
+def run_plan(config_ssh, nodes, steps, verbose=False, timings=False,
+             on_step=None):
+    """Run steps in order over the same connections.
+
+    Each step runs on the nodes successful at the previous one. Return
+    the result of each step in the 'plan' list. `on_step(command)`
+    returns the `on_host` callback of each step, if given.
+
+    With nodes given per experiment id, steps run on all experiments at
+    once and the 'plan' of each experiment is returned per experiment id.
+    """
+    results = []
+    connections = ConnectionPool()
+    try:
+        for command, kwargs in steps:
+            on_host = None if on_step is None else on_step(command)
+            result = run_step(config_ssh, nodes, command, kwargs,
+                              verbose=verbose, connections=connections,
+                              timings=timings, on_host=on_host)
+            results.append(result)
+            if isinstance(nodes, dict):
+                nodes = OrderedDict(
+                    (exp_id, _successful_nodes(exp_nodes,
+                                               result[exp_id][command]))
+                    for exp_id, exp_nodes in nodes.items())
+            else:
+                nodes = _successful_nodes(nodes, result[command])
+    finally:
+        connections.close()
+    if isinstance(nodes, dict):
+        return OrderedDict((exp_id, {"plan": [result[exp_id]
+                                              for result in results]})
+                           for exp_id in nodes)
+    return {"plan": results}
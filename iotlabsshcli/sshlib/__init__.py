@@ -22,4 +22,19 @@
 
 # flake8: noqa
 
-from .open_a8_ssh import OpenA8Ssh, OpenA8SshAuthenticationException
+import sys
+
+from .backend import get_backend, SshBackend, OpenA8SshAuthenticationException
+from .pipeline import Pipeline
+from .capture import OutputCapture, DEFAULT_CAPTURE_SIZE
+
+if sys.version_info < (3, 7):
+    from .open_a8_ssh import OpenA8Ssh
+else:
+    def __getattr__(name):
+        # pssh patches the process with gevent on import, which the asyncio
+        # backend does not want: only load it on use
+        if name == 'OpenA8Ssh':
+            return get_backend('pssh')
+        raise AttributeError('module {} has no attribute {}'.format(
+            __name__, name))
@@ -0,0 +1,147 @@
+# -*- coding:utf-8 -*-
+"""Adaptive concurrency limit of the hosts reached through a frontend."""
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+from collections import deque
+
+# Hosts in flight through one frontend
+DEFAULT_MAX_LIMIT = 64
+# Connections slower than this factor of the fastest one stop the growth
+SLOW_FACTOR = 3
+# Latency under which a connection is never considered slow, in seconds
+MIN_BASELINE = 0.1
+
+
+class AimdLimit(object):  # pylint:disable=too-many-instance-attributes
+    """Concurrency limit with additive increase, multiplicative decrease.
+
+    The limit, a number of hosts in flight, grows by one each time a
+    whole window of connections succeeds while they stay fast, less than
+    `SLOW_FACTOR` times slower than the fastest one. It is multiplied by
+    `decrease` on connection errors, only once per window: errors of
+    connections started before the decrease are ignored.
+
+    Waiters are events of `event_factory`, gevent or asyncio ones, waited
+    for until `try_acquire` succeeds.
+
+    >>> limit = AimdLimit(initial=2, maximum=4)
+    >>> limit.try_acquire(), limit.try_acquire(), limit.try_acquire()
+    (True, True, False)
+    >>> for _ in range(2):
+    ...     limit.report(True, 0.5)
+    ...     limit.release()
+    >>> limit.limit
+    3
+    >>> limit.report(False)
+    >>> limit.limit
+    1
+    """
+
+    # pylint:disable=too-many-arguments
+    def __init__(self, initial, minimum=1, maximum=DEFAULT_MAX_LIMIT,
+                 decrease=0.5, event_factory=None):
+        self.minimum = minimum
+        self.maximum = max(maximum, initial)
+        self.decrease = decrease
+        self.event_factory = event_factory
+        self.limit = initial
+        self.in_flight = 0
+        self.baseline = None
+        self.stats = {'errors': 0, 'slow': 0, 'decreases': 0,
+                      'peak': initial}
+        self._since_decrease = initial
+        self._successes = 0
+        self._waiters = deque()
+
+    def try_acquire(self):
+        """Take a slot if one is free, return True on success."""
+        if self.in_flight >= self.limit:
+            return False
+        self.in_flight += 1
+        return True
+
+    def waiter(self):
+        """Return an event set once a slot may be free."""
+        event = self.event_factory()
+        self._waiters.append(event)
+        return event
+
+    def release(self):
+        """Free a slot."""
+        self.in_flight -= 1
+        self._wake()
+
+    def report(self, success, latency=None):
+        """Adapt the limit to a connection outcome and latency."""
+        self._since_decrease += 1
+        if not success:
+            self.stats['errors'] += 1
+            self._decrease()
+        elif self._is_slow(latency):
+            # Frontend is busy, hold the limit
+            self.stats['slow'] += 1
+        else:
+            self._increase()
+
+    def _is_slow(self, latency):
+        if latency is None:
+            return False
+        if self.baseline is None or latency < self.baseline:
+            self.baseline = latency
+        return latency > SLOW_FACTOR * max(self.baseline, MIN_BASELINE)
+
+    def _decrease(self):
+        # Connections started before the last decrease saw the old limit
+        if self._since_decrease < self.limit:
+            return
+        self._since_decrease = 0
+        self._successes = 0
+        self.stats['decreases'] += 1
+        self.limit = max(int(self.limit * self.decrease), self.minimum)
+
+    def _increase(self):
+        self._successes += 1
+        if self._successes < self.limit or self.limit >= self.maximum:
+            return
+        self._successes = 0
+        self.limit += 1
+        self.stats['peak'] = max(self.stats['peak'], self.limit)
+        self._wake()
+
+    def _wake(self):
+        free = self.limit - self.in_flight
+        while free > 0 and self._waiters:
+            self._waiters.popleft().set()
+            free -= 1
+
+    def as_dict(self):
+        """Return current limit and congestion signals seen."""
+        return dict(self.stats, limit=self.limit)
+
+    def summary(self):
+        """Return current limit and congestion signals seen, as text.
+
+        >>> AimdLimit(10).summary()
+        'window 10 hosts (peak 10, 0 errors, 0 slow, 0 decreases)'
+        """
+        return ('window {limit} hosts (peak {peak}, {errors} errors, '
+                '{slow} slow, {decreases} decreases)'.format(**self.as_dict()))
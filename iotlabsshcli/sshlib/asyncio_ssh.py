@@ -0,0 +1,456 @@
+# -*- coding:utf-8 -*-
+"""SSH backend running on asyncio with asyncssh, requires Python 3.7."""
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import asyncio
+import contextlib
+import io
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import asyncssh
+except ImportError:  # pragma: no cover
+    asyncssh = None
+
+from ..cache import file_digest
+from .scheduler import DEFAULT_POOL_SIZE, DEFAULT_MAX_UPLOADS
+from .aimd import AimdLimit, DEFAULT_MAX_LIMIT
+from .boot import Backoff, PROBE_TIMEOUT
+from .result import Result
+from .timing import clock
+from .backend import SshBackend, OpenA8SshAuthenticationException
+from .backend import _CHECK_DIGEST_CMD, _transfer_stats, _compressed_stats
+from . import compression
+
+LOGGER = logging.getLogger(__name__)
+# Errors of a host that make it unreachable, not the whole site
+_HOST_ERRORS = (OSError, asyncio.TimeoutError) + (
+    (asyncssh.Error,) if asyncssh is not None else ())
+
+
+def _log_ready(node, latency):
+    """Log node boot, shown when verbose."""
+    LOGGER.info("%s booted in %.1f s", node, latency)
+
+
+def _import_key(pkey):
+    """Return the asyncssh key of a paramiko key."""
+    data = io.StringIO()
+    pkey.write_private_key(data)
+    return asyncssh.import_private_key(data.getvalue())
+
+
+async def _exec_command(conn, command):
+    """Run command on an asyncssh connection, return True on success."""
+    if not command:
+        return True
+    completed = await conn.run(command)
+    return completed.exit_status == 0
+
+
+class OpenA8AsyncSsh(SshBackend):
+    """Implement SshBackend with asyncssh on an asyncio event loop.
+
+    Nodes are reached through channels of one connection per frontend,
+    files are always copied whole.
+    """
+
+    # pylint: disable=too-many-arguments,unused-argument
+    def __init__(self, config_ssh, groups, verbose=False,
+                 pool_size=DEFAULT_POOL_SIZE, max_sessions=None,
+                 max_uploads=DEFAULT_MAX_UPLOADS, upload_cache=None,
+                 connections=None, timings=False):
+        if asyncssh is None:
+            raise ValueError('SSH backend asyncio requires asyncssh')
+        super(OpenA8AsyncSsh, self).__init__(config_ssh, groups, verbose,
+                                             upload_cache, timings)
+        self.pool_size = pool_size
+        self.max_sessions = max_sessions
+        self.max_uploads = max_uploads
+        pkey = config_ssh.get('pkey')
+        self._client_keys = () if pkey is None else [_import_key(pkey)]
+        self._frontends = {}
+        self._nodes = {}
+        self._semaphores = {}
+        self.limits = {}
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+        if self.verbose and not LOGGER.handlers:
+            LOGGER.addHandler(logging.StreamHandler())
+            LOGGER.setLevel(logging.INFO)
+
+    def close(self):
+        """Close all connections and stop the event loop."""
+        if self._loop.is_closed():
+            return
+        self._call(self._close())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    def map_sites(self, func):
+        """Call func(site, hosts) in one thread per site."""
+        with ThreadPoolExecutor(max(len(self.groups), 1)) as executor:
+            futures = OrderedDict(
+                (site, executor.submit(func, site, hosts))
+                for site, hosts in self.groups.items())
+        return OrderedDict((site, future.result())
+                           for site, future in futures.items())
+
+    def run_site_direct(self, site, hosts, command, with_proxy=True,
+                        **kwargs):
+        """Run ssh command on hosts of one site, or on its frontend.
+
+        Output is kept in the OutputCapture `capture` if given, and run
+        in a pseudo terminal unless `use_pty` is False. Return a Result.
+        """
+        result = self._call(self._run_site(site, hosts, command, with_proxy,
+                                           **kwargs))
+        LOGGER.info("%s: %s", self._frontend_host(site),
+                    self._limit(site).summary())
+        return result
+
+    # pylint: disable=too-many-arguments
+    def scp_site(self, site, src, dst, before=None, after=None, delta=False):
+        """Copy file to the frontend of one site.
+
+        Optional `before` and `after` commands are run on the same
+        connection, the copy fails if one of them fails. Return a Result.
+        """
+        with self.timings.measure('copy', site=site):
+            return self._call(self._scp_site(site, src, dst, before, after))
+
+    def wait(self, max_wait, on_ready=None):
+        """Wait for requested A8 nodes until they boot.
+
+        Each node is probed on its own with backoff: its SSH port is first
+        reached through the frontend, then uptime is run on it.
+        `on_ready(node, latency)` is called as soon as a node is ready,
+        from the event loop thread. Boot latencies are given in the
+        'latency' entry of the result.
+        """
+        result = self._call(self._wait(max_wait, on_ready or _log_ready))
+        for node, latency in result.details.get('latency', {}).items():
+            self.timings.add('boot', latency, host=node)
+        return self.as_dict(result)
+
+    def _call(self, coro):
+        """Run coro in the event loop, wait and return its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    def _semaphore(self, key, size):
+        """Return the semaphore of key, created in the event loop."""
+        if key not in self._semaphores:
+            self._semaphores[key] = asyncio.Semaphore(size)
+        return self._semaphores[key]
+
+    def _limit(self, site):
+        """Return the AimdLimit of site, created in the event loop."""
+        if site not in self.limits:
+            self.limits[site] = AimdLimit(self.pool_size,
+                                          maximum=DEFAULT_MAX_LIMIT,
+                                          event_factory=asyncio.Event)
+        return self.limits[site]
+
+    @contextlib.asynccontextmanager
+    async def _session(self, site):
+        """Bound the number of hosts in flight in site and overall."""
+        limit = self._limit(site)
+        while not limit.try_acquire():
+            await limit.waiter().wait()
+        try:
+            if self.max_sessions is None:
+                yield limit
+            else:
+                async with self._semaphore('sessions', self.max_sessions):
+                    yield limit
+        finally:
+            limit.release()
+
+    async def _connect(self, host, user, **kwargs):
+        try:
+            return await asyncssh.connect(host, username=user,
+                                          client_keys=self._client_keys,
+                                          known_hosts=None,
+                                          connect_timeout=10, **kwargs)
+        except asyncssh.PermissionDenied:
+            raise OpenA8SshAuthenticationException(host)
+
+    async def _frontend(self, site):
+        """Return the connection to the frontend of site, opened once."""
+        task = self._frontends.get(site)
+        if task is None:
+            task = asyncio.ensure_future(self._connect(
+                self._frontend_host(site), self.config_ssh['user'],
+                port=self.config_ssh.get('port') or 22))
+            self._frontends[site] = task
+        try:
+            conn = await task
+        except Exception:
+            # Connect again next time
+            self._forget_frontend(site, task)
+            raise
+        if conn.is_closed():
+            self._forget_frontend(site, task)
+            return await self._frontend(site)
+        return conn
+
+    def _forget_frontend(self, site, task):
+        if self._frontends.get(site) is task:
+            del self._frontends[site]
+
+    async def _node(self, site, node):
+        """Return the connection to node through its frontend."""
+        conn = self._nodes.get(node)
+        if conn is None or conn.is_closed():
+            frontend = await self._frontend(site)
+            conn = await self._connect(node, 'root', tunnel=frontend)
+            self._nodes[node] = conn
+        return conn
+
+    async def _close(self):
+        frontends = [task.result() for task in self._frontends.values()
+                     if task.done() and not task.cancelled() and
+                     task.exception() is None]
+        for connections in (list(self._nodes.values()), frontends):
+            for conn in connections:
+                conn.close()
+            await asyncio.gather(*[conn.wait_closed() for conn in connections],
+                                 return_exceptions=True)
+        self._nodes.clear()
+        self._frontends.clear()
+
+    # pylint: disable=too-many-arguments
+    async def _run_site(self, site, hosts, command, with_proxy=True,
+                        capture=None, use_pty=True, on_host=None):
+        result = Result()
+        hosts = hosts if with_proxy else [self._frontend_host(site)]
+        await asyncio.gather(*[
+            self._run_host(site, host, command, with_proxy, capture,
+                           use_pty, result, on_host)
+            for host in hosts])
+        return result
+
+    # pylint: disable=too-many-arguments
+    async def _run_host(self, site, host, command, with_proxy, capture,
+                        use_pty, result, on_host=None):
+        """Run command on host, add its exit status to result.
+
+        The exit status is also given to `on_host(host, exit_code)`.
+        """
+        async with self._session(site) as limit:
+            start = clock()
+            try:
+                with self.timings.measure('connect', host=host):
+                    if with_proxy:
+                        conn = await self._node(site, host)
+                    else:
+                        conn = await self._frontend(site)
+                    process = await conn.create_process(
+                        command, term_type='xterm' if use_pty else None)
+            except _HOST_ERRORS:
+                limit.report(False)
+                result.add(host, None)
+                if on_host is not None:
+                    on_host(host, None)
+                return
+            limit.report(True, clock() - start)
+            started = clock()
+            await asyncio.gather(
+                self._read(host, 'stdout', process.stdout, capture),
+                self._read(host, 'stderr', process.stderr, capture))
+            completed = await process.wait()
+            self.timings.add('command', clock() - started, host=host)
+        result.add(host, completed.exit_status)
+        if on_host is not None:
+            on_host(host, completed.exit_status)
+
+    # pylint: disable=too-many-arguments
+    async def _read(self, host, stream, reader, capture):
+        """Read output lines as they arrive, keep them in capture."""
+        ring = None if capture is None else capture.buffer(host, stream)
+        while True:
+            # Iterating on reader may yield an empty string at EOF
+            line = await reader.readline()
+            if not line:
+                break
+            line = line.rstrip('\r\n')
+            if ring is not None:
+                ring.append(line)
+            if self.verbose:
+                LOGGER.info('[%s]\t%s', host, line)
+
+    # pylint: disable=too-many-arguments
+    async def _scp_site(self, site, src, dst, before, after):
+        result = Result()
+        frontend = self._frontend_host(site)
+        timings = self.timings
+        try:
+            with timings.measure('connect', host=frontend):
+                conn = await self._frontend(site)
+        except _HOST_ERRORS:
+            result.add(frontend, None)
+            return result
+
+        with timings.measure('before', host=frontend):
+            success = await _exec_command(conn, before)
+        if success:
+            with timings.measure('upload', host=frontend):
+                stats = await self._upload(conn, frontend, src, dst)
+            result.add_detail('transfers', frontend, stats)
+            with timings.measure('after', host=frontend):
+                success = await _exec_command(conn, after)
+        result.add(frontend, 0 if success else 1)
+        return result
+
+    async def _upload(self, conn, frontend, src, dst):
+        """Copy src to dst on frontend unless already there."""
+        cache = self.upload_cache
+        if cache is None:
+            return await self._put(conn, src, dst)
+
+        digest = cache.digest(src)
+        check_cmd = _CHECK_DIGEST_CMD.format(dst=dst, digest=digest)
+        if (cache.is_fresh(frontend, dst, digest) or
+                await _exec_command(conn, check_cmd)):
+            stats = _transfer_stats(0, 0)
+            stats['cached'] = True
+        else:
+            stats = await self._put(conn, src, dst)
+        cache.add(frontend, dst, digest)
+        return stats
+
+    async def _put(self, conn, src, dst):
+        """Copy src to dst, return the transfer statistics.
+
+        Files are sent compressed if the backend `compress` and it is
+        worth it, with scp otherwise.
+        """
+        async with self._semaphore('uploads', self.max_uploads):
+            stats = None
+            if self.compress:
+                stats = await self._compressed_put(conn, src, dst)
+            if stats is None:
+                start = clock()
+                await asyncssh.scp(src, (conn, dst))
+                stats = _transfer_stats(os.path.getsize(src), clock() - start)
+            return stats
+
+    async def _compressed_put(self, conn, src, dst):
+        """Copy src to dst compressed, return the transfer statistics.
+
+        Return None if nothing was copied because compression is not worth
+        it or failed on the remote host. Files are read and compressed out
+        of the event loop.
+        """
+        loop = asyncio.get_event_loop()
+        size = os.path.getsize(src)
+        has_zstd = (compression.zstandard is not None and
+                    await _exec_command(conn, compression.HAS_ZSTD_CMD))
+        codec = await loop.run_in_executor(None, compression.choose, src,
+                                           size, lambda: has_zstd)
+        if codec is None:
+            return None
+        start = clock()
+        digest = await loop.run_in_executor(None, file_digest, src)
+        chunks = compression.stream(src, codec, size)
+        sent = 0
+        process = await conn.create_process(
+            compression.put_command(codec, dst, digest), encoding=None)
+        while True:
+            chunk = await loop.run_in_executor(None, next, chunks, None)
+            if chunk is None:
+                break
+            process.stdin.write(chunk)
+            await process.stdin.drain()
+            sent += len(chunk)
+        process.stdin.write_eof()
+        completed = await process.wait()
+        if completed.exit_status != 0:
+            return None
+        return _compressed_stats(size, sent, codec, clock() - start)
+
+    async def _wait(self, max_wait, on_ready):
+        start = clock()
+        deadline = start + max_wait
+        nodes = [(site, node)
+                 for site, site_nodes in self.groups.items()
+                 for node in site_nodes]
+        waits = await asyncio.gather(*[
+            self._wait_node(site, node, start, deadline, on_ready)
+            for site, node in nodes])
+
+        result = Result()
+        for (_, node), (latency, attempts) in zip(nodes, waits):
+            result.add(node, None if latency is None else 0, attempts)
+            if latency is not None:
+                result.add_detail('latency', node, latency)
+        return result
+
+    # pylint: disable=too-many-arguments
+    async def _wait_node(self, site, node, start, deadline, on_ready):
+        """Probe node until ready or deadline.
+
+        Return its latency, None if not ready, and the number of probes.
+        """
+        backoff = Backoff()
+        attempt = 0
+        while True:
+            attempt += 1
+            if (await self._probe_node(site, node) and
+                    await self._check_node(site, node)):
+                latency = clock() - start
+                on_ready(node, latency)
+                return latency, attempt
+            remaining = deadline - clock()
+            if remaining <= 0:
+                return None, attempt
+            await asyncio.sleep(min(backoff.delay(attempt - 1), remaining))
+
+    async def _probe_node(self, site, node):
+        """Return True if node SSH server answers through its frontend."""
+        with self.timings.measure('probe', host=node):
+            try:
+                conn = await self._frontend(site)
+                reader, writer = await asyncio.wait_for(
+                    conn.open_connection(node, 22), PROBE_TIMEOUT)
+                try:
+                    banner = await asyncio.wait_for(reader.readexactly(4),
+                                                    PROBE_TIMEOUT)
+                finally:
+                    writer.close()
+            except _HOST_ERRORS + (asyncio.IncompleteReadError,):
+                return False
+        return banner == b'SSH-'
+
+    async def _check_node(self, site, node):
+        """Return True if a command can be run on node."""
+        result = Result()
+        await self._run_host(site, node, 'uptime', True, None, True, result)
+        return result.success(node)
@@ -0,0 +1,371 @@
+# -*- coding:utf-8 -*-
+"""Interface of the SSH backends running commands on nodes and frontends."""
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import importlib
+import json
+import os
+
+from .capture import OutputCapture
+from .result import Result, Reporter
+from .retry import RetryPolicy
+from .timing import Timings
+from . import fanout
+
+# Backend name: (module, class). Modules are only imported when selected,
+# the pssh one patches the whole process with gevent.
+BACKENDS = {
+    'pssh': ('iotlabsshcli.sshlib.open_a8_ssh', 'OpenA8Ssh'),
+    'asyncio': ('iotlabsshcli.sshlib.asyncio_ssh', 'OpenA8AsyncSsh'),
+}
+DEFAULT_BACKEND = os.environ.get('IOTLABSSHCLI_BACKEND', 'pssh')
+
+_FRONTEND = '{}.iot-lab.info'
+_HELPERS_DIR = '~/A8/.iotlabsshcli'
+_MKDIR_CMD = 'mkdir -p {}'
+_CHECK_DIGEST_CMD = ('test "$(sha256sum {dst} 2>/dev/null | cut -d" " -f1)"'
+                     ' = {digest}')
+
+
+def get_backend(name=None):
+    """Return the SSH backend class called name, DEFAULT_BACKEND if None.
+
+    >>> get_backend('unknown')
+    Traceback (most recent call last):
+    ...
+    ValueError: Unknown SSH backend unknown, choose from asyncio, pssh
+    """
+    name = name or DEFAULT_BACKEND
+    if name not in BACKENDS:
+        raise ValueError('Unknown SSH backend {}, choose from {}'.format(
+            name, ', '.join(sorted(BACKENDS))))
+    module, cls = BACKENDS[name]
+    try:
+        return getattr(importlib.import_module(module), cls)
+    except (ImportError, SyntaxError) as err:
+        # The asyncio backend requires Python 3 and asyncssh
+        raise ValueError('SSH backend {} is not available: {}'.format(
+            name, err))
+
+
+def _transfer_stats(size, duration):
+    """Return statistics of a transfer of size bytes in duration seconds.
+
+    >>> sorted(_transfer_stats(1000, 0.5).items())
+    [('duration', 0.5), ('size', 1000), ('throughput', 2000.0)]
+    >>> _transfer_stats(0, 0)['throughput'] is None
+    True
+    """
+    return {'size': size,
+            'duration': round(duration, 3),
+            'throughput': round(size / duration, 1) if duration else None}
+
+
+def _compressed_stats(size, sent, codec, duration):
+    """Return statistics of a transfer of size bytes sent compressed.
+
+    Bytes on the wire are given in 'sent', the throughput is effective.
+
+    >>> stats = _compressed_stats(1000, 250, 'gzip', 0.5)
+    >>> stats['sent'], stats['ratio'], stats['throughput']
+    (250, 0.25, 2000.0)
+    """
+    stats = _transfer_stats(size, duration)
+    stats.update(sent=sent, codec=codec,
+                 ratio=round(float(sent) / size, 3) if size else None)
+    return stats
+
+
+class OpenA8SshAuthenticationException(Exception):
+    """Raised when an authentication error occurs on one site"""
+
+    def __init__(self, site):
+        msg = ('Cannot connect to IoT-LAB server on site '
+               '"{}", check your SSH configuration.'.format(site))
+        super(OpenA8SshAuthenticationException, self).__init__(msg)
+        self.msg = msg
+
+
+class _FanoutLines(object):
+    """Frontend output lines of the fan-out helper, one per node."""
+
+    def __init__(self, fanout_capture):
+        self.fanout_capture = fanout_capture
+
+    def append(self, line):
+        """Record the node result of line, ignore other output."""
+        try:
+            node = json.loads(line)
+        except ValueError:
+            return
+        if isinstance(node, dict) and 'host' in node:
+            self.fanout_capture.add(node)
+
+    def close(self):
+        """Nothing to close."""
+
+
+class _FanoutCapture(OutputCapture):
+    """Capture of the fan-out helper output, as a Result of nodes.
+
+    Node durations are the 'command' phase of `timings`, their output is
+    kept in the OutputCapture `capture` if any, their exit code given to
+    `on_host(host, exit_code)` if any.
+    """
+
+    def __init__(self, timings, capture=None, on_host=None):
+        super(_FanoutCapture, self).__init__(max_bytes=0)
+        self.timings = timings
+        self.capture = capture
+        self.on_host = on_host
+        self.nodes = Result()
+
+    def buffer(self, host, stream):
+        if stream == 'stdout':
+            return _FanoutLines(self)
+        return super(_FanoutCapture, self).buffer(host, stream)
+
+    def add(self, node):
+        """Record the result of a node, sent by the helper."""
+        host = node['host']
+        self.nodes.add(host, node['exit_code'])
+        self.timings.add('command', node['duration'], host=host)
+        if self.on_host is not None:
+            self.on_host(host, node['exit_code'])
+        if self.capture is None:
+            return
+        for stream in ('stdout', 'stderr'):
+            lines = node.get(stream, '').splitlines()
+            if lines:
+                ring = self.capture.buffer(host, stream)
+                for line in lines:
+                    ring.append(line)
+
+
+class SshBackend(object):
+    """Commands and copies on the nodes and frontends of sites.
+
+    Backends implement `map_sites`, `run_site_direct`, `scp_site`, `wait`
+    and `close`, on which `run`, `scp` and `Pipeline` process all sites.
+    """
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, config_ssh, groups, verbose=False, upload_cache=None,
+                 timings=False):
+        self.config_ssh = config_ssh
+        self.groups = groups
+        self.verbose = verbose
+        self.upload_cache = upload_cache
+        self.timings = Timings()
+        self.report_timings = timings
+        self.fanout = config_ssh.get('fanout', False)
+        self.compress = config_ssh.get('compress', False)
+        self.retry = RetryPolicy.from_config(config_ssh.get('retry'))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close all connections kept open."""
+        raise NotImplementedError()
+
+    def map_sites(self, func):
+        """Call func(site, hosts) concurrently for every site of groups.
+
+        Return results per site in groups order, re-raise the first
+        exception.
+        """
+        raise NotImplementedError()
+
+    # pylint: disable=too-many-arguments
+    def run_site(self, site, hosts, command, with_proxy=True, on_host=None,
+                 **kwargs):
+        """Run command on hosts of one site, or on its frontend.
+
+        `on_host(host, exit_code)` is called as soon as a host is done,
+        once for each host of the returned Result.
+        """
+        report = None if on_host is None else Reporter(on_host)
+        with self.timings.measure('run', site=site):
+            if with_proxy and self.fanout:
+                result = self._fanout_site(site, hosts, command,
+                                           on_host=report, **kwargs)
+            else:
+                result = self.run_site_direct(site, hosts, command,
+                                              with_proxy, on_host=report,
+                                              **kwargs)
+        if report is not None:
+            report.flush(result)
+        return result
+
+    def run_site_direct(self, site, hosts, command, with_proxy=True,
+                        **kwargs):
+        """Run command on hosts of one site, or on its frontend.
+
+        Hosts are reached from here, through the frontend as a proxy.
+        Output is kept in the OutputCapture `capture` if given, hosts
+        exit codes given to `on_host` as soon as they exit.
+        """
+        raise NotImplementedError()
+
+    # pylint: disable=too-many-arguments
+    def _fanout_site(self, site, hosts, command, capture=None, on_host=None,
+                     **kwargs):
+        """Run command on hosts of one site with the fan-out helper.
+
+        The helper is copied to the frontend when missing. Output of
+        nodes is only captured up to `capture` size, without pseudo
+        terminal. Nodes without result are unreachable.
+        """
+        # pylint:disable=unused-argument
+        frontend = self._frontend_host(site)
+        helper = fanout.helper_path(_HELPERS_DIR)
+        command = fanout.fanout_command(
+            helper, command, hosts,
+            capture=0 if capture is None else capture.max_bytes)
+        for _ in range(2):
+            nodes = _FanoutCapture(self.timings, capture, on_host)
+            result = self.run_site_direct(site, hosts, command,
+                                          with_proxy=False, capture=nodes,
+                                          use_pty=False)
+            if (frontend not in result.hosts or
+                    result.exit_code(frontend) != fanout.HELPER_MISSING):
+                break
+            copy = self.scp_site(site, fanout.source(), helper,
+                                 before=_MKDIR_CMD.format(_HELPERS_DIR))
+            if not copy.success(frontend):
+                break
+        result = nodes.nodes
+        for host in hosts:
+            if host not in result.hosts:
+                result.add(host, None)
+        return result
+
+    # pylint: disable=too-many-arguments
+    def scp_site(self, site, src, dst, before=None, after=None, delta=False):
+        """Copy file to the frontend of one site.
+
+        Optional `before` and `after` commands are run on the same
+        connection, the copy fails if one of them fails.
+        """
+        raise NotImplementedError()
+
+    def wait(self, max_wait, on_ready=None):
+        """Wait for requested A8 nodes until they boot.
+
+        `on_ready(node, latency)` is called as soon as a node is ready,
+        boot latencies are given in the 'latency' entry of the result.
+        """
+        raise NotImplementedError()
+
+    def as_dict(self, result):
+        """Return the dict view of a Result, with timings if asked."""
+        ret = result.as_dict()
+        if self.report_timings:
+            ret['timings'] = self.timings.as_dict()
+        return ret
+
+    def _frontend_host(self, site):
+        """Return the host name of the frontend of site."""
+        return self.config_ssh.get('frontend', _FRONTEND).format(site)
+
+    # pylint: disable=too-many-arguments
+    def retry_site(self, hosts, attempt, retry=None, expires=None,
+                   on_host=None):
+        """Return the Result of attempt(hosts, on_host), retried by policy.
+
+        The policy of the backend is used if `retry` is None, `expires`
+        is given by its `expires` method when the command started.
+        `on_host(host, exit_code)` is called once for each host, as soon
+        as it is not attempted again.
+        """
+        retry = retry or self.retry
+        report = None if on_host is None else Reporter(on_host)
+        if retry is None:
+            result = attempt(hosts, report)
+        else:
+            result = retry.run(hosts, attempt, expires, report)
+        if report is not None:
+            report.flush(result)
+        return result
+
+    def expires(self, retry=None):
+        """Return the deadline of a command starting now, if any."""
+        retry = retry or self.retry
+        return retry.expires() if retry is not None else None
+
+    # pylint: disable=too-many-arguments
+    def run(self, command, with_proxy=True, capture=None, retry=None,
+            on_host=None, **kwargs):
+        """Run ssh command on the nodes of all sites, or their frontends.
+
+        With an OutputCapture `capture`, the output of hosts is given in
+        the 'output' entry of the result. Failed hosts are run again as
+        allowed by the RetryPolicy `retry`, the backend one by default.
+        The final exit code of hosts is given to `on_host(host, exit_code)`
+        as soon as known.
+        """
+        result = Result()
+        expires = self.expires(retry)
+
+        def _run_site(site, hosts):
+            return self.retry_site(
+                hosts, lambda hosts, on_host: self.run_site(
+                    site, hosts, command, with_proxy, on_host=on_host,
+                    capture=capture, **kwargs),
+                retry, expires, on_host)
+
+        for result_cmd in self.map_sites(_run_site).values():
+            result.update(result_cmd)
+
+        if capture is not None:
+            result.details['output'] = capture.result()
+        return self.as_dict(result)
+
+    # pylint: disable=too-many-arguments
+    def scp(self, src, dst, delta=False, retry=None, on_host=None):
+        """Copy file to all frontends at once.
+
+        Size, duration and throughput of each successful copy are given in
+        the 'transfers' entry of the result.
+        With `delta`, only the blocks differing from the existing dst are
+        sent. Copies sent compressed give their bytes on the wire in
+        'sent', their codec and compression ratio too. Failed copies are
+        attempted again as allowed by the RetryPolicy `retry`, the backend
+        one by default. The final exit code of frontends is given to
+        `on_host(host, exit_code)` as soon as known.
+        """
+        result = Result()
+        expires = self.expires(retry)
+
+        def _scp_site(site, _):
+            return self.retry_site(
+                [self._frontend_host(site)],
+                lambda *_: self.scp_site(site, src, dst, delta=delta),
+                retry, expires, on_host)
+
+        for result_scp in self.map_sites(_scp_site).values():
+            result.update(result_scp)
+        return self.as_dict(result)
@@ -0,0 +1,111 @@
+# -*- coding:utf-8 -*-
+"""iotlabsshcli boot waiter probing each node with backoff."""
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import socket
+
+import gevent
+from paramiko import SSHException
+
+from .result import Result
+from .retry import Backoff
+from .timing import clock
+
+# Seconds to wait for a node SSH banner
+PROBE_TIMEOUT = 5
+
+
+def tcp_probe(transport, host, port=22, timeout=PROBE_TIMEOUT):
+    """Return True if host SSH server answers, through an SSH transport.
+
+    A direct-tcpip channel is opened from the frontend to host and the
+    SSH banner is read, without any SSH handshake with host.
+    """
+    try:
+        channel = transport.open_channel('direct-tcpip', (host, port),
+                                         ('127.0.0.1', 0), timeout=timeout)
+    except (SSHException, socket.error, EOFError):
+        return False
+    try:
+        channel.settimeout(timeout)
+        return channel.recv(4) == b'SSH-'
+    except socket.timeout:
+        return False
+    finally:
+        channel.close()
+
+
+class BootWaiter(object):
+    """Wait for the nodes of all sites to boot, each node on its own.
+
+    `probe(site, node)` is a cheap reachability test, `check(site, node)`
+    the SSH test only run once the probe succeeds. Both return a boolean.
+    `on_ready(node, latency)` is called as soon as a node is ready.
+    """
+
+    def __init__(self, probe, check, backoff=None, on_ready=None):
+        self.probe = probe
+        self.check = check
+        self.backoff = backoff or Backoff()
+        self.on_ready = on_ready
+
+    def wait(self, groups, max_wait):
+        """Wait at most max_wait seconds for nodes of groups.
+
+        Return a Result with the number of probes of each node and the
+        boot latency of ready nodes in 'latency' details.
+        """
+        start = clock()
+        deadline = start + max_wait
+        greenlets = dict((node, gevent.spawn(self._wait_node, site, node,
+                                             start, deadline))
+                         for site, nodes in groups.items() for node in nodes)
+        try:
+            gevent.joinall(list(greenlets.values()), raise_error=True)
+        except Exception:
+            gevent.killall(list(greenlets.values()))
+            raise
+
+        result = Result()
+        for node, greenlet in greenlets.items():
+            latency, attempts = greenlet.get()
+            result.add(node, None if latency is None else 0, attempts)
+            if latency is not None:
+                result.add_detail('latency', node, latency)
+        return result
+
+    def _wait_node(self, site, node, start, deadline):
+        """Probe node until ready or deadline.
+
+        Return its latency, None if not ready, and the number of probes.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            if self.probe(site, node) and self.check(site, node):
+                latency = clock() - start
+                if self.on_ready is not None:
+                    self.on_ready(node, latency)
+                return latency, attempt
+            remaining = deadline - clock()
+            if remaining <= 0:
+                return None, attempt
+            gevent.sleep(min(self.backoff.delay(attempt - 1), remaining))
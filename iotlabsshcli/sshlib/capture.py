@@ -0,0 +1,141 @@
+# -*- coding:utf-8 -*-
+"""iotlabsshcli streaming capture of commands output."""
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import io
+import os
+from collections import deque
+
+import gevent
+
+# Bytes of output kept in memory per host and stream
+DEFAULT_CAPTURE_SIZE = 65536
+
+
+class RingBuffer(object):
+    """Last lines of a stream, up to max_bytes.
+
+    When spill_path is given, all lines are also written to this file.
+
+    >>> ring = RingBuffer(8)
+    >>> for line in ['first', 'second', 'third']:
+    ...     ring.append(line)
+    >>> ring.getvalue(), ring.dropped
+    ('third', 13)
+    """
+
+    def __init__(self, max_bytes, spill_path=None):
+        self.max_bytes = max_bytes
+        self.spill_path = spill_path
+        self.lines = deque()
+        self.size = 0
+        self.dropped = 0
+        self._spill = None
+
+    def append(self, line):
+        """Add a line, dropping the oldest ones above max_bytes."""
+        if self.spill_path is not None:
+            if self._spill is None:
+                self._spill = io.open(self.spill_path, 'a', encoding='utf-8')
+            self._spill.write(line + u'\n')
+        self.lines.append(line)
+        self.size += len(line) + 1
+        while self.size > self.max_bytes:
+            dropped = len(self.lines.popleft()) + 1
+            self.size -= dropped
+            self.dropped += dropped
+
+    def close(self):
+        """Close spill file."""
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+
+    def getvalue(self):
+        """Return the lines kept."""
+        return '\n'.join(self.lines)
+
+
+def _consume(lines, ring):
+    for line in lines:
+        ring.append(line)
+
+
+class OutputCapture(object):
+    """Capture of stdout and stderr of hosts, read as output arrives.
+
+    Memory is bounded by `max_bytes` per host and stream. With `spill_dir`
+    the whole output is written in '<host>.stdout' and '<host>.stderr'
+    files of this directory.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_CAPTURE_SIZE, spill_dir=None):
+        self.max_bytes = max_bytes
+        self.spill_dir = spill_dir
+        self.buffers = {}
+        if spill_dir is not None and not os.path.isdir(spill_dir):
+            os.makedirs(spill_dir)
+
+    def start(self, output):
+        """Start reading all streams of a pssh run_command output.
+
+        Return the reading greenlets.
+        """
+        readers = []
+        for host, host_output in output.items():
+            for stream in ('stdout', 'stderr'):
+                # Pssh: stream is None on connection errors
+                lines = host_output.get(stream)
+                if lines:
+                    ring = self.buffer(host, stream)
+                    readers.append(gevent.spawn(_consume, lines, ring))
+        return readers
+
+    def buffer(self, host, stream):
+        """Return a new RingBuffer keeping stream of host."""
+        spill_path = None
+        if self.spill_dir is not None:
+            spill_path = os.path.join(self.spill_dir,
+                                      '{}.{}'.format(host, stream))
+        ring = RingBuffer(self.max_bytes, spill_path)
+        self.buffers[(host, stream)] = ring
+        return ring
+
+    @staticmethod
+    def join(readers):
+        """Wait until readers have consumed their stream."""
+        gevent.joinall(readers)
+
+    def result(self):
+        """Return captured output per host.
+
+        Each host has its 'stdout' and 'stderr' text, the number of
+        bytes 'dropped' from memory and the 'spill' files if any.
+        """
+        result = {}
+        for (host, stream), ring in sorted(self.buffers.items()):
+            ring.close()
+            host_result = result.setdefault(host, {'dropped': 0})
+            host_result[stream] = ring.getvalue()
+            host_result['dropped'] += ring.dropped
+            if ring.spill_path is not None:
+                host_result.setdefault('spill', []).append(ring.spill_path)
+        return result
@@ -0,0 +1,123 @@
+# -*- coding:utf-8 -*-
+"""iotlabsshcli compressed transfer of files to the frontends.
+
+Files are streamed compressed to the standard input of a command
+decompressing them on the frontend, which checks their digest before
+replacing the destination.
+"""
+
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import zlib
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+
+_CHUNK_SIZE = 65536
+# Start of the file compressed to know if compression is worth it
+_SAMPLE_SIZE = 262144
+# Compression is worth it if the sample shrinks below this ratio
+_MAX_RATIO = 0.9
+# (size up to, gzip level, zstd level): slower levels for smaller files
+_LEVELS = ((1 << 20, 9, 19), (16 << 20, 6, 9), (None, 1, 3))
+_DECOMPRESS = {GZIP: 'gzip -dc', ZSTD: 'zstd -dcq'}
+
+HAS_ZSTD_CMD = 'command -v zstd >/dev/null'
+_PUT_CMD = ('{decompress} > {tmp} && '
+            'test "$(sha256sum {tmp} | cut -d" " -f1)" = {digest} && '
+            'mv {tmp} {dst} || {{ rm -f {tmp}; exit 1; }}')
+
+
+def level(codec, size):
+    """Return compression level of codec for a file of size bytes.
+
+    >>> level(GZIP, 1000), level(GZIP, 2 ** 22), level(GZIP, 2 ** 30)
+    (9, 6, 1)
+    >>> level(ZSTD, 1000), level(ZSTD, 2 ** 22), level(ZSTD, 2 ** 30)
+    (19, 9, 3)
+    """
+    index = 1 if codec == GZIP else 2
+    for levels in _LEVELS:
+        if levels[0] is None or size < levels[0]:
+            return levels[index]
+    return None  # pragma: no cover
+
+
+def compressor(codec, size):
+    """Return a compressor of codec for a file of size bytes.
+
+    It has the `compress(data)` and `flush()` methods of zlib ones.
+    """
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=level(codec, size)).compressobj()
+    # wbits 31 writes the gzip format
+    return zlib.compressobj(level(codec, size), zlib.DEFLATED, 31)
+
+
+def choose(path, size, remote_zstd=None):
+    """Return the codec to send path with, None if it is not worth it.
+
+    zstd is used if the zstandard module is installed and `remote_zstd()`
+    tells the frontend has the zstd command, gzip otherwise.
+    """
+    codec = GZIP
+    if zstandard is not None and remote_zstd is not None and remote_zstd():
+        codec = ZSTD
+    with open(path, 'rb') as path_fd:
+        sample = path_fd.read(_SAMPLE_SIZE)
+    if not sample:
+        return None
+    comp = compressor(codec, size)
+    compressed = len(comp.compress(sample)) + len(comp.flush())
+    return codec if compressed < _MAX_RATIO * len(sample) else None
+
+
+def put_command(codec, dst, sha256):
+    """Return command writing dst from codec compressed standard input.
+
+    dst is only replaced if the decompressed file has digest sha256.
+
+    >>> print(put_command(GZIP, 'fw.elf', 'abc'))
+    ... # doctest: +NORMALIZE_WHITESPACE
+    gzip -dc > fw.elf.tmp && test "$(sha256sum fw.elf.tmp | cut -d" " -f1)"
+    = abc && mv fw.elf.tmp fw.elf || { rm -f fw.elf.tmp; exit 1; }
+    """
+    return _PUT_CMD.format(decompress=_DECOMPRESS[codec], tmp=dst + '.tmp',
+                           dst=dst, digest=sha256)
+
+
+def stream(path, codec, size):
+    """Yield the compressed chunks of file at path, of size bytes."""
+    comp = compressor(codec, size)
+    with open(path, 'rb') as path_fd:
+        for chunk in iter(lambda: path_fd.read(_CHUNK_SIZE), b''):
+            data = comp.compress(chunk)
+            if data:
+                yield data
+    data = comp.flush()
+    if data:
+        yield data
@@ -0,0 +1,275 @@
+# -*- coding:utf-8 -*-
+"""iotlabsshcli rsync-like delta transfer of files to the frontends.
+
+This module only depends on the standard library: it is also copied on the
+frontends and run there to compute signatures and apply deltas.
+"""
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import math
+import zlib
+import struct
+import hashlib
+import tempfile
+
+_ADLER_MOD = 65521
+_MIN_BLOCK_SIZE = 1024
+_MAX_BLOCK_SIZE = 65536
+# Part of a file sent as new data above which it is copied whole
+_MAX_LITERAL_RATIO = 0.5
+
+_DELTA_CMD = ('$(command -v python3 || echo python) {helper} {action} {path} '
+              '{block_size} {digest}')
+
+
+def block_size(size):
+    """Return block size for a file of size bytes, about its square root.
+
+    >>> block_size(100), block_size(10 * 1024 * 1024), block_size(2 ** 40)
+    (1024, 3072, 65536)
+    """
+    size = int(math.sqrt(size)) // _MIN_BLOCK_SIZE * _MIN_BLOCK_SIZE
+    return min(max(size, _MIN_BLOCK_SIZE), _MAX_BLOCK_SIZE)
+
+
+def _weak(block):
+    return zlib.adler32(bytes(block)) & 0xffffffff
+
+
+def _strong(block):
+    return hashlib.md5(bytes(block)).hexdigest()
+
+
+def _roll(weak, out_byte, in_byte, size):
+    """Slide adler32 checksum of a size bytes window by one byte.
+
+    >>> data = bytearray(b'rolling checksum')
+    >>> _roll(_weak(data[0:8]), data[0], data[8], 8) == _weak(data[1:9])
+    True
+    """
+    low = ((weak & 0xffff) - out_byte + in_byte) % _ADLER_MOD
+    high = ((weak >> 16) - size * out_byte + low - 1) % _ADLER_MOD
+    return (high << 16) | low
+
+
+def signature(data, size):
+    """Return data length and [weak, strong] checksums of its blocks."""
+    return {'size': len(data),
+            'blocks': [[_weak(data[offset:offset + size]),
+                        _strong(data[offset:offset + size])]
+                       for offset in range(0, len(data), size)]}
+
+
+def compute_delta(sig, data, size, max_literal=None):
+    """Return records turning the file of signature sig into data.
+
+    Records are ('C', index) to copy a block of the remote file and
+    ('D', bytes) for new data. Return None once more than `max_literal`
+    bytes of new data are needed, if given.
+
+    >>> old = b'0123456789'
+    >>> (compute_delta(signature(old, 4), b'0123x456789', 4) ==
+    ...  [('C', 0), ('D', b'x'), ('C', 1), ('C', 2)])
+    True
+    >>> (compute_delta(signature(old, 4), b'01234-56789', 4) ==
+    ...  [('C', 0), ('D', b'4-567'), ('C', 2)])
+    True
+    >>> compute_delta(signature(b'', 4), b'new', 4) == [('D', b'new')]
+    True
+    >>> compute_delta(signature(old, 4), b'01234-56789', 4, 4) is None
+    True
+    """
+    table = {}
+    for index, (weak, strong) in enumerate(sig['blocks']):
+        table.setdefault(weak, []).append((strong, index))
+    # The last remote block may be shorter, only match it at the end
+    tail = sig['size'] - (len(sig['blocks']) - 1) * size
+
+    def _match(window, weak):
+        # Strong checksums are only computed on weak checksum hits
+        candidates = table.get(weak)
+        if not candidates:
+            return None
+        strong = _strong(window)
+        for block_strong, index in candidates:
+            if block_strong == strong:
+                return index
+        return None
+
+    data = bytearray(data)
+    records = []
+    literal = bytearray()
+    literal_size = 0
+    pos = 0
+    weak = None
+    while pos < len(data):
+        if weak is None:
+            weak = _weak(data[pos:pos + size])
+        index = _match(data[pos:pos + size], weak) if weak in table else None
+        if index is not None:
+            if literal:
+                records.append(('D', bytes(literal)))
+                literal = bytearray()
+            records.append(('C', index))
+            pos = min(pos + size, len(data))
+            weak = None
+            continue
+        if pos + size < len(data):
+            literal.append(data[pos])
+            literal_size += 1
+            weak = _roll(weak, data[pos], data[pos + size], size)
+            pos += 1
+        elif 0 < tail < size and len(data) - tail > pos:
+            literal.extend(data[pos:len(data) - tail])
+            literal_size += len(data) - tail - pos
+            pos = len(data) - tail
+            weak = None
+        else:
+            literal.extend(data[pos:])
+            literal_size += len(data) - pos
+            pos = len(data)
+        if max_literal is not None and literal_size > max_literal:
+            return None
+    if literal:
+        records.append(('D', bytes(literal)))
+    return records
+
+
+def encode_delta(records):
+    """Return records encoded for `apply_delta`.
+
+    >>> (encode_delta([('C', 1), ('D', b'ab')]) ==
+    ...  b'C\\x00\\x00\\x00\\x01D\\x00\\x00\\x00\\x02abE')
+    True
+    """
+    chunks = []
+    for kind, value in records:
+        if kind == 'C':
+            chunks.append(b'C' + struct.pack('>I', value))
+        else:
+            chunks.append(b'D' + struct.pack('>I', len(value)) + value)
+    chunks.append(b'E')
+    return b''.join(chunks)
+
+
+def _read(delta_fd, size):
+    data = delta_fd.read(size)
+    if len(data) != size:
+        raise ValueError('Truncated delta')
+    return data
+
+
+def apply_delta(basis_fd, delta_fd, out_fd, size):
+    """Write to out_fd the file made of basis_fd blocks and delta_fd data."""
+    while True:
+        kind = _read(delta_fd, 1)
+        if kind == b'E':
+            return
+        value = struct.unpack('>I', _read(delta_fd, 4))[0]
+        if kind == b'C':
+            basis_fd.seek(value * size)
+            out_fd.write(basis_fd.read(size))
+        elif kind == b'D':
+            out_fd.write(_read(delta_fd, value))
+        else:
+            raise ValueError('Invalid delta record {!r}'.format(kind))
+
+
+def _patch(path, size, digest, delta_fd):
+    """Apply delta to path, replace it only if the result has digest."""
+    directory = os.path.dirname(os.path.abspath(path))
+    tmp_fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with open(path, 'rb') as basis_fd, os.fdopen(tmp_fd, 'wb') as out_fd:
+            apply_delta(basis_fd, delta_fd, out_fd, size)
+        with open(tmp_path, 'rb') as out_fd:
+            if hashlib.sha256(out_fd.read()).hexdigest() != digest:
+                raise ValueError('Digest mismatch')
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def _exec(ssh, action, helper, path, size, digest=''):
+    """Run the delta helper on a pssh SSHClient."""
+    command = _DELTA_CMD.format(helper=helper, action=action, path=path,
+                                block_size=size, digest=digest)
+    return ssh.exec_command(command, use_pty=False)
+
+
+def delta_put(ssh, src, dst, helper):
+    """Update dst from src on a pssh SSHClient sending changed blocks only.
+
+    `helper` is the path of this module on the remote host.
+    Return the number of bytes sent, or None if nothing was sent because a
+    full copy is needed: dst missing or too different, or helper failure.
+    """
+    with open(src, 'rb') as src_fd:
+        data = src_fd.read()
+    size = block_size(len(data))
+
+    channel, _, stdout, _, _ = _exec(ssh, 'signature', helper, dst, size)
+    output = stdout.read()
+    if channel.recv_exit_status() != 0:
+        return None
+    sig = json.loads(output.decode('utf-8'))
+
+    records = compute_delta(sig, data, size, len(data) * _MAX_LITERAL_RATIO)
+    if records is None:
+        return None
+    delta = encode_delta(records)
+    if len(delta) >= len(data):
+        return None
+
+    digest = hashlib.sha256(data).hexdigest()
+    channel, _, _, _, stdin = _exec(ssh, 'patch', helper, dst, size, digest)
+    stdin.write(delta)
+    stdin.flush()
+    channel.shutdown_write()
+    if channel.recv_exit_status() != 0:
+        return None
+    return len(delta)
+
+
+def main(args):
+    """Remote helper entry point.
+
+    signature PATH SIZE: print PATH blocks signature, fail if missing.
+    patch PATH SIZE DIGEST: apply delta read on stdin to PATH.
+    """
+    action, path, size = args[0], args[1], int(args[2])
+    if action == 'signature':
+        with open(path, 'rb') as path_fd:
+            print(json.dumps(signature(path_fd.read(), size)))
+    elif action == 'patch':
+        _patch(path, size, args[3], getattr(sys.stdin, 'buffer', sys.stdin))
+    else:
+        raise ValueError('Unknown action {}'.format(action))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main(sys.argv[1:])
@@ -0,0 +1,175 @@
+# -*- coding:utf-8 -*-
+"""iotlabsshcli fan-out of node commands from the frontends.
+
+This module only depends on the standard library: it is also copied on the
+frontends and run there, to run a command on the nodes of the site from
+inside the testbed network. One JSON line is printed per node as soon as
+its command completes.
+"""
+
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+from __future__ import print_function
+
+import os
+import sys
+import json
+import time
+import base64
+import hashlib
+import threading
+import subprocess
+
+# Nodes reached at once by the helper
+DEFAULT_PARALLEL = 32
+# Exit code of the frontend command when the helper is not there yet
+HELPER_MISSING = 100
+
+# ssh exit status when it fails to connect
+_SSH_ERROR = 255
+_SSH_OPTIONS = ['-T', '-o', 'BatchMode=yes',
+                '-o', 'StrictHostKeyChecking=no',
+                '-o', 'UserKnownHostsFile=/dev/null',
+                '-o', 'LogLevel=ERROR', '-o', 'ConnectTimeout=10']
+_FANOUT_CMD = ('test -f {helper} || exit {missing}; '
+               '$(command -v python3 || echo python) {helper} {request}')
+
+
+def source():
+    """Return the path of this module source."""
+    return os.path.splitext(__file__)[0] + '.py'
+
+
+def helper_path(directory):
+    """Return the remote path of this module in directory.
+
+    It is named after its digest, so that a new version gets copied.
+    """
+    with open(source(), 'rb') as source_fd:
+        digest = hashlib.sha256(source_fd.read()).hexdigest()[:12]
+    return '{}/.fanout-{}.py'.format(directory, digest)
+
+
+def encode_request(command, nodes, parallel=DEFAULT_PARALLEL, capture=0):
+    """Return the helper request as one shell word.
+
+    `capture` is the number of output bytes kept per node and stream.
+
+    >>> request = decode_request(encode_request('uptime', ['node-a8-1']))
+    >>> sorted(request.items())
+    ... # doctest: +NORMALIZE_WHITESPACE
+    [('capture', 0), ('command', 'uptime'), ('nodes', ['node-a8-1']),
+     ('parallel', 32)]
+    """
+    request = json.dumps({'command': command, 'nodes': nodes,
+                          'parallel': parallel, 'capture': capture})
+    return base64.urlsafe_b64encode(request.encode('utf-8')).decode('ascii')
+
+
+def decode_request(word):
+    """Return the request encoded by `encode_request`."""
+    return json.loads(base64.urlsafe_b64decode(word.encode('ascii'))
+                      .decode('utf-8'))
+
+
+# pylint:disable=too-many-arguments
+def fanout_command(helper, command, nodes, parallel=DEFAULT_PARALLEL,
+                   capture=0):
+    """Return the frontend command running command on nodes with helper.
+
+    It exits with HELPER_MISSING if helper must be copied first.
+    """
+    return _FANOUT_CMD.format(helper=helper, missing=HELPER_MISSING,
+                              request=encode_request(command, nodes,
+                                                     parallel, capture))
+
+
+def _tail(data, size):
+    """Return the last lines of data fitting in size bytes, as text.
+
+    >>> _tail(b'first\\nsecond\\n', 8)
+    'second\\n'
+    >>> _tail(b'first\\nsecond\\n', 0)
+    ''
+    """
+    if len(data) > size:
+        data = data[len(data) - size:]
+        data = data[data.find(b'\n') + 1:] if b'\n' in data else b''
+    return data.decode('utf-8', 'replace')
+
+
+def run_node(node, command, capture=0):
+    """Run command on node with ssh, return its result line fields.
+
+    'exit_code' is None if node could not be reached.
+    """
+    start = time.time()
+    with open(os.devnull, 'rb') as devnull:
+        process = subprocess.Popen(
+            ['ssh'] + _SSH_OPTIONS + ['root@{}'.format(node), command],
+            stdin=devnull, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+    exit_code = process.returncode
+    result = {'host': node,
+              'exit_code': None if exit_code == _SSH_ERROR else exit_code,
+              'duration': round(time.time() - start, 3)}
+    if capture:
+        result['stdout'] = _tail(stdout, capture)
+        result['stderr'] = _tail(stderr, capture)
+    return result
+
+
+def run(request, out=sys.stdout):
+    """Run request command on its nodes, `parallel` at once.
+
+    A JSON line is written to out per node as soon as it completes.
+    """
+    nodes = list(request['nodes'])
+    lock = threading.Lock()
+
+    def _worker():
+        while True:
+            with lock:
+                if not nodes:
+                    return
+                node = nodes.pop(0)
+            line = json.dumps(run_node(node, request['command'],
+                                       request['capture']))
+            with lock:
+                out.write(line + '\n')
+                out.flush()
+
+    workers = [threading.Thread(target=_worker)
+               for _ in range(min(request['parallel'], len(nodes)))]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def main(args):
+    """Remote helper entry point, args being an encoded request."""
+    run(decode_request(args[0]))
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main(sys.argv[1:])
@@ -22,210 +22,439 @@
 
 
 from __future__ import print_function
+import os
 import time
+
+import gevent
 from pssh.pssh_client import ParallelSSHClient, SSHClient
 from pssh import utils
 from pssh.exceptions import AuthenticationException, ConnectionErrorException
+from pssh.exceptions import ProxyError, SSHException, UnknownHostException
+# pssh patches the process with gevent, it must come before paramiko
+import paramiko
 from scp import SCPClient
 
+from ..cache import file_digest
+from .scheduler import SiteScheduler, DEFAULT_POOL_SIZE, DEFAULT_MAX_UPLOADS
+from .pool import ConnectionPool
+from .capture import OutputCapture
+from .boot import BootWaiter, tcp_probe
+from .result import Result
+from .timing import clock
+from .backend import SshBackend, OpenA8SshAuthenticationException
+from .backend import _CHECK_DIGEST_CMD, _transfer_stats, _compressed_stats
+from . import compression
+from . import delta as delta_transfer
+
+# Errors of hosts connections, through an overloaded frontend too
+_CONNECTION_ERRORS = (ConnectionErrorException, ProxyError, SSHException,
+                      UnknownHostException)
+
+
+_DELTA_HELPER = '.delta.py'
+# SSH port of the nodes, reached through their frontend
+_NODE_PORT = 22
+
+
+def _log_ready(node, latency):
+    """Log node boot, shown when verbose."""
+    utils.logger.info("%s booted in %.1f s", node, latency)
+
+
+def _exec_command(ssh, command):
+    """Run command on a pssh SSHClient, return True on success."""
+    if not command:
+        return True
+    channel = ssh.exec_command(command, use_pty=False)[0]
+    return channel.recv_exit_status() == 0
+
 
-def _cleanup_result(result):
-    """Remove empty list from result.
+def _scp_put(ssh, src, dst):
+    """Copy src to dst on a pssh SSHClient, return transfer statistics."""
+    sent = {}
 
-    >>> _cleanup_result({ '0': [], '1': []})
-    {}
-    >>> _cleanup_result({ '0': [1, 2, 3], '1': []})
-    {'0': [1, 2, 3]}
-    >>> _cleanup_result({ '0': [], '1': [1, 2, 3]})
-    {'1': [1, 2, 3]}
-    >>> sorted(_cleanup_result({ '0': [1, 2, 3], '1': [4, 5, 6]}).items())
-    [('0', [1, 2, 3]), ('1', [4, 5, 6])]
+    def _progress(filename, size, sent_bytes):
+        # pylint:disable=unused-argument
+        sent[filename] = sent_bytes
+
+    start = time.time()
+    with SCPClient(ssh.client.get_transport(), progress=_progress) as scp:
+        scp.put(src, dst)
+    return _transfer_stats(sum(sent.values()), time.time() - start)
+
+
+def _compressed_put(ssh, src, dst):
+    """Copy src to dst compressed on a pssh SSHClient.
+
+    Return transfer statistics, or None if nothing was copied because
+    compression is not worth it or failed on the remote host.
     """
-    key_to_del = []
-    for key, value in result.items():
-        if value == []:
-            key_to_del.append(key)
-    for key in key_to_del:
-        del result[key]
-
-    return result
-
-
-def _extend_result(result, new_result):
-    """ Extend result dictionnary values with new result
-    dictionnary values
-
-    >>> result = {'0': [], '1': []}
-    >>> result == _extend_result(
-    ...    { '0': [], '1': []}, { '0': [], '1': []})
-    True
-
-    >>> result = {'0': ['node-a8-1.saclay.iot-lab.info'],
-    ...           '1': []}
-    >>> result == _extend_result({ '0': [], '1': []},
-    ...    { '0': ['node-a8-1.saclay.iot-lab.info'], '1': []})
-    True
-
-    >>> result = {'0': ['node-a8-1.saclay.iot-lab.info',
-    ...                 'node-a8-2.saclay.iot-lab.info'],
-    ...           '1': ['node-a8-3.saclay.iot-lab.info']}
-    >>> result == _extend_result(
-    ...    { '0': ['node-a8-1.saclay.iot-lab.info'], '1': []},
-    ...    { '0': ['node-a8-2.saclay.iot-lab.info'],
-    ...      '1': ['node-a8-3.saclay.iot-lab.info']})
-    True
-
-    >>> result = {'0': ['node-a8-1.saclay.iot-lab.info',
-    ...                 'node-a8-2.saclay.iot-lab.info'],
-    ...           '1': ['node-a8-3.saclay.iot-lab.info']}
-    >>> result ==_extend_result(
-    ...    { '0': ['node-a8-1.saclay.iot-lab.info',
-    ...            'node-a8-2.saclay.iot-lab.info'],
-    ...      '1': ['node-a8-3.saclay.iot-lab.info']},
-    ...    { '0': [], '1': ['node-a8-3.saclay.iot-lab.info']})
-    True
-
-    >>> result =  {'0': ['node-a8-1.saclay.iot-lab.info',
-    ...                  'node-a8-2.saclay.iot-lab.info',
-    ...                  'node-a8-3.saclay.iot-lab.info'],
-    ...            '1': []}
-    >>> result == _extend_result(
-    ...    { '0': ['node-a8-1.saclay.iot-lab.info',
-    ...            'node-a8-2.saclay.iot-lab.info'],
-    ...      '1': ['node-a8-3.saclay.iot-lab.info']},
-    ...    { '0': ['node-a8-3.saclay.iot-lab.info'], '1': []})
-    True
+    size = os.path.getsize(src)
+    codec = compression.choose(
+        src, size, lambda: _exec_command(ssh, compression.HAS_ZSTD_CMD))
+    if codec is None:
+        return None
+    start = time.time()
+    command = compression.put_command(codec, dst, file_digest(src))
+    channel, _, _, _, stdin = ssh.exec_command(command, use_pty=False)
+    sent = 0
+    for chunk in compression.stream(src, codec, size):
+        stdin.write(chunk)
+        sent += len(chunk)
+    stdin.flush()
+    channel.shutdown_write()
+    if channel.recv_exit_status() != 0:
+        return None
+    return _compressed_stats(size, sent, codec, time.time() - start)
+
+
+def _time_commands(client, timings):
+    """Measure the 'connect' phase of the hosts of a ParallelSSHClient.
+
+    It lasts until the command is started: proxy connection, tunnel,
+    authentication and session opening. Return start time of commands.
     """
-    result["0"] = sorted(list(set(result["0"] + new_result["0"])))
-    result["1"] = sorted(list(set(result["1"]) - set(new_result["0"])))
-    result["1"] = sorted(list(set(result["1"]) | set(new_result["1"])))
-    return result
-
-
-def _check_all_nodes_processed(result):
-    """Verify all nodes are successful or failed.
-
-    >>> _check_all_nodes_processed({ 'saclay': [], 'grenoble': []})
-    True
-    >>> _check_all_nodes_processed(
-    ...    { 'saclay': ['node-a8-1.saclay.iot-lab.info'],
-    ...      'grenoble': []})
-    False
-    >>> _check_all_nodes_processed(
-    ...    { 'saclay': ['node-a8-1.saclay.iot-lab.info'],
-    ...      'grenoble': ['node-a8-10.grenoble.iot-lab.info']})
-    False
+    started = {}
+    run_command = client._run_command  # pylint:disable=protected-access
+
+    def _run_command(host, *args, **kwargs):
+        with timings.measure('connect', host=host):
+            ret = run_command(host, *args, **kwargs)
+        started[host] = clock()
+        return ret
+
+    client._run_command = _run_command  # pylint:disable=protected-access
+    return started
+
+
+def _adapt_commands(client, limit):
+    """Report hosts connection latency and errors to an AimdLimit."""
+    run_command = client._run_command  # pylint:disable=protected-access
+
+    def _run_command(host, *args, **kwargs):
+        start = clock()
+        try:
+            ret = run_command(host, *args, **kwargs)
+        except _CONNECTION_ERRORS:
+            limit.report(False)
+            raise
+        limit.report(True, clock() - start)
+        return ret
+
+    client._run_command = _run_command  # pylint:disable=protected-access
+
+
+def _open_tunnel(proxy, host, timeout):
+    """Return a 'direct-tcpip' channel to host over pssh SSHClient proxy."""
+    transport = proxy.client.get_transport()
+    try:
+        if transport is None or not transport.is_active():
+            raise paramiko.SSHException('proxy connection closed')
+        return transport.open_channel('direct-tcpip', (host, _NODE_PORT),
+                                      ('127.0.0.1', 0), timeout=timeout)
+    except (paramiko.SSHException, EOFError) as err:
+        raise ConnectionErrorException(
+            "Error connecting to host '%s:%s' - %s", host, _NODE_PORT,
+            str(err))
+
+
+def _tunnel_commands(client, proxy, timeout):
+    """Connect the hosts of a ParallelSSHClient through a proxy connection.
+
+    Hosts are reached over channels of the one transport of the pssh
+    SSHClient `proxy`, as with an OpenSSH ControlMaster: each host only
+    costs its own handshake, not a new one with the proxy too.
+    """
+    # pylint:disable=protected-access
+    make_ssh_client = client._make_ssh_client
+
+    def _make_ssh_client(host, **paramiko_kwargs):
+        if client.host_clients.get(host) is None:
+            paramiko_kwargs['sock'] = _open_tunnel(proxy, host, timeout)
+        return make_ssh_client(host, **paramiko_kwargs)
+
+    client._make_ssh_client = _make_ssh_client
+
+
+def _proxy_unreachable(output, hosts):
+    """Return True if hosts missing from pssh output failed to connect.
+
+    Proxy errors are given under the proxy host name instead of the host,
+    connection errors, as a reset by an overloaded frontend, are no
+    authentication error.
     """
-    return not any(result.values())
+    errors = [host_output.get('exception')
+              for host, host_output in output.items() if host not in hosts]
+    return bool(errors) and all(isinstance(error, _CONNECTION_ERRORS)
+                                for error in errors)
 
 
-class OpenA8SshAuthenticationException(Exception):
-    """Raised when an authentication error occurs on one site"""
+def _time_command(timings, host, host_output, started):
+    """Measure the 'command' phase of host, until its exit status."""
+    host_output['channel'].recv_exit_status()
+    timings.add('command', clock() - started[host], host=host)
 
-    def __init__(self, site):
-        msg = ('Cannot connect to IoT-LAB server on site '
-               '"{}", check your SSH configuration.'.format(site))
-        super(OpenA8SshAuthenticationException, self).__init__(msg)
-        self.msg = msg
 
+def _report_command(on_host, host, host_output):
+    """Give the exit status of host to on_host once its command exits."""
+    channel = host_output['channel']
+    on_host(host, None if channel is None else channel.recv_exit_status())
 
-class OpenA8Ssh(object):
-    """Implement SshAPI for Parallel SSH."""
 
-    def __init__(self, config_ssh, groups, verbose=False):
-        self.config_ssh = config_ssh
-        self.groups = groups
-        self.verbose = verbose
+class OpenA8Ssh(SshBackend):
+    """Implement SshBackend for Parallel SSH."""
+
+    # pylint: disable=too-many-arguments
+    def __init__(self, config_ssh, groups, verbose=False,
+                 pool_size=DEFAULT_POOL_SIZE, max_sessions=None,
+                 max_uploads=DEFAULT_MAX_UPLOADS, upload_cache=None,
+                 connections=None, timings=False):
+        super(OpenA8Ssh, self).__init__(config_ssh, groups, verbose,
+                                        upload_cache, timings)
+        self.scheduler = SiteScheduler(pool_size, max_sessions, max_uploads)
+        self._own_connections = connections is None
+        if connections is None:
+            connections = ConnectionPool()
+        self.connections = connections
 
         if self.verbose:
             utils.enable_logger(utils.logger)
 
-    def run(self, command, with_proxy=True, **kwargs):
-        """Run ssh command using Parallel SSH."""
-        result = {"0": [], "1": []}
-        for site, hosts in self.groups.items():
-            proxy_host = '{}.iot-lab.info'.format(site) if with_proxy else None
-            hosts = hosts if with_proxy else ['{}.iot-lab.info'.format(site)]
-            result_cmd = self.run_command(command,
-                                          hosts=hosts,
-                                          user=self.config_ssh['user'],
-                                          verbose=self.verbose,
-                                          proxy_host=proxy_host,
-                                          **kwargs)
-            result = _extend_result(result, result_cmd)
-
-        return _cleanup_result(result)
-
-    def scp(self, src, dst):
-        """Copy file to  using Parallel SSH copy_file"""
-        result = {"0": [], "1": []}
-        sites = ['{}.iot-lab.info'.format(site) for site in self.groups]
-        for site in sites:
+    def close(self):
+        """Close all connections kept open, unless shared."""
+        if self._own_connections:
+            self.connections.close()
+
+    def map_sites(self, func):
+        """Call func(site, hosts) in one greenlet per site."""
+        return self.scheduler.map(func, self.groups)
+
+    def run_site_direct(self, site, hosts, command, with_proxy=True,
+                        **kwargs):
+        """Run ssh command on hosts of one site, or on its frontend.
+
+        Return a Result.
+        """
+        frontend = self._frontend_host(site)
+        if not with_proxy:
+            return self.run_command(command,
+                                    hosts=[frontend],
+                                    user=self.config_ssh['user'],
+                                    port=self.config_ssh.get('port'),
+                                    pkey=self.config_ssh.get('pkey'),
+                                    pool=self.scheduler.site_pool(site),
+                                    connections=self.connections,
+                                    timings=self.timings,
+                                    **kwargs)
+        result = self._run_nodes(site, hosts, command, **kwargs)
+        utils.logger.info("%s: %s", frontend,
+                          self.scheduler.limits[site].summary())
+        return result
+
+    def _run_nodes(self, site, hosts, command, **kwargs):
+        """Run ssh command on hosts of one site through its frontend.
+
+        Hosts connections are channels of the pooled frontend connection.
+        Return a Result.
+        """
+        frontend = self._frontend_host(site)
+        pool = self.scheduler.site_pool(site)
+        try:
+            with self.timings.measure('connect', host=frontend):
+                tunnel = self._frontend(site)
+        except _CONNECTION_ERRORS:
+            result = Result()
+            for host in hosts:
+                result.add(host, None)
+            return result
+        return self.run_command(command,
+                                hosts=hosts,
+                                user=self.config_ssh['user'],
+                                proxy_host=frontend,
+                                pkey=self.config_ssh.get('pkey'),
+                                pool=pool,
+                                connections=self.connections,
+                                timings=self.timings,
+                                tunnel=tunnel,
+                                **kwargs)
+
+    # pylint: disable=too-many-arguments
+    def scp_site(self, site, src, dst, before=None, after=None, delta=False):
+        """Copy file to the frontend of one site.
+
+        Optional `before` and `after` commands are run on the same
+        connection, the copy fails if one of them fails. Return a Result.
+        """
+        with self.timings.measure('copy', site=site):
+            return self._scp_site(site, src, dst, before, after, delta)
+
+    # pylint: disable=too-many-arguments
+    def _scp_site(self, site, src, dst, before, after, delta):
+        result = Result()
+        frontend = self._frontend_host(site)
+        timings = self.timings
+        try:
+            with timings.measure('connect', host=frontend):
+                ssh = self._frontend(site)
+        except _CONNECTION_ERRORS:
+            result.add(frontend, None)
+            return result
+
+        with timings.measure('before', host=frontend):
+            success = _exec_command(ssh, before)
+        if success:
+            with timings.measure('upload', host=frontend):
+                stats = self._upload(ssh, frontend, src, dst, delta)
+            result.add_detail('transfers', frontend, stats)
+            with timings.measure('after', host=frontend):
+                success = _exec_command(ssh, after)
+        result.add(frontend, 0 if success else 1)
+        return result
+
+    def _frontend(self, site):
+        """Return the pooled connection to the frontend of site."""
+        user = self.config_ssh['user']
+        frontend = self._frontend_host(site)
+        try:
+            return self.connections.get_or_create(
+                lambda: SSHClient(frontend, user=user,
+                                  port=self.config_ssh.get('port'),
+                                  pkey=self.config_ssh.get('pkey'),
+                                  timeout=10),
+                frontend, user)
+        except AuthenticationException:
+            raise OpenA8SshAuthenticationException(frontend)
+
+    # pylint: disable=too-many-arguments
+    def _upload(self, ssh, frontend, src, dst, delta=False):
+        """Copy src to dst on frontend unless already there."""
+        cache = self.upload_cache
+        if cache is None:
+            return self._put(ssh, frontend, src, dst, delta)
+
+        digest = cache.digest(src)
+        check_cmd = _CHECK_DIGEST_CMD.format(dst=dst, digest=digest)
+        if (cache.is_fresh(frontend, dst, digest) or
+                _exec_command(ssh, check_cmd)):
+            stats = _transfer_stats(0, 0)
+            stats['cached'] = True
+        else:
+            stats = self._put(ssh, frontend, src, dst, delta)
+        cache.add(frontend, dst, digest)
+        return stats
+
+    # pylint: disable=too-many-arguments
+    def _put(self, ssh, frontend, src, dst, delta=False):
+        """Copy src to dst on frontend, using delta transfer if asked.
+
+        Files are sent compressed if the backend `compress` and a delta
+        transfer is not possible, with scp otherwise.
+        """
+        if delta:
+            # The delta helper is this module, copied next to dst
+            helper = os.path.join(os.path.dirname(dst), _DELTA_HELPER)
+            helper_src = os.path.splitext(delta_transfer.__file__)[0] + '.py'
+            self._upload(ssh, frontend, helper_src, helper)
+            with self.scheduler.uploads:
+                start = time.time()
+                sent = delta_transfer.delta_put(ssh, src, dst, helper)
+                duration = time.time() - start
+            if sent is not None:
+                stats = _transfer_stats(sent, duration)
+                stats['delta'] = True
+                return stats
+        with self.scheduler.uploads:
+            stats = _compressed_put(ssh, src, dst) if self.compress else None
+            return stats or _scp_put(ssh, src, dst)
+
+    def wait(self, max_wait, on_ready=None):
+        """Wait for requested A8 nodes until they boot.
+
+        Each node is probed on its own with backoff: its SSH port is first
+        reached through the frontend, then uptime is run on it.
+        `on_ready(node, latency)` is called as soon as a node is ready,
+        boot latencies are given in the 'latency' entry of the result.
+        """
+        waiter = BootWaiter(self._probe_node, self._check_node,
+                            on_ready=on_ready or _log_ready)
+        result = waiter.wait(self.groups, max_wait)
+        for node, latency in result.details.get('latency', {}).items():
+            self.timings.add('boot', latency, host=node)
+        return self.as_dict(result)
+
+    def _probe_node(self, site, node):
+        """Return True if node SSH server answers through its frontend."""
+        with self.timings.measure('probe', host=node):
             try:
-                ssh = SSHClient(site, user=self.config_ssh['user'], timeout=10)
-            except AuthenticationException:
-                raise OpenA8SshAuthenticationException(site)
-            except ConnectionErrorException:
-                result["1"].append(site)
-            else:
-                with SCPClient(ssh.client.get_transport()) as scp:
-                    scp.put(src, dst)
-                ssh.client.close()
-                result["0"].append(site)
-        return _cleanup_result(result)
-
-    def wait(self, max_wait):
-        """Wait for requested A8 nodes until they boot"""
-        result = {"0": [], "1": []}
-        start_time = time.time()
-        groups = self.groups.copy()
-        while (start_time + max_wait > time.time() and
-               not _check_all_nodes_processed(groups)):
-            for site, hosts in groups.copy().items():
-                proxy_host = '{}.iot-lab.info'.format(site)
-                result_cmd = self.run_command("uptime",
-                                              hosts=hosts,
-                                              user=self.config_ssh['user'],
-                                              verbose=self.verbose,
-                                              proxy_host=proxy_host)
-                groups[site] = result_cmd["1"]
-                groups = _cleanup_result(groups)
-                result = _extend_result(result, result_cmd)
-
-        return _cleanup_result(result)
+                ssh = self._frontend(site)
+            except _CONNECTION_ERRORS:
+                return False
+            return tcp_probe(ssh.client.get_transport(), node)
+
+    def _check_node(self, site, node):
+        """Return True if a command can be run on node."""
+        return self._run_nodes(site, [node], 'uptime').success(node)
 
     # pylint: disable=too-many-arguments
     @staticmethod
-    def run_command(command, hosts, user, verbose=False, proxy_host=None,
-                    timeout=10, **kwargs):
-        """Run ssh command using Parallel SSH."""
-        result = {"0": [], "1": []}
-        if proxy_host:
+    def run_command(command, hosts, user, proxy_host=None, timeout=10,
+                    pool=None, connections=None, capture=None, port=None,
+                    pkey=None, timings=None, tunnel=None, on_host=None,
+                    **kwargs):
+        """Run ssh command using Parallel SSH, return a Result."""
+        result = Result()
+        if proxy_host and tunnel is not None:
+            client = ParallelSSHClient(hosts, user='root', pkey=pkey,
+                                       timeout=timeout)
+            _tunnel_commands(client, tunnel, timeout)
+        elif proxy_host:
             client = ParallelSSHClient(hosts, user='root',
+                                       pkey=pkey,
                                        proxy_host=proxy_host,
+                                       proxy_port=port or 22,
                                        proxy_user=user,
+                                       proxy_pkey=pkey,
                                        timeout=timeout)
         else:
-            client = ParallelSSHClient(hosts, user=user, timeout=timeout)
+            client = ParallelSSHClient(hosts, user=user, port=port,
+                                       pkey=pkey, timeout=timeout)
+        if pool is not None:
+            client.pool = pool
+            if getattr(pool, 'limit', None) is not None:
+                _adapt_commands(client, pool.limit)
+        if connections is not None:
+            connections.checkout(client, user, proxy_host)
+        if timings is not None:
+            started = _time_commands(client, timings)
         output = client.run_command(command, stop_on_errors=False,
                                     **kwargs)
+        if capture is None:
+            # Only drain output: unread output stalls commands once the
+            # channel window is full, and is logged when verbose
+            capture = OutputCapture(max_bytes=0)
+        readers = capture.start(output)
+        waiters = []
+        if timings is not None:
+            waiters += [gevent.spawn(_time_command, timings, host,
+                                     output[host], started)
+                        for host in started]
+        if on_host is not None:
+            waiters += [gevent.spawn(_report_command, on_host, host,
+                                     output[host])
+                        for host in hosts if host in output]
         client.join(output)
+        capture.join(readers)
+        gevent.joinall(waiters)
+        if connections is not None:
+            connections.checkin(client, user, proxy_host)
+        missing = [host for host in hosts if host not in output]
+        if missing and not _proxy_unreachable(output, hosts):
+            # Pssh AuthenticationException duplicate output dict key
+            # {'saclay.iot-lab.info': {'exception': ...},
+            # {'saclay.iot-lab.info_qzhtyxlt': {'exception': ...}}
+            site = next(iter(sorted(output)))
+            raise OpenA8SshAuthenticationException(site)
         for host in hosts:
-            if host not in output:
-                # Pssh AuthenticationException duplicate output dict key
-                # {'saclay.iot-lab.info': {'exception': ...},
-                # {'saclay.iot-lab.info_qzhtyxlt': {'exception': ...}}
-                site = next(iter(sorted(output)))
-                raise OpenA8SshAuthenticationException(site)
-            result['0' if output[host]['exit_code'] == 0
-                   else '1'].append(host)
-        if verbose:
-            for host in hosts:
-                # Pssh >= 1.0.0: stdout is None instead of generator object
-                # when you have ConnectionErrorException
-                stdout = output[host].get('stdout')
-                if stdout:
-                    for _ in stdout:
-                        pass
-
+            result.add(host, output[host]['exit_code']
+                       if host in output else None)
         return result
@@ -0,0 +1,218 @@
+# -*- coding:utf-8 -*-
+"""iotlabsshcli pipeline fusing remote steps in few executions."""
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+from .result import Result, Reporter
+
+
+class _Step(object):  # pylint:disable=too-few-public-methods
+    """One command run on nodes or frontends."""
+
+    def __init__(self, command, check=True):
+        self.command = command
+        self.check = check
+
+    def __str__(self):
+        if self.check:
+            return self.command
+        return '{{ {} || true; }}'.format(self.command)
+
+
+def _join(steps):
+    """Join steps in one shell command stopping at the first checked failure.
+
+    >>> _join([_Step('mkdir -p dir'), _Step('chmod +x dir/script')])
+    'mkdir -p dir && chmod +x dir/script'
+    >>> _join([_Step('screen -X quit', check=False), _Step('screen -dm ls')])
+    '{ screen -X quit || true; } && screen -dm ls'
+    >>> _join([]) is None
+    True
+    """
+    return ' && '.join(str(step) for step in steps) or None
+
+
+def _final(on_host, last):
+    """Return on_host given failures, and successes of the last execution.
+
+    Hosts failing an execution are not run by the next ones.
+    """
+    if on_host is None:
+        return None
+
+    def _on_host(host, exit_code):
+        if last or exit_code != 0:
+            on_host(host, exit_code)
+    return _on_host
+
+
+class _Execution(object):
+    """Steps run together on the same target, in one remote execution.
+
+    Frontend executions may hold one upload, steps before and after it
+    being run on the same connection.
+    """
+
+    def __init__(self, with_proxy, kwargs, hosts=None):
+        self.with_proxy = with_proxy
+        self.kwargs = kwargs
+        self.hosts = hosts
+        self.before = []
+        self.upload = None
+        self.after = []
+
+    def accepts(self, with_proxy, kwargs, upload=None, hosts=None):
+        """Return True if a step with these parameters can be fused."""
+        return (self.with_proxy == with_proxy and self.kwargs == kwargs and
+                self.hosts == hosts and not (upload and self.upload))
+
+    def selects(self, hosts):
+        """Return the hosts the execution runs on, among the given ones."""
+        if self.hosts is None:
+            return hosts
+        return [host for host in hosts if host in self.hosts]
+
+    def add(self, step=None, upload=None):
+        """Add a step or an upload."""
+        if upload is not None:
+            self.upload = upload
+        elif self.upload is None:
+            self.before.append(step)
+        else:
+            self.after.append(step)
+
+    # pylint: disable=too-many-arguments
+    def run_site(self, ssh, site, hosts, expires=None, on_host=None):
+        """Run the execution for site, on hosts or on its frontend.
+
+        Failed hosts are run again as allowed by the backend retry policy,
+        their final exit code given to `on_host(host, exit_code)`.
+        """
+        if self.upload is not None:
+            src, dst, kwargs = self.upload
+            return ssh.retry_site(
+                hosts, lambda *_: ssh.scp_site(site, src, dst,
+                                               before=_join(self.before),
+                                               after=_join(self.after),
+                                               **kwargs),
+                expires=expires, on_host=on_host)
+        return ssh.retry_site(
+            hosts, lambda hosts, on_host: ssh.run_site(
+                site, hosts, _join(self.before), self.with_proxy,
+                on_host=on_host, **self.kwargs),
+            expires=expires, on_host=on_host)
+
+
+class Pipeline(object):
+    """Remote steps fused in as few remote executions as possible.
+
+    Consecutive steps on the same target with the same parameters are
+    joined in one shell command, frontends steps surrounding an upload share
+    its connection. Each site goes through its executions independently of
+    the others, nodes failing one are not run by the next ones.
+    """
+
+    def __init__(self, ssh):
+        self.ssh = ssh
+        self.executions = []
+
+    def _execution(self, with_proxy, kwargs, upload=None, hosts=None):
+        if (not self.executions or
+                not self.executions[-1].accepts(with_proxy, kwargs, upload,
+                                                hosts)):
+            self.executions.append(_Execution(with_proxy, kwargs, hosts))
+        return self.executions[-1]
+
+    # pylint: disable=too-many-arguments
+    def run(self, command, with_proxy=True, check=True, hosts=None,
+            **kwargs):
+        """Add a command on nodes, or on the frontends without proxy.
+
+        Failure of a command added with `check=False` is ignored. With
+        `hosts`, only these nodes run the command, or the frontends of
+        their sites, other nodes going on to the next steps.
+        """
+        if hosts is not None:
+            hosts = frozenset(hosts)
+        self._execution(with_proxy, kwargs, hosts=hosts).add(
+            _Step(command, check))
+
+    def upload(self, src, dst, **kwargs):
+        """Add a copy of src to dst on the frontends.
+
+        kwargs are given to `SshBackend.scp_site`.
+        """
+        self._execution(False, {}, upload=True).add(upload=(src, dst, kwargs))
+
+    def execute(self, on_host=None):
+        """Run all sites through the pipeline, return the last step result.
+
+        Pipelines with node executions report nodes, the nodes of a site
+        failing with its frontend executions. Other pipelines report
+        frontends. Details, like transfers, of all executions are kept.
+        The final exit code of reported hosts is given to
+        `on_host(host, exit_code)` as soon as known.
+        """
+        result = Result()
+        expires = self.ssh.expires()
+        results = self.ssh.map_sites(
+            lambda site, hosts: self._execute_site(site, hosts, expires,
+                                                   on_host))
+        for result_site in results.values():
+            result.update(result_site)
+        return self.ssh.as_dict(result)
+
+    def _execute_site(self, site, hosts, expires=None, on_host=None):
+        on_nodes = any(execution.with_proxy for execution in self.executions)
+        report = None if on_host is None else Reporter(on_host)
+        # Executions on the reported hosts
+        reported = [execution for execution in self.executions
+                    if execution.with_proxy == on_nodes]
+        result = Result()
+        for execution in self.executions:
+            if execution.with_proxy and not hosts:
+                break
+            selected = execution.selects(hosts)
+            if execution.hosts is not None and not selected:
+                continue
+            final = None
+            if execution.with_proxy == on_nodes:
+                final = _final(report, execution is reported[-1])
+            result_exec = execution.run_site(self.ssh, site, selected,
+                                             expires, final)
+            if execution.with_proxy:
+                result.update(result_exec)
+                hosts = sorted(set(hosts) - set(selected) |
+                               set(result_exec.successes))
+            elif on_nodes:
+                result.update_details(result_exec)
+                if result_exec.failures:
+                    for host in selected:
+                        result.add(host, None, attempts=0)
+                    hosts = [host for host in hosts if host not in selected]
+                    if not hosts:
+                        break
+            else:
+                result.update(result_exec)
+                if result_exec.failures:
+                    break
+        if report is not None:
+            report.flush(result)
+        return result
@@ -0,0 +1,119 @@
+# -*- coding:utf-8 -*-
+"""iotlabsshcli pool of authenticated SSH connections."""
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import time
+from collections import defaultdict
+
+from gevent.lock import RLock
+
+# Seconds after which an unused connection is closed
+DEFAULT_MAX_IDLE = 60
+
+
+def _is_alive(ssh):
+    """Return True if the pssh SSHClient transport is still usable."""
+    transport = ssh.client.get_transport()
+    return transport is not None and transport.is_active()
+
+
+def _close(ssh):
+    """Close a pssh SSHClient and its proxy client if any."""
+    ssh.client.close()
+    if getattr(ssh, 'proxy_client', None) is not None:
+        ssh.proxy_client.close()
+
+
+class ConnectionPool(object):
+    """Authenticated pssh SSHClient objects keyed by (proxy, host, user).
+
+    Connections are reused across the commands and copies of one
+    invocation, closed once idle for more than `max_idle` seconds or on
+    explicit `close`.
+    """
+
+    def __init__(self, max_idle=DEFAULT_MAX_IDLE):
+        self.max_idle = max_idle
+        self._clients = {}
+        self._locks = defaultdict(RLock)
+
+    def __len__(self):
+        return len(self._clients)
+
+    def get(self, host, user, proxy_host=None):
+        """Return the live connection to host or None."""
+        key = (proxy_host, host, user)
+        ssh, _ = self._clients.get(key, (None, None))
+        if ssh is not None and not _is_alive(ssh):
+            self.discard(host, user, proxy_host)
+            ssh = None
+        if ssh is not None:
+            self._clients[key] = (ssh, time.time())
+        return ssh
+
+    def put(self, ssh, host, user, proxy_host=None):
+        """Store connection to host."""
+        self._clients[(proxy_host, host, user)] = (ssh, time.time())
+
+    def get_or_create(self, factory, host, user, proxy_host=None):
+        """Return the live connection to host, opened by factory if none.
+
+        Concurrent callers for the same host share a single connection.
+        """
+        with self._locks[(proxy_host, host, user)]:
+            ssh = self.get(host, user, proxy_host)
+            if ssh is None:
+                ssh = factory()
+                self.put(ssh, host, user, proxy_host)
+        return ssh
+
+    def discard(self, host, user, proxy_host=None):
+        """Close and forget connection to host."""
+        ssh, _ = self._clients.pop((proxy_host, host, user), (None, None))
+        if ssh is not None:
+            _close(ssh)
+
+    def checkout(self, client, user, proxy_host=None):
+        """Give the pooled connections of its hosts to a ParallelSSHClient."""
+        self.evict_idle()
+        for host in client.hosts:
+            ssh = self.get(host, user, proxy_host)
+            if ssh is not None:
+                client.host_clients[host] = ssh
+
+    def checkin(self, client, user, proxy_host=None):
+        """Store connections opened by a ParallelSSHClient."""
+        for host, ssh in client.host_clients.items():
+            if ssh is not None:
+                self.put(ssh, host, user, proxy_host)
+
+    def evict_idle(self):
+        """Close connections unused for more than `max_idle` seconds."""
+        deadline = time.time() - self.max_idle
+        for key, (_, last_used) in list(self._clients.items()):
+            if last_used < deadline:
+                proxy_host, host, user = key
+                self.discard(host, user, proxy_host)
+
+    def close(self):
+        """Close all connections."""
+        for proxy_host, host, user in list(self._clients):
+            self.discard(host, user, proxy_host)
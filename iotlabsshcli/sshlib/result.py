@@ -0,0 +1,160 @@
+# -*- coding:utf-8 -*-
+"""iotlabsshcli status of hosts through commands."""
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+import threading
+import time
+
+
+class Result(object):
+    """Status of hosts, updated host by host.
+
+    Each host has its last exit code, its number of attempts and the time
+    of its last attempt. Per host `details`, such as 'transfers' statistics,
+    are kept by name. The {"0": [...], "1": [...]} view of successful and
+    failed hosts is only sorted when built by `as_dict`.
+
+    >>> result = Result()
+    >>> result.add('node-2', 0)
+    >>> result.add('node-1', 1)
+    >>> result.add('node-1', 0)
+    >>> result.add('node-3', None)
+    >>> result.add_detail('latency', 'node-1', 12.5)
+    >>> sorted(result.as_dict().items())
+    ... # doctest: +NORMALIZE_WHITESPACE
+    [('0', ['node-1', 'node-2']), ('1', ['node-3']),
+     ('latency', {'node-1': 12.5})]
+    >>> result.attempts('node-1'), result.exit_code('node-3')
+    (2, None)
+    """
+
+    def __init__(self):
+        # host: [exit_code, attempts, time]
+        self.hosts = {}
+        self.details = {}
+        self._successes = set()
+        self._failures = set()
+
+    def __len__(self):
+        return len(self.hosts)
+
+    def add(self, host, exit_code, attempts=1, timestamp=None):
+        """Record an exit code of host, None if it could not be reached."""
+        entry = self.hosts.get(host)
+        if entry is None:
+            entry = self.hosts[host] = [None, 0, None]
+        entry[0] = exit_code
+        entry[1] += attempts
+        entry[2] = timestamp or time.time()
+        if exit_code == 0:
+            self._failures.discard(host)
+            self._successes.add(host)
+        else:
+            self._successes.discard(host)
+            self._failures.add(host)
+
+    def add_detail(self, name, host, value):
+        """Record the `name` detail of host."""
+        self.details.setdefault(name, {})[host] = value
+
+    def update(self, other):
+        """Merge hosts and details of other result, return self."""
+        for host, (exit_code, attempts, timestamp) in other.hosts.items():
+            self.add(host, exit_code, attempts, timestamp)
+        return self.update_details(other)
+
+    def update_details(self, other):
+        """Merge details of other result, return self."""
+        for name, values in other.details.items():
+            self.details.setdefault(name, {}).update(values)
+        return self
+
+    def success(self, host):
+        """Return True if last attempt on host succeeded."""
+        return host in self._successes
+
+    def exit_code(self, host):
+        """Return last exit code of host."""
+        return self.hosts[host][0]
+
+    def attempts(self, host):
+        """Return the number of attempts on host."""
+        return self.hosts[host][1]
+
+    @property
+    def successes(self):
+        """Sorted successful hosts."""
+        return sorted(self._successes)
+
+    @property
+    def failures(self):
+        """Sorted failed hosts."""
+        return sorted(self._failures)
+
+    def as_dict(self):
+        """Return successful hosts in '0', failed ones in '1' and details.
+
+        Empty entries are left out.
+        """
+        result = dict((name, values)
+                      for name, values in self.details.items() if values)
+        if self._successes:
+            result['0'] = self.successes
+        if self._failures:
+            result['1'] = self.failures
+        return result
+
+
+class Reporter(object):
+    """Status of hosts reported once each, as soon as it is known.
+
+    `on_host(host, exit_code)` is called the first time a host is given,
+    from any thread. `flush` reports the hosts of a complete Result not
+    reported yet.
+
+    >>> reported = []
+    >>> report = Reporter(lambda *status: reported.append(status))
+    >>> report('node-1', 0)
+    >>> report('node-1', 1)
+    >>> result = Result()
+    >>> result.add('node-1', 0)
+    >>> result.add('node-2', None)
+    >>> report.flush(result)
+    >>> reported
+    [('node-1', 0), ('node-2', None)]
+    """
+
+    def __init__(self, on_host):
+        self.on_host = on_host
+        self.reported = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, host, exit_code):
+        with self._lock:
+            if host in self.reported:
+                return
+            self.reported.add(host)
+        self.on_host(host, exit_code)
+
+    def flush(self, result):
+        """Report hosts of result not reported yet, in order."""
+        for host in sorted(result.hosts):
+            self(host, result.exit_code(host))
@@ -0,0 +1,168 @@
+# -*- coding:utf-8 -*-
+"""iotlabsshcli retry of failed hosts with backoff."""
+
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import random
+import time
+
+from .timing import clock
+
+# Failures worth another attempt: unreachable hosts, non-zero exit codes
+RETRY_CONNECTION = 'connection'
+RETRY_EXIT = 'exit'
+RETRY_ON = (RETRY_CONNECTION, RETRY_EXIT)
+DEFAULT_MAX_ATTEMPTS = 3
+# Delays between two attempts, in seconds
+DEFAULT_INITIAL_DELAY = 1
+DEFAULT_MAX_DELAY = 10
+
+
+class Backoff(object):
+    """Exponential backoff with jitter.
+
+    Delays are randomly taken between (1 - jitter) and 1 times the
+    exponential delay, so hosts attempted at once get spread over time.
+
+    >>> backoff = Backoff(initial=1, maximum=10, jitter=0)
+    >>> [backoff.delay(attempt) for attempt in range(6)]
+    [1, 2, 4, 8, 10, 10]
+    >>> 0.5 <= Backoff(jitter=0.5).delay(0) <= 1
+    True
+    """
+
+    def __init__(self, initial=DEFAULT_INITIAL_DELAY,
+                 maximum=DEFAULT_MAX_DELAY, factor=2, jitter=0.5):
+        self.initial = initial
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+
+    def delay(self, attempt):
+        """Return delay before the next attempt, after `attempt` ones."""
+        delay = min(self.maximum, self.initial * self.factor ** attempt)
+        if self.jitter:
+            delay *= random.uniform(1 - self.jitter, 1)
+        return delay
+
+
+class RetryPolicy(object):
+    """Attempts of commands on the hosts that failed the previous ones.
+
+    Hosts are attempted up to `max_attempts` times in all, only for the
+    failures listed in `retry_on`, waiting a `backoff` delay between two
+    attempts. No attempt is started after `deadline` seconds since the
+    command started, if given.
+
+    >>> policy = RetryPolicy(retry_on=['connection'])
+    >>> policy.retryable(None), policy.retryable(1), policy.retryable(0)
+    (True, False, False)
+    """
+
+    def __init__(self, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 retry_on=(RETRY_CONNECTION,), backoff=None, deadline=None):
+        unknown = set(retry_on) - set(RETRY_ON)
+        if unknown:
+            raise ValueError('Unknown retried failures {}, choose from '
+                             '{}'.format(', '.join(sorted(unknown)),
+                                         ', '.join(RETRY_ON)))
+        self.max_attempts = max_attempts
+        self.retry_on = tuple(retry_on)
+        self.backoff = backoff or Backoff()
+        self.deadline = deadline
+
+    @classmethod
+    def from_config(cls, config):
+        """Return the policy of a config_ssh 'retry' dict, None if empty.
+
+        >>> RetryPolicy.from_config({'max_attempts': 5}).max_attempts
+        5
+        >>> RetryPolicy.from_config(None) is None
+        True
+        """
+        if not config:
+            return None
+        return cls(**config)
+
+    def retryable(self, exit_code):
+        """Return True if a host exiting with exit_code is attempted again.
+
+        exit_code is None for hosts that could not be reached.
+        """
+        if exit_code is None:
+            return RETRY_CONNECTION in self.retry_on
+        return exit_code != 0 and RETRY_EXIT in self.retry_on
+
+    def expires(self, start=None):
+        """Return the time after which no attempt is started, or None."""
+        if self.deadline is None:
+            return None
+        return (clock() if start is None else start) + self.deadline
+
+    def run(self, hosts, attempt, expires=None, on_host=None):
+        """Call attempt(hosts, on_host), then again for retryable failures.
+
+        attempt returns a Result of the hosts it was given, `expires` is
+        the time given by `expires` for the whole command. Return the
+        Result of all attempts, hosts attempted more than once having
+        their number of attempts in the 'attempts' detail.
+
+        attempt gives each host exit code to its `on_host`, only the final
+        ones are given to `on_host(host, exit_code)`, which may miss the
+        hosts not attempted again because of the deadline.
+        """
+        result = attempt(hosts, self._final(on_host, 1))
+        for retry in range(1, self.max_attempts):
+            failed = [host for host in result.failures
+                      if self.retryable(result.exit_code(host))]
+            if not failed:
+                break
+            delay = self.backoff.delay(retry - 1)
+            if expires is not None and clock() + delay > expires:
+                break
+            time.sleep(delay)
+            result.update(attempt(failed, self._final(on_host, retry + 1)))
+        for host in result.hosts:
+            if result.attempts(host) > 1:
+                result.add_detail('attempts', host, result.attempts(host))
+        return result
+
+    def _final(self, on_host, attempts):
+        """Return on_host filtering the exit codes of attempt `attempts`.
+
+        >>> done = []
+        >>> policy = RetryPolicy(max_attempts=2)
+        >>> first = policy._final(lambda *status: done.append(status), 1)
+        >>> first('node-1', None)
+        >>> first('node-2', 0)
+        >>> last = policy._final(lambda *status: done.append(status), 2)
+        >>> last('node-1', None)
+        >>> done
+        [('node-2', 0), ('node-1', None)]
+        """
+        if on_host is None:
+            return None
+
+        def _on_host(host, exit_code):
+            if attempts >= self.max_attempts or not self.retryable(exit_code):
+                on_host(host, exit_code)
+        return _on_host
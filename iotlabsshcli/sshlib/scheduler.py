@@ -0,0 +1,130 @@
+# -*- coding:utf-8 -*-
+"""iotlabsshcli scheduler fanning out work to every site at once."""
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+from collections import OrderedDict
+
+import gevent
+import gevent.pool
+from gevent.event import Event
+from gevent.lock import BoundedSemaphore
+
+from .aimd import AimdLimit, DEFAULT_MAX_LIMIT
+
+# Same default as parallel-ssh greenlet pool
+DEFAULT_POOL_SIZE = 10
+# Frontends uploads running at once
+DEFAULT_MAX_UPLOADS = 4
+
+
+class SitePool(gevent.pool.Pool):
+    """Greenlet pool of one site, optionally sharing a global limit.
+
+    The pool size bounds the number of hosts processed at once on the site,
+    the shared semaphore bounds it across all sites. An AimdLimit `limit`
+    of the site frontend bounds it further, its users report connections
+    outcome to it.
+    """
+
+    def __init__(self, size, sessions=None, limit=None):
+        super(SitePool, self).__init__(size)
+        self.sessions = sessions
+        self.limit = limit
+
+    def spawn(self, *args, **kwargs):
+        if self.sessions is None and self.limit is None:
+            return super(SitePool, self).spawn(*args, **kwargs)
+        return super(SitePool, self).spawn(self._limited, *args, **kwargs)
+
+    def _limited(self, func, *args, **kwargs):
+        if self.limit is None:
+            return self._in_session(func, *args, **kwargs)
+        while not self.limit.try_acquire():
+            self.limit.waiter().wait()
+        try:
+            return self._in_session(func, *args, **kwargs)
+        finally:
+            self.limit.release()
+
+    def _in_session(self, func, *args, **kwargs):
+        if self.sessions is None:
+            return func(*args, **kwargs)
+        with self.sessions:
+            return func(*args, **kwargs)
+
+
+class SiteScheduler(object):
+    """Run one task per site, all sites at once.
+
+    Uploads to the frontends are bounded separately by `max_uploads`,
+    tasks holding the `uploads` semaphore while they transfer.
+
+    Hosts of a site are processed `pool_size` at once at first, then as
+    many as its frontend sustains, up to `max_pool_size`, as adapted by
+    the AimdLimit of the site in `limits`.
+
+    >>> scheduler = SiteScheduler(pool_size=2, max_sessions=3)
+    >>> scheduler.map(lambda site, hosts: len(hosts),
+    ...               OrderedDict([('saclay', [1, 2]), ('lille', [3])]))
+    OrderedDict([('saclay', 2), ('lille', 1)])
+    >>> scheduler.site_pool().size
+    2
+    >>> scheduler.site_pool('saclay').limit.limit
+    2
+    """
+
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, max_sessions=None,
+                 max_uploads=DEFAULT_MAX_UPLOADS,
+                 max_pool_size=DEFAULT_MAX_LIMIT):
+        self.pool_size = pool_size
+        self.max_sessions = max_sessions
+        self.max_pool_size = max_pool_size
+        self._sessions = (BoundedSemaphore(max_sessions)
+                          if max_sessions else None)
+        self.uploads = BoundedSemaphore(max_uploads)
+        self.limits = {}
+
+    def site_pool(self, site=None):
+        """Return a greenlet pool honouring per-site and global limits.
+
+        With `site`, the pool adapts to the limit of its frontend.
+        """
+        if site is None:
+            return SitePool(self.pool_size, self._sessions)
+        if site not in self.limits:
+            self.limits[site] = AimdLimit(self.pool_size,
+                                          maximum=self.max_pool_size,
+                                          event_factory=Event)
+        limit = self.limits[site]
+        return SitePool(limit.maximum, self._sessions, limit)
+
+    @staticmethod
+    def map(func, groups):
+        """Call func(site, hosts) concurrently for every site of groups.
+
+        Wait for all sites to complete, then return results per site in
+        groups order. The first exception, in groups order, is re-raised.
+        """
+        greenlets = OrderedDict((site, gevent.spawn(func, site, hosts))
+                                for site, hosts in groups.items())
+        gevent.joinall(list(greenlets.values()))
+        return OrderedDict((site, greenlet.get())
+                           for site, greenlet in greenlets.items())
@@ -0,0 +1,115 @@
+# -*- coding:utf-8 -*-
+"""Phase timings of SSH operations per host and per site."""
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+import math
+from collections import defaultdict
+from contextlib import contextmanager
+
+try:
+    from time import monotonic as clock
+except ImportError:  # Python 2
+    from time import time as clock
+
+
+def percentile(values, pct):
+    """Return the pct percentile of sorted values, using the nearest rank.
+
+    >>> percentile([1, 2, 3, 4], 50)
+    2
+    >>> percentile([1, 2, 3, 4], 95)
+    4
+    """
+    rank = int(math.ceil(pct / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def summarize(durations):
+    """Return min, median, p95 and max of each phase of durations.
+
+    >>> summary = summarize({'a': {'connect': 1.0}, 'b': {'connect': 3.0}})
+    >>> sorted(summary['connect'].items())
+    [('max', 3.0), ('median', 1.0), ('min', 1.0), ('p95', 3.0)]
+    """
+    phases = defaultdict(list)
+    for phase_durations in durations.values():
+        for phase, duration in phase_durations.items():
+            phases[phase].append(duration)
+    summary = {}
+    for phase, values in phases.items():
+        values.sort()
+        summary[phase] = {'min': round(values[0], 3),
+                          'median': round(percentile(values, 50), 3),
+                          'p95': round(percentile(values, 95), 3),
+                          'max': round(values[-1], 3)}
+    return summary
+
+
+def _rounded(durations):
+    """Return durations rounded to the millisecond."""
+    return dict((name, dict((phase, round(duration, 3))
+                            for phase, duration in phases.items()))
+                for name, phases in durations.items())
+
+
+class Timings(object):
+    """Durations of phases per host and per site, from a monotonic clock.
+
+    Durations of a phase run again on the same host or site add up.
+
+    >>> timings = Timings()
+    >>> timings.add('connect', 0.5, host='node-1')
+    >>> timings.add('connect', 0.25, host='node-1')
+    >>> with timings.measure('run', site='grenoble'):
+    ...     pass
+    >>> timings.as_dict()['hosts']
+    {'node-1': {'connect': 0.75}}
+    >>> list(timings.as_dict()['summary']['sites'])
+    ['run']
+    """
+
+    def __init__(self):
+        self.hosts = defaultdict(lambda: defaultdict(float))
+        self.sites = defaultdict(lambda: defaultdict(float))
+
+    def add(self, phase, duration, host=None, site=None):
+        """Add duration seconds of phase to host and/or site."""
+        if host is not None:
+            self.hosts[host][phase] += duration
+        if site is not None:
+            self.sites[site][phase] += duration
+
+    @contextmanager
+    def measure(self, phase, host=None, site=None):
+        """Add the duration of the block to phase of host and/or site."""
+        start = clock()
+        try:
+            yield
+        finally:
+            self.add(phase, clock() - start, host, site)
+
+    def as_dict(self):
+        """Return durations per host and per site, and their summaries."""
+        return {'hosts': _rounded(self.hosts),
+                'sites': _rounded(self.sites),
+                'summary': {'hosts': summarize(self.hosts),
+                            'sites': summarize(self.sites)}}
@@ -0,0 +1,93 @@
+# -*- coding:utf-8 -*-
+"""iotlabsshcli results streamed as JSON lines, one per host."""
+
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+from __future__ import print_function
+
+import json
+import sys
+import threading
+
+
+def dumps(result):
+    """Return result on one JSON line.
+
+    >>> print(dumps({'reset-m3': {'0': ['node-a8-1.saclay.iot-lab.info']}}))
+    {"reset-m3": {"0": ["node-a8-1.saclay.iot-lab.info"]}}
+    """
+    return json.dumps(result, sort_keys=True)
+
+
+class NodeStream(object):
+    """Status of hosts written as JSON lines as soon as known.
+
+    Lines give the 'command', 'host' and 'exit_code' of each host, once per
+    step, exit code being null for unreachable hosts. Steps get their
+    `on_host(host, exit_code)` callback from `on_host`, callable from any
+    thread. `finish` writes the hosts of the final result not written yet.
+
+    >>> stream = NodeStream()
+    >>> on_host = stream.on_host('reset-m3')
+    >>> on_host('node-a8-1', 0)
+    {"command": "reset-m3", "exit_code": 0, "host": "node-a8-1"}
+    >>> stream.finish({'reset-m3': {'0': ['node-a8-1'], '1': ['node-a8-2']}})
+    {"command": "reset-m3", "exit_code": 1, "host": "node-a8-2"}
+    """
+
+    def __init__(self, out=None):
+        self.out = out
+        self._steps = []
+        self._lock = threading.Lock()
+
+    def on_host(self, command):
+        """Return the on_host callback of a step of command."""
+        written = set()
+
+        def _on_host(host, exit_code):
+            with self._lock:
+                if host in written:
+                    return
+                written.add(host)
+                out = self.out or sys.stdout
+                print(dumps({'command': command, 'host': host,
+                             'exit_code': exit_code}), file=out)
+                out.flush()
+
+        self._steps.append((command, _on_host))
+        return _on_host
+
+    def finish(self, result):
+        """Write the hosts of result not written yet.
+
+        result is the one of a command, or of a plan in its 'plan' list.
+        Their exit code is 0 or 1, exact ones being only known before.
+        Skipped hosts have exit code 0.
+        """
+        results = result.get('plan', [result])
+        for (command, on_host), step in zip(self._steps, results):
+            hosts = step.get(command, {})
+            for host in sorted(hosts.get('skipped', {})):
+                on_host(host, 0)
+            for exit_code in ('0', '1'):
+                for host in hosts.get(exit_code, []):
+                    on_host(host, int(exit_code))
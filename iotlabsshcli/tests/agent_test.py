@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+"""Tests for iotlabsshcli.agent package."""
+
+import os
+import time
+
+import gevent
+
+from iotlabsshcli import agent_client
+from iotlabsshcli.agent import Agent
+from .compat import patch
+
+_NODES = ['node-a8-1.saclay.iot-lab.info', 'node-a8-2.saclay.iot-lab.info']
+_CONFIG_SSH = {'user': 'username', 'exp_id': 123}
+
+
+def test_no_agent(tmpdir):
+    """Test forward without agent."""
+    path = str(tmpdir.join('agent.sock'))
+    step = {'command': 'reset-m3'}
+    assert agent_client.forward(path, _CONFIG_SSH, _NODES, step) is None
+
+    # Stale socket file
+    tmpdir.join('agent.sock').write('')
+    assert agent_client.forward(path, _CONFIG_SSH, _NODES, step) is None
+
+
+@patch('iotlabsshcli.open_a8.run_cmd')
+def test_agent(run_cmd, tmpdir):
+    """Test commands run by the agent over its connections."""
+    run_cmd.return_value = {'run-cmd': {'0': _NODES}}
+    path = str(tmpdir.join('agent', 'agent.sock'))
+    agent = Agent(path, idle_timeout=0.2)
+    server = gevent.spawn(agent.serve)
+    gevent.sleep(0.05)
+
+    step = {'command': 'run-cmd', 'cmd': 'uname -a', 'frontend': False,
+            'capture': None, 'capture_dir': None}
+    ret = agent_client.forward(path, _CONFIG_SSH, _NODES, step)
+    assert ret == {'run-cmd': {'0': _NODES}}
+    run_cmd.assert_called_with(_CONFIG_SSH, _NODES, verbose=False,
+                               connections=agent.connections,
+                               timings=False, on_host=None, cmd='uname -a',
+                               run_on_frontend=False, capture_size=None,
+                               capture_dir=None)
+
+    try:
+        agent_client.forward(path, _CONFIG_SSH, _NODES, {'command': 'ls'})
+    except RuntimeError as err:
+        assert 'ValueError' in str(err)
+    else:
+        assert False, 'RuntimeError not raised'
+
+    # Stops when idle
+    start = time.time()
+    server.join(timeout=2)
+    assert server.ready()
+    assert time.time() - start < 1
+    assert not os.path.exists(path)
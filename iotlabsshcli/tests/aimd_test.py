@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+"""Tests for iotlabsshcli.sshlib.aimd package."""
+
+from iotlabsshcli.sshlib.aimd import AimdLimit
+from .compat import Mock
+
+
+def _complete(limit, count, success=True, latency=0.5):
+    for _ in range(count):
+        assert limit.try_acquire()
+        limit.report(success, latency)
+        limit.release()
+
+
+def test_additive_increase():
+    """Test limit grows by one per window of successes, up to maximum."""
+    limit = AimdLimit(4, maximum=6)
+    _complete(limit, 3)
+    assert limit.limit == 4
+    _complete(limit, 1)
+    assert limit.limit == 5
+    _complete(limit, 100)
+    assert limit.limit == 6
+    assert limit.as_dict() == {'limit': 6, 'peak': 6, 'errors': 0,
+                               'slow': 0, 'decreases': 0}
+
+
+def test_multiplicative_decrease():
+    """Test limit is halved once per window of errors."""
+    limit = AimdLimit(16)
+    _complete(limit, 4, success=False)
+    assert limit.limit == 8
+    _complete(limit, 4, success=False)
+    assert limit.limit == 8
+    _complete(limit, 4, success=False)
+    assert limit.limit == 4
+    _complete(limit, 20, success=False)
+    assert limit.limit == 1
+    assert limit.stats['errors'] == 32
+
+
+def test_slow_connections():
+    """Test connections much slower than the fastest one hold limit."""
+    limit = AimdLimit(2)
+    _complete(limit, 1, latency=0.5)
+    _complete(limit, 5, latency=2)
+    assert limit.limit == 2
+    assert limit.stats['slow'] == 5
+    _complete(limit, 1, latency=1)
+    assert limit.limit == 3
+
+    # Fast reused connections are not a baseline
+    limit = AimdLimit(8)
+    _complete(limit, 1, latency=0.001)
+    _complete(limit, 1, latency=0.25)
+    assert limit.stats['slow'] == 0
+
+
+def test_waiters():
+    """Test waiters are woken when slots are freed or added."""
+    limit = AimdLimit(1, maximum=2, event_factory=Mock)
+    assert limit.try_acquire()
+    first, second = limit.waiter(), limit.waiter()
+    limit.report(True, 0.5)
+    assert first.set.called
+    assert not second.set.called
+    limit.release()
+    assert second.set.called
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+"""Tests for iotlabsshcli.sshlib.asyncio_ssh module, on the fake topology
+of the benchmarks."""
+
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+from iotlabsshcli.sshlib import get_backend, OutputCapture
+from .compat import Mock
+
+asyncssh = pytest.importorskip('asyncssh')  # pylint:disable=invalid-name
+paramiko = pytest.importorskip('paramiko')  # pylint:disable=invalid-name
+
+_FAKE_TOPOLOGY = os.path.join(os.path.dirname(__file__), os.pardir, os.pardir,
+                              'benchmarks', 'fake_topology.py')
+_NODES = ['node-a8-{}.1.iot-lab.info'.format(num) for num in range(1, 4)]
+
+
+def _gevent_patched():
+    """Return True if pssh patched this process with gevent."""
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('threading')
+
+
+def test_gevent_patched():
+    """Run these tests in a new process once pssh patched this one."""
+    if not _gevent_patched():
+        pytest.skip('tests are run in this process')
+    assert subprocess.call([sys.executable, '-m', 'pytest', '-q',
+                            '-p', 'no:cacheprovider', '-o', 'addopts=',
+                            __file__]) == 0
+
+
+@pytest.fixture(name='config_ssh', scope='module')
+def fixture_config_ssh():
+    """Start the fake topology, return the configuration to reach it."""
+    if _gevent_patched():
+        pytest.skip('the asyncio backend cannot run with gevent')
+    if not os.path.exists(_FAKE_TOPOLOGY):
+        pytest.skip('fake topology not found')
+    topology = subprocess.Popen([sys.executable, _FAKE_TOPOLOGY],
+                                stdout=subprocess.PIPE,
+                                universal_newlines=True)
+    scenario = json.loads(topology.stdout.readline())
+    yield {'user': 'test', 'frontend': scenario['frontend'],
+           'port': scenario['port'], 'backend': 'asyncio',
+           'pkey': paramiko.RSAKey.generate(1024)}
+    topology.send_signal(signal.SIGTERM)
+    topology.communicate()
+
+
+def _ssh(config_ssh, groups=None, **kwargs):
+    return get_backend('asyncio')(config_ssh, groups or {'1': _NODES},
+                                  **kwargs)
+
+
+def test_get_backend():
+    """Backends are selected by name."""
+    # pylint:disable=import-outside-toplevel
+    from iotlabsshcli.sshlib.asyncio_ssh import OpenA8AsyncSsh
+    assert get_backend('asyncio') is OpenA8AsyncSsh
+
+
+def test_run(config_ssh):
+    """Commands run on nodes through their frontend, output captured."""
+    capture = OutputCapture()
+    with _ssh(config_ssh) as ssh:
+        ret = ssh.run('uname', capture=capture)
+        assert ret['0'] == _NODES
+        assert ret['output'][_NODES[0]]['stdout'] == \
+            '{}: uname'.format(_NODES[0])
+
+        ret = ssh.run('test -f file')
+        assert ret['1'] == _NODES
+
+        ret = ssh.run('uname', with_proxy=False)
+        assert ret == {'0': ['127.0.0.1']}
+
+
+def test_run_output_lines(config_ssh):
+    """Captured output has no empty line after the last one."""
+    capture = OutputCapture()
+    with _ssh(config_ssh) as ssh:
+        ret = ssh.run('uname\nuptime', capture=capture)
+    assert ret['output'][_NODES[0]]['stdout'] == \
+        '{}: uname\nuptime'.format(_NODES[0])
+    assert ret['output'][_NODES[0]]['stdout'].split('\n')[-1]
+
+
+class _EmptyAtEofReader(object):
+    """Reader of which iteration yields an empty string at EOF, as some
+    asyncssh versions do."""
+
+    def __init__(self, lines):
+        self.lines = list(lines)
+
+    async def readline(self):
+        """Return the next line, an empty string at EOF."""
+        return self.lines.pop(0) if self.lines else ''
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.lines is None:
+            raise StopAsyncIteration
+        line = await self.readline()
+        if not line:
+            self.lines = None
+        return line
+
+
+def test_read_eof():
+    """An empty string at EOF is not captured as a line."""
+    if _gevent_patched():
+        pytest.skip('the asyncio backend cannot run with gevent')
+    capture = OutputCapture()
+    ssh = _ssh({'user': 'test'})
+    reader = _EmptyAtEofReader(['line 1\n', 'line 2\r\n'])
+    asyncio.run(ssh._read(  # pylint:disable=protected-access
+        _NODES[0], 'stdout', reader, capture))
+    assert capture.result()[_NODES[0]]['stdout'] == 'line 1\nline 2'
+
+
+def test_run_unreachable(config_ssh):
+    """Hosts which cannot be reached are given in the result."""
+    config_ssh = dict(config_ssh, port=1)
+    with _ssh(config_ssh) as ssh:
+        ret = ssh.run('uname')
+    assert ret['1'] == _NODES
+
+
+def test_scp(config_ssh):
+    """Files are copied to frontends, once with an upload cache."""
+    cache = Mock()
+    cache.digest.return_value = 'digest'
+    cache.is_fresh.return_value = False
+    with tempfile.NamedTemporaryFile() as src:
+        src.write(b'firmware')
+        src.flush()
+        with _ssh(config_ssh, upload_cache=cache, timings=True) as ssh:
+            ret = ssh.scp(src.name, '~/A8/fw.elf')
+            transfer = ret['transfers']['127.0.0.1']
+            assert transfer['size'] == len(b'firmware')
+            assert 'upload' in ret['timings']['hosts']['127.0.0.1']
+
+            cache.add.assert_called_with('127.0.0.1', '~/A8/fw.elf',
+                                         'digest')
+
+            cache.is_fresh.return_value = True
+            ret = ssh.scp(src.name, '~/A8/fw.elf')
+            assert ret['transfers']['127.0.0.1']['cached']
+
+            result = ssh.scp_site('1', src.name, '~/A8/fw.elf',
+                                  before='test -d ~/A8')
+            assert not result.success('127.0.0.1')
+
+
+def test_wait(config_ssh):
+    """Nodes are probed until they boot."""
+    ready = []
+    with _ssh(config_ssh, timings=True) as ssh:
+        ret = ssh.wait(10, on_ready=lambda node, _: ready.append(node))
+    assert sorted(ret['0']) == _NODES
+    assert sorted(ready) == _NODES
+    assert set(ret['latency']) == set(_NODES)
+    assert 'boot' in ret['timings']['hosts'][_NODES[0]]
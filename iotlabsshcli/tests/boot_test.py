@@ -0,0 +1,104 @@
+# -*- coding: utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+"""Tests for iotlabsshcli.sshlib.boot module."""
+
+import socket
+import time
+import unittest
+
+from paramiko import ChannelException
+
+from iotlabsshcli.sshlib.boot import Backoff, BootWaiter, tcp_probe
+from .compat import Mock
+
+
+class TestBootWaiter(unittest.TestCase):
+    """Test BootWaiter."""
+
+    def setUp(self):
+        self.probes = {}
+        self.checks = []
+
+    def _probe(self, site, node):
+        """Node answers from its third probe."""
+        # pylint: disable=unused-argument
+        self.probes[node] = self.probes.get(node, 0) + 1
+        return node != 'node-down' and self.probes[node] >= 3
+
+    def _check(self, site, node):
+        # pylint: disable=unused-argument
+        self.checks.append(node)
+        return True
+
+    def test_wait(self):
+        """Nodes are reported as they are ready."""
+        ready = []
+        waiter = BootWaiter(self._probe, self._check,
+                            backoff=Backoff(initial=0.01, maximum=0.02),
+                            on_ready=lambda node, _: ready.append(node))
+        groups = {'saclay': ['node-1', 'node-down'], 'lille': ['node-2']}
+        start = time.time()
+        result = waiter.wait(groups, 0.3)
+
+        self.assertEqual(result.successes, ['node-1', 'node-2'])
+        self.assertEqual(result.failures, ['node-down'])
+        self.assertEqual(sorted(ready), ['node-1', 'node-2'])
+        self.assertEqual(sorted(self.checks), ['node-1', 'node-2'])
+        self.assertLess(result.details['latency']['node-1'], 0.3)
+        self.assertEqual(self.probes['node-1'], 3)
+        self.assertEqual(result.attempts('node-1'), 3)
+        self.assertEqual(result.attempts('node-down'),
+                         self.probes['node-down'])
+        # Down node probed with backoff until deadline
+        self.assertTrue(3 < self.probes['node-down'] < 40)
+        self.assertLess(time.time() - start, 0.5)
+
+    def test_wait_error(self):
+        """Errors are raised without waiting for other nodes."""
+        def _check(site, node):
+            raise ValueError(site, node)
+
+        waiter = BootWaiter(lambda site, node: node == 'node-1', _check)
+        start = time.time()
+        self.assertRaises(ValueError, waiter.wait,
+                          {'saclay': ['node-1', 'node-2']}, 10)
+        self.assertLess(time.time() - start, 1)
+
+
+class TestTcpProbe(unittest.TestCase):
+    """Test tcp_probe."""
+
+    def test_probe(self):
+        """Probe reads SSH banner through the transport."""
+        transport = Mock()
+        channel = transport.open_channel.return_value
+        channel.recv.return_value = b'SSH-'
+        self.assertTrue(tcp_probe(transport, 'node-1'))
+        transport.open_channel.assert_called_with(
+            'direct-tcpip', ('node-1', 22), ('127.0.0.1', 0), timeout=5)
+        self.assertTrue(channel.close.called)
+
+        channel.recv.side_effect = socket.timeout()
+        self.assertFalse(tcp_probe(transport, 'node-1'))
+
+        transport.open_channel.side_effect = ChannelException(2, 'refused')
+        self.assertFalse(tcp_probe(transport, 'node-1'))
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+"""Tests for iotlabsshcli.cache package."""
+
+import os
+import time
+import hashlib
+
+from iotlabsshcli import cache
+from .compat import patch
+
+
+def test_json(tmpdir):
+    """Test atomic JSON write and tolerant read."""
+    path = os.path.join(str(tmpdir), 'sub', 'data.json')
+    assert cache.read_json(path, {}) == {}
+
+    cache.write_json(path, {'a': [1, 2]})
+    assert cache.read_json(path) == {'a': [1, 2]}
+    assert os.listdir(os.path.dirname(path)) == ['data.json']
+
+    with open(path, 'w') as json_fd:
+        json_fd.write('{corrupted')
+    assert cache.read_json(path, 'default') == 'default'
+
+
+def test_file_digest(tmpdir):
+    """Test file digest."""
+    path = tmpdir.join('file')
+    path.write(b'content' * 10000, mode='wb')
+    assert (cache.file_digest(str(path), block_size=1000) ==
+            hashlib.sha256(b'content' * 10000).hexdigest())
+
+
+def test_upload_cache(tmpdir):
+    """Test upload manifest per user and its expiration."""
+    src = tmpdir.join('firmware.elf')
+    src.write(b'firmware', mode='wb')
+    digest = hashlib.sha256(b'firmware').hexdigest()
+
+    with patch('iotlabsshcli.cache.CACHE_DIR', str(tmpdir)):
+        upload_cache = cache.UploadCache('user')
+        assert upload_cache.digest(str(src)) == digest
+        assert not upload_cache.is_fresh('saclay', 'dst', digest)
+        upload_cache.add('saclay', 'dst', digest)
+
+        upload_cache = cache.UploadCache('user')
+        assert upload_cache.is_fresh('saclay', 'dst', digest)
+        assert not upload_cache.is_fresh('saclay', 'dst', 'other')
+        assert not upload_cache.is_fresh('lille', 'dst', digest)
+        assert not cache.UploadCache('other').is_fresh('saclay', 'dst', digest)
+
+        # Entries expire, the next add records them again
+        with patch('time.time', return_value=time.time() + 61):
+            assert not upload_cache.is_fresh('saclay', 'dst', digest)
+            upload_cache.add('saclay', 'dst', digest)
+        assert cache.UploadCache('user').is_fresh('saclay', 'dst', digest)
+
+
+def test_firmware_state(tmpdir):
+    """Test flashed firmwares per experiment."""
+    with patch('iotlabsshcli.cache.CACHE_DIR', str(tmpdir)):
+        state = cache.FirmwareState(123)
+        assert not state.is_flashed('node-a8-1', 'digest')
+        state.update(['node-a8-1', 'node-a8-2'], [], 'digest')
+
+        state = cache.FirmwareState(123)
+        assert state.is_flashed('node-a8-1', 'digest')
+        assert not state.is_flashed('node-a8-1', 'other')
+        assert not cache.FirmwareState(124).is_flashed('node-a8-1', 'digest')
+
+        state.update(['node-a8-1'], ['node-a8-2'], 'other')
+        state = cache.FirmwareState(123)
+        assert state.is_flashed('node-a8-1', 'other')
+        assert not state.is_flashed('node-a8-2', 'digest')
+
+
+def test_experiment_cache(tmpdir):
+    """Test experiment cache expiration and invalidation."""
+    with patch('iotlabsshcli.cache.CACHE_DIR', str(tmpdir)):
+        exp_cache = cache.ExperimentCache('user')
+        assert exp_cache.current_experiment() is None
+        exp_cache.set_current_experiment(123)
+        exp_cache.set_nodes(123, ['a8-1.saclay.iot-lab.info'])
+
+        exp_cache = cache.ExperimentCache('user')
+        assert exp_cache.current_experiment() == 123
+        assert exp_cache.nodes(123) == ['a8-1.saclay.iot-lab.info']
+        assert exp_cache.nodes(124) is None
+        assert cache.ExperimentCache('other').current_experiment() is None
+
+        with patch('time.time', return_value=time.time() + 301):
+            assert exp_cache.current_experiment() is None
+        assert cache.ExperimentCache('user', ttl=0).nodes(123) is None
+
+        exp_cache.forget_current_experiment()
+        assert exp_cache.current_experiment() is None
+        assert cache.ExperimentCache('user').current_experiment() is None
+        assert cache.ExperimentCache('user').nodes(123) == [
+            'a8-1.saclay.iot-lab.info']
+
+        exp_cache.set_current_experiment(123)
+        exp_cache.invalidate()
+        assert exp_cache.current_experiment() is None
+        assert cache.ExperimentCache('user').nodes(123) is None
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+"""Tests for iotlabsshcli.sshlib.capture module."""
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import gevent
+
+from iotlabsshcli.sshlib.capture import OutputCapture
+
+
+def _lines(count, delay=0):
+    for index in range(count):
+        gevent.sleep(delay)
+        yield 'line {}'.format(index)
+
+
+class TestOutputCapture(unittest.TestCase):
+    """Test OutputCapture."""
+
+    def setUp(self):
+        self.spill_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.spill_dir)
+
+    def test_bounded(self):
+        """Only the last bytes are kept in memory."""
+        capture = OutputCapture(max_bytes=18)
+        readers = capture.start({'node-1': {'stdout': _lines(1000)},
+                                 'node-2': {'stdout': None}})
+        capture.join(readers)
+        result = capture.result()
+        self.assertEqual(list(result), ['node-1'])
+        self.assertEqual(result['node-1']['stdout'], 'line 998\nline 999')
+        self.assertEqual(result['node-1']['dropped'],
+                         sum(len('line {}'.format(i)) + 1
+                             for i in range(998)))
+
+    def test_concurrent(self):
+        """Hosts streams are read at once."""
+        output = dict(('node-{}'.format(i), {'stdout': _lines(5, 0.02),
+                                             'stderr': _lines(5, 0.02)})
+                      for i in range(50))
+        capture = OutputCapture()
+        with gevent.Timeout(1):
+            capture.join(capture.start(output))
+        result = capture.result()
+        self.assertEqual(len(result), 50)
+        self.assertEqual(result['node-3']['stderr'].count('\n'), 4)
+
+    def test_spill(self):
+        """Whole output is saved in spill files."""
+        spill_dir = os.path.join(self.spill_dir, 'out')
+        capture = OutputCapture(max_bytes=0, spill_dir=spill_dir)
+        capture.join(capture.start({'node-1': {'stdout': _lines(100)}}))
+        result = capture.result()
+        spill = os.path.join(spill_dir, 'node-1.stdout')
+        self.assertEqual(result['node-1'], {'stdout': '', 'spill': [spill],
+                                            'dropped': 790})
+        with open(spill) as spill_file:
+            self.assertEqual(spill_file.read().splitlines(),
+                             list(_lines(100)))
@@ -39,4 +39,4 @@ else:  # pragma: no cover
     raise ValueError('Unknown python version %r' % version_info)
 
 # pylint:disable=wrong-import-position
-from mock import patch, Mock, mock_open  # noqa
+from mock import patch, Mock, mock_open, ANY  # noqa
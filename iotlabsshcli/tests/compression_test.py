@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+"""Tests for iotlabsshcli.sshlib.compression package."""
+
+import os
+import shutil
+import zlib
+
+import pytest
+
+from iotlabsshcli.open_a8 import _nodes_grouped
+from iotlabsshcli.sshlib import OpenA8Ssh
+from iotlabsshcli.sshlib import compression
+from iotlabsshcli.sshlib.open_a8_ssh import _compressed_put
+from .compat import patch
+from .delta_test import LocalSSHClient, _random_data
+
+_TEXT = b''.join(b'line %d of a compressible file\n' % num
+                 for num in range(20000))
+
+
+def test_stream(tmpdir):
+    """Test files are streamed compressed in gzip format."""
+    src = tmpdir.join('src')
+    src.write(_TEXT, mode='wb')
+    data = b''.join(compression.stream(str(src), compression.GZIP,
+                                       len(_TEXT)))
+    assert len(data) < len(_TEXT) // 10
+    assert zlib.decompress(data, 31) == _TEXT
+
+
+def test_stream_zstd(tmpdir):
+    """Test files are streamed compressed in zstd format."""
+    zstandard = pytest.importorskip('zstandard')
+    src = tmpdir.join('src')
+    src.write(_TEXT, mode='wb')
+    data = b''.join(compression.stream(str(src), compression.ZSTD,
+                                       len(_TEXT)))
+    decompressor = zstandard.ZstdDecompressor()
+    assert decompressor.decompressobj().decompress(data) == _TEXT
+
+
+def test_choose(tmpdir):
+    """Test the codec depends on the frontend, and on data shrinking."""
+    src = tmpdir.join('src')
+    src.write(_TEXT, mode='wb')
+    assert compression.choose(str(src), len(_TEXT)) == compression.GZIP
+    assert compression.choose(str(src), len(_TEXT),
+                              lambda: False) == compression.GZIP
+    if compression.zstandard is not None:
+        assert compression.choose(str(src), len(_TEXT),
+                                  lambda: True) == compression.ZSTD
+
+    src.write(bytes(_random_data(10000)), mode='wb')
+    assert compression.choose(str(src), 10000) is None
+    src.write(b'', mode='wb')
+    assert compression.choose(str(src), 0) is None
+
+
+def test_compressed_put(tmpdir):
+    """Test remote file is written decompressed, with bytes sent."""
+    src, dst = tmpdir.join('src'), tmpdir.join('dst')
+    src.write(_TEXT, mode='wb')
+
+    stats = _compressed_put(LocalSSHClient(), str(src), str(dst))
+    assert dst.read(mode='rb') == _TEXT
+    assert stats['size'] == len(_TEXT)
+    assert stats['sent'] < len(_TEXT) // 10
+    assert stats['codec'] in (compression.GZIP, compression.ZSTD)
+
+    src.write(bytes(_random_data(10000)), mode='wb')
+    assert _compressed_put(LocalSSHClient(), str(src), str(dst)) is None
+    assert dst.read(mode='rb') == _TEXT
+
+
+def test_put_command_digest(tmpdir):
+    """Test a file decompressed with a different digest is not kept."""
+    dst = tmpdir.join('dst')
+    dst.write(b'old content', mode='wb')
+    ssh = LocalSSHClient()
+    command = compression.put_command(compression.GZIP, str(dst), 'bad')
+    channel, _, _, _, stdin = ssh.exec_command(command, use_pty=False)
+    comp = compression.compressor(compression.GZIP, 11)
+    stdin.write(comp.compress(b'new content') + comp.flush())
+    channel.shutdown_write()
+    assert channel.recv_exit_status() != 0
+    assert dst.read(mode='rb') == b'old content'
+    assert tmpdir.listdir(lambda path: path.ext == '.tmp') == []
+
+
+@patch('iotlabsshcli.sshlib.open_a8_ssh._scp_put')
+@patch('iotlabsshcli.sshlib.open_a8_ssh.SSHClient', LocalSSHClient)
+def test_scp_compress(scp_put, tmpdir):
+    """Test compressed copy through OpenA8Ssh falls back to scp."""
+    def _copy(ssh, src, dst):  # pylint:disable=unused-argument
+        shutil.copy(src, dst)
+        return {'size': os.path.getsize(src)}
+
+    scp_put.side_effect = _copy
+    config_ssh = {'user': 'username', 'exp_id': 123, 'compress': True}
+    groups = _nodes_grouped(['node-a8-1.saclay.iot-lab.info'])
+    src, dst = tmpdir.join('src'), str(tmpdir.join('dst'))
+    src.write(_TEXT, mode='wb')
+
+    with OpenA8Ssh(config_ssh, groups) as node_ssh:
+        ret = node_ssh.scp(str(src), dst)
+        stats = ret['transfers']['saclay.iot-lab.info']
+        assert stats['sent'] < stats['size'] == len(_TEXT)
+        assert tmpdir.join('dst').read(mode='rb') == _TEXT
+        assert not scp_put.called
+
+        src.write(bytes(_random_data(10000)), mode='wb')
+        ret = node_ssh.scp(str(src), dst)
+        assert ret['transfers']['saclay.iot-lab.info'] == {'size': 10000}
+        assert tmpdir.join('dst').read(mode='rb') == src.read(mode='rb')
@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+"""Tests for iotlabsshcli.sshlib.delta package."""
+
+import os
+import random
+import shutil
+import subprocess
+
+from iotlabsshcli.open_a8 import _nodes_grouped
+from iotlabsshcli.sshlib import OpenA8Ssh
+from iotlabsshcli.sshlib import delta
+from .compat import patch, Mock
+
+
+class LocalChannel(object):
+    """Channel of a command run by LocalSSHClient."""
+
+    def __init__(self, process):
+        self.process = process
+
+    def shutdown_write(self):
+        """Close command standard input."""
+        self.process.stdin.close()
+
+    def recv_exit_status(self):
+        """Wait for command exit code."""
+        return self.process.wait()
+
+
+class LocalSSHClient(object):
+    """SSH server stand-in running commands with the local shell."""
+
+    def __init__(self, *args, **kwargs):
+        # pylint: disable=unused-argument
+        self.client = Mock()
+        self.proxy_client = None
+        self.commands = []
+
+    def exec_command(self, command, use_pty=True):
+        # pylint: disable=unused-argument
+        """Run command locally, return it like pssh SSHClient does."""
+        self.commands.append(command)
+        process = subprocess.Popen(['sh', '-c', command],
+                                   stdin=subprocess.PIPE,
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE)
+        return (LocalChannel(process), 'localhost', process.stdout,
+                process.stderr, process.stdin)
+
+
+def _random_data(size, seed=0):
+    rand = random.Random(seed)
+    return bytearray(rand.randint(0, 255) for _ in range(size))
+
+
+def _helper(tmpdir):
+    helper = str(tmpdir.join('.delta.py'))
+    shutil.copy(os.path.splitext(delta.__file__)[0] + '.py', helper)
+    return helper
+
+
+def test_delta_put(tmpdir):
+    """Test remote file is updated sending only changed blocks."""
+    old = _random_data(200000)
+    new = old[:1000] + b'inserted' + old[1000:150000] + old[150100:]
+    src, dst = tmpdir.join('src'), tmpdir.join('dst')
+    src.write(bytes(new), mode='wb')
+    dst.write(bytes(old), mode='wb')
+
+    sent = delta.delta_put(LocalSSHClient(), str(src), str(dst),
+                           _helper(tmpdir))
+    assert dst.read(mode='rb') == bytes(new)
+    assert sent < len(new) // 10
+
+
+def test_delta_put_full_copy_needed(tmpdir):
+    """Test nothing is sent when dst is missing or too different."""
+    src, dst = tmpdir.join('src'), tmpdir.join('dst')
+    src.write(bytes(_random_data(10000)), mode='wb')
+    helper = _helper(tmpdir)
+
+    assert delta.delta_put(LocalSSHClient(), str(src), str(dst),
+                           helper) is None
+    assert not dst.check()
+
+    dst.write(bytes(_random_data(10000, seed=1)), mode='wb')
+    assert delta.delta_put(LocalSSHClient(), str(src), str(dst),
+                           helper) is None
+    assert dst.read(mode='rb') == bytes(_random_data(10000, seed=1))
+
+    # More than half of the file is new data, no delta is computed
+    old = _random_data(100000)
+    dst.write(bytes(old), mode='wb')
+    src.write(bytes(old[:40000] + _random_data(60000, seed=1)), mode='wb')
+    ssh = LocalSSHClient()
+    with patch('iotlabsshcli.sshlib.delta.encode_delta') as encode:
+        assert delta.delta_put(ssh, str(src), str(dst), helper) is None
+    assert not encode.called
+    assert len(ssh.commands) == 1
+
+
+def test_apply_delta_digest(tmpdir):
+    """Test a patch resulting in a different digest is not applied."""
+    dst = tmpdir.join('dst')
+    dst.write(b'old content', mode='wb')
+    ssh = LocalSSHClient()
+    channel, _, _, _, stdin = delta._exec(  # pylint:disable=protected-access
+        ssh, 'patch', _helper(tmpdir), str(dst), 1024, 'bad digest')
+    stdin.write(delta.encode_delta([('D', b'new content')]))
+    channel.shutdown_write()
+    assert channel.recv_exit_status() != 0
+    assert dst.read(mode='rb') == b'old content'
+    assert tmpdir.listdir(lambda path: path.ext == '.tmp') == []
+
+
+@patch('iotlabsshcli.sshlib.open_a8_ssh._scp_put')
+@patch('iotlabsshcli.sshlib.open_a8_ssh.SSHClient', LocalSSHClient)
+def test_scp_delta(scp_put, tmpdir):
+    """Test delta copy through OpenA8Ssh falls back to full copies."""
+    def _copy(ssh, src, dst):  # pylint:disable=unused-argument
+        shutil.copy(src, dst)
+        return {'size': os.path.getsize(src)}
+
+    scp_put.side_effect = _copy
+    config_ssh = {'user': 'username', 'exp_id': 123}
+    groups = _nodes_grouped(['node-a8-1.saclay.iot-lab.info'])
+    data = _random_data(100000)
+    src, dst = tmpdir.join('src'), str(tmpdir.join('dst'))
+    src.write(bytes(data), mode='wb')
+
+    with OpenA8Ssh(config_ssh, groups) as node_ssh:
+        ret = node_ssh.scp(str(src), dst, delta=True)
+        assert ret['transfers']['saclay.iot-lab.info'] == {'size': 100000}
+        assert tmpdir.join('.delta.py').check()
+
+        data[5000:5010] = b'x' * 10
+        src.write(bytes(data), mode='wb')
+        ret = node_ssh.scp(str(src), dst, delta=True)
+        stats = ret['transfers']['saclay.iot-lab.info']
+        assert stats['delta']
+        assert stats['size'] < 10000
+        assert tmpdir.join('dst').read(mode='rb') == bytes(data)
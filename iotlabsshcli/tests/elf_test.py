@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+"""Tests for iotlabsshcli.elf package."""
+
+import os
+import struct
+
+from pytest import raises
+
+from iotlabsshcli import elf
+from .compat import patch
+
+_TEXT = b'\x01\x02\x03\x04' * 64
+_DATA = b'data'
+_DEBUG = b'\xaa' * 4096
+
+
+def _firmware():
+    """Return an ELF32 firmware with text and data segments, a non
+    loadable segment and a debug section.
+    """
+    header_fmt = '<16sHHIIIIIHHHHHH'
+    phdr_fmt = '<IIIIIIII'
+    phoff = struct.calcsize(header_fmt)
+    phdrs = [
+        # Loaded in flash, data copied to RAM at startup
+        (1, 0x8000, 0x08000000, 0x08000000, len(_TEXT), len(_TEXT), 5,
+         0x8000),
+        (1, 0x8100, 0x20000000, 0x08000100, len(_DATA), 0x40, 6, 0x8000),
+        # ARM exception index, inside the text segment
+        (0x70000001, 0x8010, 0x08000010, 0x08000010, 8, 8, 4, 4),
+    ]
+    shoff = 0x8100 + len(_DATA) + len(_DEBUG)
+    ident = b'\x7fELF\x01\x01\x01' + b'\0' * 9
+    header = struct.pack(header_fmt, ident, 2, 40, 1, 0x08000011, phoff,
+                         shoff, 0x5000200, phoff, struct.calcsize(phdr_fmt),
+                         len(phdrs), 40, 1, 0)
+    data = bytearray(shoff + 40)
+    data[:phoff] = header
+    for index, phdr in enumerate(phdrs):
+        offset = phoff + index * struct.calcsize(phdr_fmt)
+        data[offset:offset + 32] = struct.pack(phdr_fmt, *phdr)
+    data[0x8000:0x8000 + len(_TEXT)] = _TEXT
+    data[0x8100:0x8100 + len(_DATA)] = _DATA
+    data[0x8104:0x8104 + len(_DEBUG)] = _DEBUG
+    return bytes(data)
+
+
+def test_compact():
+    """Test only loadable segments are kept, at the same addresses."""
+    firmware = _firmware()
+    compacted = elf.compact(firmware)
+    assert len(compacted) < len(_TEXT) + len(_DATA) + 200
+    assert _DEBUG[:64] not in compacted
+    assert elf.segments(compacted) == elf.segments(firmware) == [
+        (0x08000000, _TEXT), (0x08000100, _DATA)]
+
+    # No section headers, same entry point
+    header = struct.unpack_from('<16sHHIIIIIHHHHHH', compacted)
+    assert header[4] == 0x08000011
+    assert header[6] == 0 and header[11:] == (0, 0, 0)
+    assert elf.compact(compacted) == compacted
+
+    with raises(ValueError):
+        elf.compact(b'#!/bin/sh\n')
+
+
+def test_compact_firmware(tmpdir):
+    """Test compacted firmwares are cached by source digest."""
+    src = tmpdir.join('fw.elf')
+    src.write(_firmware(), mode='wb')
+    script = tmpdir.join('script.sh')
+    script.write(b'#!/bin/sh\n', mode='wb')
+
+    with patch('iotlabsshcli.cache.CACHE_DIR', str(tmpdir.join('cache'))):
+        path = elf.compact_firmware(str(src))
+        assert os.path.basename(path) == 'fw.elf'
+        assert path.startswith(str(tmpdir.join('cache', 'firmwares')))
+        with open(path, 'rb') as compact_fd:
+            assert compact_fd.read() == elf.compact(_firmware())
+
+        with patch('iotlabsshcli.elf.compact') as compact:
+            assert elf.compact_firmware(str(src)) == path
+            assert not compact.called
+
+        # Other files are uploaded as is
+        assert elf.compact_firmware(str(script)) == str(script)
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+"""Tests for iotlabsshcli.sshlib.fanout package."""
+
+import json
+import subprocess
+
+from iotlabsshcli.sshlib import fanout
+from .compat import patch, Mock
+
+
+def _process(returncode, stdout=b'', stderr=b''):
+    process = Mock(returncode=returncode)
+    process.communicate.return_value = (stdout, stderr)
+    return process
+
+
+@patch('subprocess.Popen')
+def test_run_node(popen):
+    """Test running a command on a node with ssh."""
+    popen.return_value = _process(0, b'first\nsecond\n', b'')
+    result = fanout.run_node('node-a8-1', 'uptime', capture=8)
+    assert popen.call_args[0][0][-2:] == ['root@node-a8-1', 'uptime']
+    assert popen.call_args[1]['stdout'] == subprocess.PIPE
+    assert result['exit_code'] == 0
+    assert result['stdout'] == 'second\n'
+    assert result['stderr'] == ''
+
+    # Output is only sent when captured
+    popen.return_value = _process(2, b'output')
+    result = fanout.run_node('node-a8-1', 'false')
+    assert result['exit_code'] == 2
+    assert 'stdout' not in result
+
+    # ssh could not connect
+    popen.return_value = _process(255)
+    assert fanout.run_node('node-a8-1', 'uptime')['exit_code'] is None
+
+
+@patch('subprocess.Popen')
+def test_run(popen):
+    """Test running a request on nodes, one JSON line per node."""
+    popen.side_effect = lambda args, **kwargs: _process(
+        1 if args[-2] == 'root@node-a8-2' else 0)
+    nodes = ['node-a8-{}'.format(num) for num in range(1, 11)]
+    request = fanout.decode_request(fanout.encode_request(
+        'uptime', nodes, parallel=3))
+    out = Mock()
+    fanout.run(request, out)
+
+    results = [json.loads(call[0][0]) for call in out.write.call_args_list]
+    assert sorted(result['host'] for result in results) == sorted(nodes)
+    assert [result['host'] for result in results
+            if result['exit_code']] == ['node-a8-2']
+    assert popen.call_count == len(nodes)
+
+
+def test_fanout_command():
+    """Test the frontend command runs the helper, if it was copied."""
+    helper = fanout.helper_path('~/A8/.iotlabsshcli')
+    assert helper.startswith('~/A8/.iotlabsshcli/.fanout-')
+    command = fanout.fanout_command(helper, 'uptime', ['node-a8-1'])
+    assert command.startswith('test -f {} || exit {};'.format(
+        helper, fanout.HELPER_MISSING))
+    assert command.split()[-2] == helper
+    assert fanout.decode_request(command.split()[-1])['nodes'] == [
+        'node-a8-1']
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+"""Import time regression tests of iotlabsshcli command line."""
+
+import json
+import os
+import subprocess
+import sys
+import time
+
+# Modules only needed once a command runs
+HEAVY_MODULES = ['pssh', 'gevent', 'paramiko', 'scp', 'iotlabsshcli.open_a8',
+                 'iotlabsshcli.sshlib']
+
+_SCRIPT = """
+import json, sys
+from iotlabsshcli.parser import open_a8_parser
+open_a8_parser.parse_options().parse_args({args})
+print(json.dumps([mod for mod in {heavy} if mod in sys.modules]))
+"""
+
+
+def _loaded_modules(args):
+    """Return heavy modules loaded to parse args, and time spent."""
+    script = _SCRIPT.format(args=repr(args), heavy=repr(HEAVY_MODULES))
+    root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+    start = time.time()
+    output = subprocess.check_output([sys.executable, '-c', script],
+                                     cwd=os.path.abspath(root))
+    return json.loads(output.decode('utf-8')), time.time() - start
+
+
+def test_parser_import():
+    """Parsing arguments does not load SSH libraries.
+
+    Run with -s to see time spent, `python -X importtime` for details.
+    """
+    loaded, duration = _loaded_modules(['run-cmd', 'uname -a'])
+    print('parse run-cmd: {:.3f} s'.format(duration))
+    assert loaded == []
+
+    loaded, _ = _loaded_modules(['--verbose', 'flash-m3', 'fw.elf'])
+    assert loaded == []
@@ -22,6 +22,8 @@
 """ common TestCase class for testing commands """
 
 import sys
+import shutil
+import tempfile
 import unittest
 
 from iotlabcli.rest import Api
@@ -78,6 +80,10 @@ class MainMock(unittest.TestCase):
                    x if x is not None else (123 if running_only else 234))
         patch('iotlabcli.helpers.get_current_experiment', get_exp).start()
 
+        self.cache_dir = tempfile.mkdtemp()
+        patch('iotlabsshcli.cache.CACHE_DIR', self.cache_dir).start()
+
     def tearDown(self):
         api_mock_stop()
         patch.stopall()
+        shutil.rmtree(self.cache_dir)
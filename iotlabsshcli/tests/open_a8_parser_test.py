@@ -21,6 +21,9 @@
 
 """Tests for iotlabsshcli.parser.open_a8 package."""
 
+import json
+import os
+
 import jmespath
 
 from iotlabsshcli.parser import open_a8_parser
@@ -51,7 +54,8 @@ class TestMainNodeParser(MainMock):
         list_nodes.assert_called_with(self.api, 123, [self._nodes], None)
         flash_m3.assert_called_with({'user': 'username', 'exp_id': 123},
                                     self._root_nodes, 'firmware.elf',
-                                    verbose=False)
+                                    False, False, verbose=False,
+                                    timings=False, on_host=None)
 
         exp_info_res = {"items": [{"network_address": node}
                                   for node in self._nodes]}
@@ -63,7 +67,23 @@ class TestMainNodeParser(MainMock):
             list_nodes.assert_called_with(self.api, 123, None, None)
             flash_m3.assert_called_with({'user': 'username', 'exp_id': 123},
                                         self._root_nodes,
-                                        'firmware.elf', verbose=False)
+                                        'firmware.elf', False, False,
+                                        verbose=False, timings=False,
+                                        on_host=None)
+
+        args = ['flash-m3', '--compact', 'firmware.elf']
+        open_a8_parser.main(args)
+        flash_m3.assert_called_with({'user': 'username', 'exp_id': 123},
+                                    self._root_nodes, 'firmware.elf', True,
+                                    False, verbose=False, timings=False,
+                                    on_host=None)
+
+        args = ['flash-m3', '--force', 'firmware.elf']
+        open_a8_parser.main(args)
+        flash_m3.assert_called_with({'user': 'username', 'exp_id': 123},
+                                    self._root_nodes, 'firmware.elf', False,
+                                    True, verbose=False, timings=False,
+                                    on_host=None)
 
     @patch('iotlabsshcli.open_a8.reset_m3')
     @patch('iotlabcli.parser.common.list_nodes')
@@ -77,7 +97,49 @@ class TestMainNodeParser(MainMock):
         list_nodes.assert_called_with(self.api, 123, [self._nodes], None)
         reset_m3.assert_called_with({'user': 'username', 'exp_id': 123},
                                     self._root_nodes,
-                                    verbose=False)
+                                    verbose=False,
+                                    timings=False, on_host=None)
+
+        args = ['--timings', 'reset-m3', '-l', 'saclay,a8,1-5']
+        open_a8_parser.main(args)
+        reset_m3.assert_called_with({'user': 'username', 'exp_id': 123},
+                                    self._root_nodes,
+                                    verbose=False,
+                                    timings=True, on_host=None)
+
+        args = ['--backend', 'asyncio', 'reset-m3', '-l', 'saclay,a8,1-5']
+        open_a8_parser.main(args)
+        reset_m3.assert_called_with({'user': 'username', 'exp_id': 123,
+                                     'backend': 'asyncio'},
+                                    self._root_nodes,
+                                    verbose=False,
+                                    timings=False, on_host=None)
+
+        args = ['--fanout', 'reset-m3', '-l', 'saclay,a8,1-5']
+        open_a8_parser.main(args)
+        reset_m3.assert_called_with({'user': 'username', 'exp_id': 123,
+                                     'fanout': True},
+                                    self._root_nodes,
+                                    verbose=False,
+                                    timings=False, on_host=None)
+
+        args = ['--compress', 'reset-m3', '-l', 'saclay,a8,1-5']
+        open_a8_parser.main(args)
+        reset_m3.assert_called_with({'user': 'username', 'exp_id': 123,
+                                     'compress': True},
+                                    self._root_nodes,
+                                    verbose=False,
+                                    timings=False, on_host=None)
+
+        args = ['--retry', '3', '--retry-on', 'connection', '--retry-on',
+                'exit', '--retry-deadline', '60', 'reset-m3',
+                '-l', 'saclay,a8,1-5']
+        open_a8_parser.main(args)
+        reset_m3.assert_called_with(
+            {'user': 'username', 'exp_id': 123,
+             'retry': {'max_attempts': 3, 'retry_on': ['connection', 'exit'],
+                       'deadline': 60}},
+            self._root_nodes, verbose=False, timings=False, on_host=None)
 
         exp_info_res = {"items": [{"network_address": node}
                                   for node in self._nodes]}
@@ -88,7 +150,71 @@ class TestMainNodeParser(MainMock):
             open_a8_parser.main(args)
             list_nodes.assert_called_with(self.api, 123, None, None)
             reset_m3.assert_called_with({'user': 'username', 'exp_id': 123},
-                                        self._root_nodes, verbose=False)
+                                        self._root_nodes, verbose=False,
+                                        timings=False, on_host=None)
+
+    @patch('iotlabsshcli.open_a8.reset_m3')
+    @patch('iotlabcli.helpers.get_current_experiment')
+    def test_experiment_cache(self, get_exp, reset_m3):
+        """Experiment id and nodes are fetched once."""
+        get_exp.return_value = 123
+        reset_m3.return_value = {"result": "test"}
+        exp_info_res = {"items": [{"network_address": node}
+                                  for node in self._nodes]}
+        with patch.object(self.api, 'get_experiment_info',
+                          Mock(return_value=exp_info_res)) as exp_info:
+            open_a8_parser.main(['reset-m3'])
+            open_a8_parser.main(['reset-m3'])
+            assert get_exp.call_count == 1
+            assert exp_info.call_count == 1
+            reset_m3.assert_called_with({'user': 'username', 'exp_id': 123},
+                                        self._root_nodes, verbose=False,
+                                        timings=False, on_host=None)
+
+            open_a8_parser.main(['--refresh-cache', 'reset-m3'])
+            assert get_exp.call_count == 2
+            assert exp_info.call_count == 2
+
+            open_a8_parser.main(['--cache-ttl', '0', 'reset-m3'])
+            assert exp_info.call_count == 3
+
+            # Experiment id is fetched again once all hosts failed
+            reset_m3.return_value = {'reset-m3': {'1': self._root_nodes}}
+            open_a8_parser.main(['reset-m3'])
+            assert get_exp.call_count == 3
+            open_a8_parser.main(['reset-m3'])
+            assert get_exp.call_count == 4
+            assert exp_info.call_count == 3
+
+    @patch('iotlabsshcli.agent_client.forward')
+    @patch('iotlabsshcli.open_a8.reset_m3')
+    def test_several_experiments(self, reset_m3, forward):
+        """Run a command on the nodes of several experiments."""
+        reset_m3.return_value = {'result': 'test'}
+        exp_nodes = {123: self._nodes[:2], 124: self._nodes[2:]}
+
+        def _exp_info(exp_id, *args):  # pylint:disable=unused-argument
+            return {"items": [{"network_address": node}
+                              for node in exp_nodes[exp_id]]}
+        with patch.object(self.api, 'get_experiment_info',
+                          Mock(side_effect=_exp_info)) as exp_info:
+            open_a8_parser.main(['-i', '123', '-i', '124', 'reset-m3'])
+            reset_m3.assert_called_with(
+                {'user': 'username', 'exp_id': 123},
+                {123: self._root_nodes[:2], 124: self._root_nodes[2:]},
+                verbose=False, timings=False, on_host=None)
+            assert list(reset_m3.call_args[0][1]) == [123, 124]
+            assert exp_info.call_count == 2
+
+            # Selected nodes are kept in their experiment, from the cache
+            open_a8_parser.main(['-i', '124', '-i', '123', 'reset-m3',
+                                 '-l', 'saclay,a8,2-3'])
+            reset_m3.assert_called_with(
+                {'user': 'username', 'exp_id': 124},
+                {124: self._root_nodes[2:3], 123: self._root_nodes[1:2]},
+                verbose=False, timings=False, on_host=None)
+            assert exp_info.call_count == 2
+        assert not forward.called
 
     @patch('iotlabsshcli.open_a8.wait_for_boot')
     @patch('iotlabcli.parser.common.list_nodes')
@@ -103,7 +229,8 @@ class TestMainNodeParser(MainMock):
         wait_for_boot.assert_called_with({'user': 'username', 'exp_id': 123},
                                          self._root_nodes,
                                          max_wait=120,
-                                         verbose=False)
+                                         verbose=False,
+                                         timings=False, on_host=None)
 
         args = ['wait-for-boot', "--max-wait", '10', '-l', 'saclay,a8,1-5']
         open_a8_parser.main(args)
@@ -111,7 +238,8 @@ class TestMainNodeParser(MainMock):
         wait_for_boot.assert_called_with({'user': 'username', 'exp_id': 123},
                                          self._root_nodes,
                                          max_wait=10,
-                                         verbose=False)
+                                         verbose=False,
+                                         timings=False, on_host=None)
 
         exp_info_res = {"items": [{"network_address": node}
                                   for node in self._nodes]}
@@ -125,7 +253,8 @@ class TestMainNodeParser(MainMock):
                                               'exp_id': 123},
                                              self._root_nodes,
                                              max_wait=120,
-                                             verbose=False)
+                                             verbose=False,
+                                             timings=False, on_host=None)
 
     @patch('iotlabsshcli.open_a8.run_script')
     @patch('iotlabcli.parser.common.list_nodes')
@@ -139,7 +268,8 @@ class TestMainNodeParser(MainMock):
         list_nodes.assert_called_with(self.api, 123, [self._nodes], None)
         run_script.assert_called_with({'user': 'username', 'exp_id': 123},
                                       self._root_nodes,
-                                      'script.sh', False, verbose=False)
+                                      'script.sh', False, verbose=False,
+                                      timings=False, on_host=None)
 
         args = ['run-script', 'script.sh', '--frontend', '-l',
                 'saclay,a8,1-5']
@@ -147,7 +277,8 @@ class TestMainNodeParser(MainMock):
         list_nodes.assert_called_with(self.api, 123, [self._nodes], None)
         run_script.assert_called_with({'user': 'username', 'exp_id': 123},
                                       self._root_nodes,
-                                      'script.sh', True, verbose=False)
+                                      'script.sh', True, verbose=False,
+                                      timings=False, on_host=None)
 
         exp_info_res = {"items": [{"network_address": node}
                                   for node in self._nodes]}
@@ -159,7 +290,8 @@ class TestMainNodeParser(MainMock):
             list_nodes.assert_called_with(self.api, 123, None, None)
             run_script.assert_called_with({'user': 'username', 'exp_id': 123},
                                           self._root_nodes,
-                                          'script.sh', False, verbose=False)
+                                          'script.sh', False, verbose=False,
+                                          timings=False, on_host=None)
 
     @patch('iotlabsshcli.open_a8.run_cmd')
     @patch('iotlabcli.parser.common.list_nodes')
@@ -173,14 +305,35 @@ class TestMainNodeParser(MainMock):
         list_nodes.assert_called_with(self.api, 123, [self._nodes], None)
         run_cmd.assert_called_with({'user': 'username', 'exp_id': 123},
                                    self._root_nodes,
-                                   'uname -a', False, verbose=False)
+                                   'uname -a', False, verbose=False,
+                                   capture_size=None, capture_dir=None,
+                                   timings=False, on_host=None)
 
         args = ['run-cmd', 'uname -a', '--frontend', '-l', 'saclay,a8,1-5']
         open_a8_parser.main(args)
         list_nodes.assert_called_with(self.api, 123, [self._nodes], None)
         run_cmd.assert_called_with({'user': 'username', 'exp_id': 123},
                                    self._root_nodes,
-                                   'uname -a', True, verbose=False)
+                                   'uname -a', True, verbose=False,
+                                   capture_size=None, capture_dir=None,
+                                   timings=False, on_host=None)
+
+        args = ['run-cmd', 'uname -a', '--capture', '-l', 'saclay,a8,1-5']
+        open_a8_parser.main(args)
+        run_cmd.assert_called_with({'user': 'username', 'exp_id': 123},
+                                   self._root_nodes,
+                                   'uname -a', False, verbose=False,
+                                   capture_size=0, capture_dir=None,
+                                   timings=False, on_host=None)
+
+        args = ['run-cmd', 'uname -a', '--capture', '100',
+                '--capture-dir', 'out', '-l', 'saclay,a8,1-5']
+        open_a8_parser.main(args)
+        run_cmd.assert_called_with({'user': 'username', 'exp_id': 123},
+                                   self._root_nodes,
+                                   'uname -a', False, verbose=False,
+                                   capture_size=100, capture_dir='out',
+                                   timings=False, on_host=None)
 
         exp_info_res = {"items": [{"network_address": node}
                                   for node in self._nodes]}
@@ -192,7 +345,69 @@ class TestMainNodeParser(MainMock):
             list_nodes.assert_called_with(self.api, 123, None, None)
             run_cmd.assert_called_with({'user': 'username', 'exp_id': 123},
                                        self._root_nodes,
-                                       'uname -a', False, verbose=False)
+                                       'uname -a', False, verbose=False,
+                                       capture_size=None,
+                                       capture_dir=None,
+                                       timings=False, on_host=None)
+
+    @patch('iotlabsshcli.open_a8.reset_m3')
+    @patch('iotlabsshcli.agent_client.forward')
+    @patch('iotlabcli.parser.common.list_nodes')
+    def test_main_agent_forward(self, list_nodes, forward, reset_m3):
+        """Commands are forwarded to a running agent."""
+        forward.return_value = {'flash-m3': {'0': self._root_nodes}}
+        reset_m3.return_value = {'reset-m3': {'0': self._root_nodes}}
+        list_nodes.return_value = self._nodes
+
+        args = ['flash-m3', 'fw.elf', '-l', 'saclay,a8,1-5']
+        open_a8_parser.main(args)
+        forward.assert_called_with(
+            os.path.join(self.cache_dir, 'agent-username.sock'),
+            {'user': 'username', 'exp_id': 123}, self._root_nodes,
+            {'command': 'flash-m3', 'firmware': os.path.abspath('fw.elf'),
+             'compact': False, 'force': False})
+
+        # No agent running
+        forward.return_value = None
+        open_a8_parser.main(['reset-m3', '-l', 'saclay,a8,1-5'])
+        assert reset_m3.call_count == 1
+
+        forward.reset_mock()
+        open_a8_parser.main(['--no-agent', 'reset-m3', '-l', 'saclay,a8,1-5'])
+        open_a8_parser.main(['--verbose', 'reset-m3', '-l', 'saclay,a8,1-5'])
+        open_a8_parser.main(['--backend', 'asyncio', 'reset-m3',
+                             '-l', 'saclay,a8,1-5'])
+        with patch('sys.stdout'):
+            open_a8_parser.main(['--stream', 'reset-m3',
+                                 '-l', 'saclay,a8,1-5'])
+        assert not forward.called
+        assert reset_m3.call_count == 5
+
+    @patch('iotlabsshcli.agent.Agent')
+    def test_main_agent(self, agent):
+        """Run the parser.node.main with agent subparser function."""
+        open_a8_parser.main(['agent', '--idle-timeout', '10'])
+        agent.assert_called_with(
+            os.path.join(self.cache_dir, 'agent-username.sock'), 10)
+        assert agent.return_value.serve.called
+
+    @patch('iotlabsshcli.plan.run_plan')
+    @patch('iotlabsshcli.plan.load_plan')
+    @patch('iotlabcli.parser.common.list_nodes')
+    def test_main_plan(self, list_nodes, load_plan, run_plan):
+        """Run the parser.node.main with plan subparser function."""
+        run_plan.return_value = {'plan': []}
+        load_plan.return_value = [('reset-m3', {})]
+        list_nodes.return_value = self._nodes
+
+        args = ['plan', 'plan.json', '-l', 'saclay,a8,1-5']
+        open_a8_parser.main(args)
+        load_plan.assert_called_with('plan.json')
+        run_plan.assert_called_with({'user': 'username', 'exp_id': 123},
+                                    self._root_nodes, [('reset-m3', {})],
+                                    verbose=False,
+                                    timings=False,
+                                    on_step=None)
 
     @patch('iotlabsshcli.open_a8.copy_file')
     @patch('iotlabcli.parser.common.list_nodes')
@@ -206,7 +421,15 @@ class TestMainNodeParser(MainMock):
         list_nodes.assert_called_with(self.api, 123, [self._nodes], None)
         copy_file.assert_called_with({'user': 'username', 'exp_id': 123},
                                      self._root_nodes,
-                                     'script.sh', verbose=False)
+                                     'script.sh', False, verbose=False,
+                                     timings=False, on_host=None)
+
+        args = ['copy-file', 'script.sh', '--delta', '-l', 'saclay,a8,1-5']
+        open_a8_parser.main(args)
+        copy_file.assert_called_with({'user': 'username', 'exp_id': 123},
+                                     self._root_nodes,
+                                     'script.sh', True, verbose=False,
+                                     timings=False, on_host=None)
 
         exp_info_res = {"items": [{"network_address": node}
                                   for node in self._nodes]}
@@ -218,7 +441,8 @@ class TestMainNodeParser(MainMock):
             list_nodes.assert_called_with(self.api, 123, None, None)
             copy_file.assert_called_with({'user': 'username', 'exp_id': 123},
                                          self._root_nodes,
-                                         'script.sh', verbose=False)
+                                         'script.sh', False, verbose=False,
+                                         timings=False, on_host=None)
 
     def test_main_unknown_function(self):
         """Run the parser.node.main with an unknown function."""
@@ -232,6 +456,32 @@ class TestMainNodeParser(MainMock):
         self.assertRaises(TypeError, open_a8_parser.open_a8_parse_and_run,
                           parser, args)
 
+    @patch('iotlabsshcli.open_a8.reset_m3')
+    @patch('iotlabcli.parser.common.list_nodes')
+    @patch('iotlabcli.parser.common.print_result')
+    def test_main_stream(self, print_result, list_nodes, reset_m3):
+        """Run reset-m3 with hosts printed as JSON lines."""
+        def _reset_m3(*args, **kwargs):  # pylint:disable=unused-argument
+            kwargs['on_host'](self._root_nodes[0], 0)
+            return {'reset-m3': {'0': self._root_nodes[:1],
+                                 '1': self._root_nodes[1:2]}}
+
+        reset_m3.side_effect = _reset_m3
+        list_nodes.return_value = self._nodes
+        with patch('sys.stdout') as stdout:
+            open_a8_parser.main(['--stream', 'reset-m3'])
+        lines = ''.join(call[0][0] for call in
+                        stdout.write.call_args_list).splitlines()
+        self.assertEqual([json.loads(line) for line in lines], [
+            {'command': 'reset-m3', 'host': self._root_nodes[0],
+             'exit_code': 0},
+            {'command': 'reset-m3', 'host': self._root_nodes[1],
+             'exit_code': 1}])
+        # The result is printed on one line
+        args, _ = print_result.call_args
+        self.assertEqual(args[2](args[0]), json.dumps(
+            reset_m3.side_effect(on_host=Mock()), sort_keys=True))
+
     @patch('iotlabsshcli.open_a8.reset_m3')
     @patch('iotlabcli.parser.common.list_nodes')
     @patch('iotlabcli.parser.common.print_result')
@@ -21,12 +21,24 @@
 
 """Tests for iotlabsshcli.open_a8 package."""
 
+import json
+
+import gevent
+import paramiko
 from pytest import raises, mark
 from pssh.exceptions import AuthenticationException, ConnectionErrorException
+from pssh.exceptions import SSHException, UnknownHostException
 
 from iotlabsshcli.open_a8 import _nodes_grouped
 from iotlabsshcli.sshlib import OpenA8Ssh, OpenA8SshAuthenticationException
-from .compat import patch
+from iotlabsshcli.sshlib import OutputCapture
+from iotlabsshcli.sshlib import fanout
+from iotlabsshcli.sshlib.result import Result
+from iotlabsshcli.sshlib.retry import RetryPolicy
+from iotlabsshcli.sshlib.open_a8_ssh import _CHECK_DIGEST_CMD
+from iotlabsshcli.sshlib.open_a8_ssh import _adapt_commands
+from iotlabsshcli.sshlib.open_a8_ssh import _tunnel_commands
+from .compat import patch, Mock
 
 _SITES = ['saclay', 'grenoble']
 _NODES = ['a8-{}.{}.iot-lab.info'.format(n, s)
@@ -35,9 +47,10 @@ _ROOT_NODES = ['node-{}'.format(node) for node in _NODES]
 
 
 @mark.parametrize('run_on_frontend', [False, True])
+@patch('iotlabsshcli.sshlib.OpenA8Ssh._frontend')
 @patch('pssh.pssh_client.ParallelSSHClient.run_command')
 @patch('pssh.pssh_client.ParallelSSHClient.join')
-def test_run(join, run_command, run_on_frontend):
+def test_run(join, run_command, frontend, run_on_frontend):
     # pylint: disable=unused-argument
     """Test running commands on ssh nodes."""
     config_ssh = {
@@ -67,6 +80,34 @@ def test_run(join, run_command, run_on_frontend):
     run_command.assert_called_with(test_command, stop_on_errors=False)
 
 
+@patch('iotlabsshcli.sshlib.OpenA8Ssh._frontend')
+@patch('pssh.pssh_client.ParallelSSHClient.run_command')
+@patch('pssh.pssh_client.ParallelSSHClient.join')
+def test_run_capture(join, run_command, frontend):
+    # pylint: disable=unused-argument
+    """Test capturing output of commands."""
+    config_ssh = {
+        'user': 'username',
+        'exp_id': 123,
+    }
+    groups = _nodes_grouped(_ROOT_NODES)
+    run_command.side_effect = lambda *args, **kwargs: dict(
+        (node, {'stdout': iter(['a' * 10, node]), 'stderr': None,
+                'exit_code': 0})
+        for node in _ROOT_NODES)
+
+    node_ssh = OpenA8Ssh(config_ssh, groups)
+    capture = OutputCapture(max_bytes=len(_ROOT_NODES[0]) + 1)
+    ret = node_ssh.run('test', capture=capture)
+    assert ret['0'] == sorted(_ROOT_NODES)
+    assert ret['output'][_ROOT_NODES[0]] == {'stdout': _ROOT_NODES[0],
+                                             'dropped': 11}
+
+    # Without capture output is drained, not returned
+    ret = node_ssh.run('test')
+    assert 'output' not in ret
+
+
 @patch('scp.SCPClient._open')
 @patch('scp.SCPClient.put')
 @patch('pssh.pssh_client.SSHClient')
@@ -87,12 +128,13 @@ def test_scp(connect, client, put, _open):
     node_ssh = OpenA8Ssh(config_ssh, groups, verbose=True)
     ret = node_ssh.scp(src, dst)
 
-    assert ret == {'0': ['saclay.iot-lab.info', 'grenoble.iot-lab.info']}
+    assert ret['0'] == ['grenoble.iot-lab.info', 'saclay.iot-lab.info']
+    assert sorted(ret['transfers']) == ret['0']
 
     connect.side_effect = ConnectionErrorException()
     ret = node_ssh.scp(src, dst)
 
-    assert ret == {'1': ['saclay.iot-lab.info', 'grenoble.iot-lab.info']}
+    assert ret == {'1': ['grenoble.iot-lab.info', 'saclay.iot-lab.info']}
 
     # Simulating an exception
     # pylint: disable=redefined-variable-type
@@ -102,9 +144,180 @@ def test_scp(connect, client, put, _open):
         node_ssh.scp(src, dst)
 
 
+@patch('scp.SCPClient._open')
+@patch('scp.SCPClient.put')
+@patch('iotlabsshcli.sshlib.open_a8_ssh.SSHClient')
+def test_scp_reuse_connections(ssh_client, put, _open):
+    # pylint: disable=unused-argument
+    """Test connections to the frontends are kept until close."""
+    config_ssh = {
+        'user': 'username',
+        'exp_id': 123,
+    }
+
+    groups = _nodes_grouped(_ROOT_NODES)
+
+    with OpenA8Ssh(config_ssh, groups) as node_ssh:
+        node_ssh.scp('test_src', 'test_dst')
+        node_ssh.scp('test_src', 'test_dst')
+        assert ssh_client.call_count == len(_SITES)
+        assert put.call_count == 2 * len(_SITES)
+        assert len(node_ssh.connections) == len(_SITES)
+    assert not node_ssh.connections
+
+
+@patch('scp.SCPClient._open')
+@patch('scp.SCPClient.put')
+@patch('iotlabsshcli.sshlib.open_a8_ssh.SSHClient')
+def test_scp_site_commands(ssh_client, put, _open):
+    # pylint: disable=unused-argument
+    """Test commands run around a copy on the frontend connection."""
+    config_ssh = {
+        'user': 'username',
+        'exp_id': 123,
+    }
+    ssh = ssh_client.return_value
+    channel = ssh.exec_command.return_value[0]
+    channel.recv_exit_status.return_value = 0
+
+    node_ssh = OpenA8Ssh(config_ssh, _nodes_grouped(_ROOT_NODES))
+    ret = node_ssh.scp_site('saclay', 'src', 'dst',
+                            before='mkdir', after='chmod').as_dict()
+    assert ret['0'] == ['saclay.iot-lab.info']
+    assert '1' not in ret
+    assert list(ret['transfers']) == ['saclay.iot-lab.info']
+    assert ssh.exec_command.call_count == 2
+    ssh.exec_command.assert_called_with('chmod', use_pty=False)
+    put.assert_called_once_with('src', 'dst')
+
+    # failing command before the copy
+    channel.recv_exit_status.return_value = 1
+    ret = node_ssh.scp_site('saclay', 'src', 'dst', before='mkdir')
+    assert ret.as_dict() == {'1': ['saclay.iot-lab.info']}
+    assert put.call_count == 1
+
+
+@patch('iotlabsshcli.sshlib.open_a8_ssh._scp_put')
+@patch('iotlabsshcli.sshlib.open_a8_ssh.SSHClient')
+@patch('iotlabsshcli.sshlib.open_a8_ssh.ParallelSSHClient')
+def test_timings(parallel_client, ssh_client, scp_put):
+    """Test phases durations are returned with timings."""
+    config_ssh = {
+        'user': 'username',
+        'exp_id': 123,
+    }
+    node = 'node-a8-1.saclay.iot-lab.info'
+    client = parallel_client.return_value
+    output = {node: {'stdout': None, 'stderr': None, 'exit_code': 0,
+                     'channel': Mock()}}
+
+    def _run_command(command, **kwargs):
+        # pylint: disable=unused-argument
+        client._run_command(node, command)
+        return output
+
+    client.run_command.side_effect = _run_command
+    ssh_client.return_value.exec_command.return_value[0] \
+        .recv_exit_status.return_value = 0
+    scp_put.return_value = {'size': 10}
+
+    node_ssh = OpenA8Ssh(config_ssh, _nodes_grouped([node]), timings=True)
+    timings = node_ssh.run('test')['timings']
+    assert sorted(timings['hosts'][node]) == ['command', 'connect']
+    assert list(timings['sites']['saclay']) == ['run']
+    assert sorted(timings['summary']['hosts']['connect']) == [
+        'max', 'median', 'min', 'p95']
+    assert output[node]['channel'].recv_exit_status.called
+
+    timings = node_ssh.scp('src', 'dst')['timings']
+    assert sorted(timings['hosts']['saclay.iot-lab.info']) == [
+        'after', 'before', 'connect', 'upload']
+    assert sorted(timings['sites']['saclay']) == ['copy', 'run']
+
+    # Not returned by default
+    node_ssh = OpenA8Ssh(config_ssh, _nodes_grouped([node]))
+    assert 'timings' not in node_ssh.run('test')
+
+
+@patch('iotlabsshcli.sshlib.open_a8_ssh._scp_put')
+@patch('iotlabsshcli.sshlib.open_a8_ssh.SSHClient')
+def test_scp_upload_cache(ssh_client, scp_put):
+    """Test files already on the frontends are not copied again."""
+    config_ssh = {
+        'user': 'username',
+        'exp_id': 123,
+    }
+    upload_cache = Mock()
+    upload_cache.digest.return_value = 'digest'
+    upload_cache.is_fresh.return_value = False
+    channel = ssh_client.return_value.exec_command.return_value[0]
+    scp_put.return_value = {'size': 10}
+
+    node_ssh = OpenA8Ssh(config_ssh, _nodes_grouped(_ROOT_NODES),
+                         upload_cache=upload_cache)
+
+    # Different remote digest
+    channel.recv_exit_status.return_value = 1
+    ret = node_ssh.scp('src', 'dst')
+    assert scp_put.call_count == len(_SITES)
+    assert ret['transfers']['saclay.iot-lab.info'] == {'size': 10}
+    upload_cache.add.assert_any_call('saclay.iot-lab.info', 'dst', 'digest')
+    ssh_client.return_value.exec_command.assert_called_with(
+        _CHECK_DIGEST_CMD.format(dst='dst', digest='digest'), use_pty=False)
+
+    # Same remote digest
+    scp_put.reset_mock()
+    channel.recv_exit_status.return_value = 0
+    ret = node_ssh.scp('src', 'dst')
+    assert not scp_put.called
+    assert ret['transfers']['saclay.iot-lab.info']['cached']
+
+    # Known in manifest, no remote check
+    ssh_client.return_value.exec_command.reset_mock()
+    upload_cache.is_fresh.return_value = True
+    ret = node_ssh.scp('src', 'dst')
+    assert not scp_put.called
+    assert not ssh_client.return_value.exec_command.called
+    assert ret['0'] == ['grenoble.iot-lab.info', 'saclay.iot-lab.info']
+
+
+@patch('iotlabsshcli.sshlib.open_a8_ssh._scp_put')
+@patch('iotlabsshcli.sshlib.open_a8_ssh.SSHClient')
+def test_scp_parallel(ssh_client, scp_put):
+    # pylint: disable=unused-argument
+    """Test copies to all frontends run at once, up to max_uploads."""
+    config_ssh = {
+        'user': 'username',
+        'exp_id': 123,
+    }
+    sites = ['saclay', 'grenoble', 'lille', 'strasbourg']
+    groups = _nodes_grouped(['node-a8-1.{}.iot-lab.info'.format(site)
+                             for site in sites])
+    state = {'current': 0, 'max': 0}
+
+    def _put(ssh, src, dst):
+        # pylint: disable=unused-argument
+        state['current'] += 1
+        state['max'] = max(state['max'], state['current'])
+        gevent.sleep(0.01)
+        state['current'] -= 1
+        return {'size': 10, 'duration': 0.01, 'throughput': 1000.0}
+
+    scp_put.side_effect = _put
+    node_ssh = OpenA8Ssh(config_ssh, groups, max_uploads=2)
+    ret = node_ssh.scp('src', 'dst')
+    frontends = sorted('{}.iot-lab.info'.format(site) for site in sites)
+    assert ret['0'] == frontends
+    assert sorted(ret['transfers']) == frontends
+    assert ret['transfers']['lille.iot-lab.info']['size'] == 10
+    assert state['max'] == 2
+
+
+@patch('iotlabsshcli.sshlib.open_a8_ssh.tcp_probe')
+@patch('iotlabsshcli.sshlib.open_a8_ssh.SSHClient')
 @patch('pssh.pssh_client.ParallelSSHClient.run_command')
 @patch('pssh.pssh_client.ParallelSSHClient.join')
-def test_wait_all_boot(join, run_command):
+def test_wait_all_boot(join, run_command, client, tcp_probe):
     # pylint: disable=unused-argument
     """Test wait for ssh nodes to be available."""
     config_ssh = {
@@ -119,13 +332,21 @@ def test_wait_all_boot(join, run_command):
     node_ssh = OpenA8Ssh(config_ssh, groups, verbose=True)
 
     # Print output of run_command
-    run_command.return_value = dict(
+    run_command.side_effect = lambda *args, **kwargs: dict(
         (node,
          {'stdout': ['test'], 'exit_code': 0})
         for node in _ROOT_NODES)
-
-    node_ssh.wait(120)
-    assert run_command.call_count == len(_SITES)
+    tcp_probe.return_value = True
+
+    ready = []
+    ret = node_ssh.wait(120, on_ready=lambda node, _: ready.append(node))
+    assert ret['0'] == sorted(_ROOT_NODES)
+    assert sorted(ret['latency']) == sorted(_ROOT_NODES)
+    assert sorted(ready) == sorted(_ROOT_NODES)
+    # One probe and one uptime per node, one connection per frontend
+    assert tcp_probe.call_count == len(_ROOT_NODES)
+    assert run_command.call_count == len(_ROOT_NODES)
+    assert client.call_count == len(_SITES)
     run_command.assert_called_with('uptime', stop_on_errors=False)
     run_command.reset_mock()
 
@@ -134,9 +355,60 @@ def test_wait_all_boot(join, run_command):
     run_command.assert_called_with(test_command, stop_on_errors=False)
 
 
+@patch('iotlabsshcli.sshlib.open_a8_ssh.tcp_probe')
+@patch('iotlabsshcli.sshlib.open_a8_ssh.SSHClient')
+@patch('pssh.pssh_client.ParallelSSHClient.run_command')
+def test_wait_unreachable(run_command, client, tcp_probe):
+    # pylint: disable=unused-argument
+    """Test SSH is not tried on nodes not answering probes."""
+    config_ssh = {
+        'user': 'username',
+        'exp_id': 123,
+    }
+    groups = _nodes_grouped(_ROOT_NODES)
+    tcp_probe.return_value = False
+
+    node_ssh = OpenA8Ssh(config_ssh, groups)
+    ret = node_ssh.wait(0)
+    assert ret['1'] == sorted(_ROOT_NODES)
+    assert not run_command.called
+
+
+@patch('scp.SCPClient._open')
+@patch('scp.SCPClient.put')
+@patch('iotlabsshcli.sshlib.open_a8_ssh.SSHClient')
+@patch('iotlabsshcli.sshlib.open_a8_ssh.ParallelSSHClient')
+def test_frontend_config(parallel_client, ssh_client, put, _open):
+    # pylint: disable=unused-argument
+    """Test frontends host name, port and key given in config_ssh."""
+    config_ssh = {
+        'user': 'username',
+        'exp_id': 123,
+        'frontend': '127.0.0.{}',
+        'port': 2222,
+        'pkey': 'key',
+    }
+    groups = _nodes_grouped(['node-a8-1.1.iot-lab.info'])
+    parallel_client.return_value.run_command.return_value = {
+        'node-a8-1.1.iot-lab.info': {'stdout': None, 'stderr': None,
+                                     'exit_code': 0}}
+
+    node_ssh = OpenA8Ssh(config_ssh, groups)
+    assert node_ssh.run('test')['0'] == ['node-a8-1.1.iot-lab.info']
+    # Nodes are reached through the frontend connection
+    parallel_client.assert_called_with(
+        ['node-a8-1.1.iot-lab.info'], user='root', pkey='key', timeout=10)
+    ssh_client.assert_called_with('127.0.0.1', user='username', port=2222,
+                                  pkey='key', timeout=10)
+
+    assert node_ssh.scp('src', 'dst')['0'] == ['127.0.0.1']
+    assert ssh_client.call_count == 1
+
+
+@patch('iotlabsshcli.sshlib.OpenA8Ssh._frontend')
 @patch('pssh.pssh_client.ParallelSSHClient.run_command')
 @patch('pssh.pssh_client.ParallelSSHClient.join')
-def test_authentication_exception(join, run_command):
+def test_authentication_exception(join, run_command, frontend):
     # pylint: disable=unused-argument
     """Test SSH authentication exception with parallel-ssh
     run_command and stop_on_errors=False option.
@@ -161,6 +433,224 @@ def test_authentication_exception(join, run_command):
     with raises(OpenA8SshAuthenticationException):
         node_ssh.run(test_command)
 
-    # only one iteration as there is an exception
-    assert run_command.call_count == 1
+    # all sites are run at once before the exception is raised
+    assert run_command.call_count == len(_SITES)
     run_command.assert_called_with(test_command, stop_on_errors=False)
+
+    # Frontend resetting proxy connections is no authentication error
+    run_command.return_value = dict(
+        ("{}.iot-lab.info".format(site),
+         {'stdout': None, 'exit_code': None,
+          'exception': ConnectionErrorException()})
+        for site in _SITES)
+    ret = node_ssh.run(test_command)
+    assert ret == {'1': sorted(_ROOT_NODES)}
+
+
+def test_shared_connections():
+    """Test shared connections are left open."""
+    config_ssh = {
+        'user': 'username',
+        'exp_id': 123,
+    }
+    groups = _nodes_grouped(_ROOT_NODES)
+    connections = Mock()
+
+    with OpenA8Ssh(config_ssh, groups, connections=connections) as node_ssh:
+        assert node_ssh.connections is connections
+    assert not connections.close.called
+
+    with patch('iotlabsshcli.sshlib.open_a8_ssh.ConnectionPool') as pool:
+        with OpenA8Ssh(config_ssh, groups):
+            pass
+    assert pool.return_value.close.called
+
+
+def test_adapt_commands():
+    """Test hosts connections are reported to the frontend limit."""
+    client, limit = Mock(), Mock()
+    run_command = client._run_command  # pylint:disable=protected-access
+    _adapt_commands(client, limit)
+
+    client._run_command('node-1')  # pylint:disable=protected-access
+    run_command.assert_called_with('node-1')
+    assert limit.report.call_args[0][0]
+
+    run_command.side_effect = ConnectionErrorException()
+    with raises(ConnectionErrorException):
+        client._run_command('node-1')  # pylint:disable=protected-access
+    limit.report.assert_called_with(False)
+
+    # Not a congestion signal
+    limit.reset_mock()
+    run_command.side_effect = AuthenticationException()
+    with raises(AuthenticationException):
+        client._run_command('node-1')  # pylint:disable=protected-access
+    assert not limit.report.called
+
+
+@patch('iotlabsshcli.sshlib.OpenA8Ssh.scp_site')
+@patch('iotlabsshcli.sshlib.OpenA8Ssh.run_site_direct')
+def test_run_fanout(run_site_direct, scp_site):
+    """Test running commands from the frontends with the fan-out helper."""
+    config_ssh = {
+        'user': 'username',
+        'exp_id': 123,
+        'fanout': True,
+    }
+    groups = _nodes_grouped(_ROOT_NODES)
+    copied = set()
+
+    def _run_site(site, hosts, command, with_proxy, capture, use_pty):
+        # pylint:disable=too-many-arguments
+        assert not with_proxy and not use_pty
+        request = fanout.decode_request(command.split()[-1])
+        assert request['command'] == 'test'
+        frontend = '{}.iot-lab.info'.format(site)
+        result = Result()
+        if site not in copied:
+            result.add(frontend, fanout.HELPER_MISSING)
+            return result
+        # Last node of each site is unreachable
+        lines = capture.buffer(site, 'stdout')
+        lines.append('Warning: not a node result')
+        # JSON values which are not node results either
+        for value in (None, 42, {'status': 'starting'}):
+            lines.append(json.dumps(value))
+        for host in hosts[:-1]:
+            lines.append(json.dumps({'host': host, 'exit_code': 0,
+                                     'duration': 0.1, 'stdout': host}))
+        result.add(frontend, 0)
+        return result
+
+    def _scp_site(site, src, dst, before):
+        assert src == fanout.source()
+        assert dst.startswith('~/A8/.iotlabsshcli/.fanout-')
+        assert before.startswith('mkdir -p')
+        copied.add(site)
+        result = Result()
+        result.add('{}.iot-lab.info'.format(site), 0)
+        return result
+
+    run_site_direct.side_effect = _run_site
+    scp_site.side_effect = _scp_site
+
+    node_ssh = OpenA8Ssh(config_ssh, groups, timings=True)
+    ret = node_ssh.run('test', capture=OutputCapture())
+    unreachable = sorted(hosts[-1] for hosts in groups.values())
+    assert ret['0'] == sorted(set(_ROOT_NODES) - set(unreachable))
+    assert ret['1'] == unreachable
+    assert ret['output'][_ROOT_NODES[0]] == {'stdout': _ROOT_NODES[0],
+                                             'dropped': 0}
+    assert ret['timings']['hosts'][_ROOT_NODES[0]]['command'] == 0.1
+    assert scp_site.call_count == len(groups)
+
+    # The helper is only copied once
+    node_ssh.run('test')
+    assert scp_site.call_count == len(groups)
+
+
+def test_tunnel_commands():
+    """Test hosts are connected over channels of the proxy connection."""
+    # pylint:disable=protected-access
+    client, proxy = Mock(host_clients={}), Mock()
+    make_ssh_client = client._make_ssh_client
+    transport = proxy.client.get_transport.return_value
+    _tunnel_commands(client, proxy, 10)
+
+    client._make_ssh_client('node-1')
+    transport.open_channel.assert_called_with(
+        'direct-tcpip', ('node-1', 22), ('127.0.0.1', 0), timeout=10)
+    make_ssh_client.assert_called_with(
+        'node-1', sock=transport.open_channel.return_value)
+
+    # Connected hosts are reused
+    client.host_clients['node-1'] = Mock()
+    client._make_ssh_client('node-1')
+    make_ssh_client.assert_called_with('node-1')
+
+    # Host connection errors are given under the host name
+    transport.open_channel.side_effect = paramiko.ChannelException(2, 'no')
+    with raises(ConnectionErrorException) as err:
+        client._make_ssh_client('node-2')
+    assert err.value.args[1] == 'node-2'
+
+    transport.is_active.return_value = False
+    with raises(ConnectionErrorException):
+        client._make_ssh_client('node-3')
+
+
+@patch('iotlabsshcli.sshlib.OpenA8Ssh._frontend')
+def test_run_frontend_unreachable(frontend):
+    """Test nodes of an unreachable frontend fail to connect."""
+    config_ssh = {
+        'user': 'username',
+        'exp_id': 123,
+    }
+    frontend.side_effect = ConnectionErrorException()
+    node_ssh = OpenA8Ssh(config_ssh, _nodes_grouped(_ROOT_NODES))
+    assert node_ssh.run('test') == {'1': sorted(_ROOT_NODES)}
+
+
+@mark.parametrize('error', [SSHException, UnknownHostException])
+@patch('iotlabsshcli.sshlib.OpenA8Ssh._frontend')
+def test_wait_frontend_unreachable(frontend, error):
+    """Test nodes of a frontend failing to connect are not ready."""
+    config_ssh = {
+        'user': 'username',
+        'exp_id': 123,
+    }
+    frontend.side_effect = error()
+    node_ssh = OpenA8Ssh(config_ssh, _nodes_grouped(_ROOT_NODES))
+    assert node_ssh.wait(0) == {'1': sorted(_ROOT_NODES)}
+
+
+@mark.parametrize('error', [SSHException, UnknownHostException])
+@patch('iotlabsshcli.sshlib.open_a8_ssh._scp_put')
+@patch('iotlabsshcli.sshlib.OpenA8Ssh._frontend')
+def test_scp_frontend_unreachable(frontend, scp_put, error):
+    """Test a copy to an unreachable frontend only fails its site."""
+    config_ssh = {
+        'user': 'username',
+        'exp_id': 123,
+    }
+
+    def _frontend(site):
+        if site == 'saclay':
+            raise error()
+        return Mock()
+    frontend.side_effect = _frontend
+    scp_put.return_value = {'size': 10}
+    node_ssh = OpenA8Ssh(config_ssh, _nodes_grouped(_ROOT_NODES))
+    ret = node_ssh.scp('src', 'dst')
+    assert ret['0'] == ['grenoble.iot-lab.info']
+    assert ret['1'] == ['saclay.iot-lab.info']
+
+
+@patch('time.sleep')
+@patch('iotlabsshcli.sshlib.OpenA8Ssh.scp_site')
+def test_scp_retry(scp_site, sleep):
+    """Test copies failing to connect are attempted again."""
+    config_ssh = {
+        'user': 'username',
+        'exp_id': 123,
+    }
+    results = {'saclay': [None, None, 0], 'grenoble': [0]}
+
+    def _scp_site(site, *args, **kwargs):
+        # pylint:disable=unused-argument
+        result = Result()
+        result.add('{}.iot-lab.info'.format(site), results[site].pop(0))
+        return result
+
+    scp_site.side_effect = _scp_site
+    node_ssh = OpenA8Ssh(config_ssh, _nodes_grouped(_ROOT_NODES))
+    retry = RetryPolicy(max_attempts=3)
+    assert node_ssh.scp('src', 'dst', retry=retry) == {
+        '0': ['grenoble.iot-lab.info', 'saclay.iot-lab.info'],
+        'attempts': {'saclay.iot-lab.info': 3}}
+    assert sleep.call_count == 2
+
+    # No retry by default
+    results.update(saclay=[None, 0], grenoble=[0])
+    assert node_ssh.scp('src', 'dst')['1'] == ['saclay.iot-lab.info']
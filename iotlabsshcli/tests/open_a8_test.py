@@ -22,46 +22,155 @@
 """Tests for iotlabsshcli.open_a8 package."""
 
 import os.path
+import subprocess
+import time
+import hashlib
+from collections import OrderedDict
 from pytest import mark
 from iotlabsshcli.open_a8 import reset_m3, flash_m3, wait_for_boot, run_script
 from iotlabsshcli.open_a8 import run_cmd, copy_file
-from iotlabsshcli.open_a8 import (_RESET_M3_CMD, _UPDATE_M3_CMD,
+from iotlabsshcli.open_a8 import (_RESET_M3_CMD, _SKIPPED_M3, _M3_MARKER,
+                                  _flash_m3_cmd,
                                   _MKDIR_DST_CMD, _RUN_SCRIPT_CMD,
                                   _QUIT_SCRIPT_CMD, _MAKE_EXECUTABLE_CMD)
 from iotlabsshcli.sshlib import OpenA8SshAuthenticationException
-from .compat import patch
+from iotlabsshcli.sshlib.result import Result
+from .compat import patch, Mock, ANY
 
+_SITES = ['saclay', 'grenoble']
 _NODES = ['a8-{}.{}.iot-lab.info'.format(n, s)
-          for n in range(1, 6) for s in ['saclay', 'grenoble']]
+          for n in range(1, 6) for s in _SITES]
 _ROOT_NODES = ['node-{}'.format(node) for node in _NODES]
 
 
-@patch('iotlabsshcli.sshlib.OpenA8Ssh.run')
-@patch('iotlabsshcli.sshlib.OpenA8Ssh.scp')
-def test_open_a8_flash_m3(scp, run):
+def _result(succeeded, failed=()):
+    """Result of succeeded and failed hosts."""
+    result = Result()
+    for host in succeeded:
+        result.add(host, 0)
+    for host in failed:
+        result.add(host, 1)
+    return result
+
+
+def _scp_site(site, src, dst, before=None, after=None, **kwargs):
+    # pylint: disable=unused-argument
+    """Successful OpenA8Ssh.scp_site."""
+    return _result(['{}.iot-lab.info'.format(site)])
+
+
+def _run_site(site, hosts, command, with_proxy=True, **kwargs):
+    # pylint: disable=unused-argument
+    """Successful OpenA8Ssh.run_site."""
+    if not with_proxy:
+        hosts = ['{}.iot-lab.info'.format(site)]
+    return _result(hosts)
+
+
+@patch('iotlabsshcli.sshlib.OpenA8Ssh.run_site')
+@patch('iotlabsshcli.sshlib.OpenA8Ssh.scp_site')
+def test_open_a8_flash_m3(scp_site, run_site, tmpdir):
     """Test flashing an M3."""
     config_ssh = {
         'user': 'username',
         'exp_id': 123,
     }
-    firmware = '/tmp/firmware.elf'
+    firmware = tmpdir.join('firmware.elf')
+    firmware.write(b'firmware', mode='wb')
+    firmware = str(firmware)
+    digest = hashlib.sha256(b'firmware').hexdigest()
     remote_fw = os.path.join('~/A8/.iotlabsshcli', os.path.basename(firmware))
-    return_value = {'0': 'test'}
-    run.return_value = return_value
-
-    ret = flash_m3(config_ssh, _ROOT_NODES, firmware)
-
-    assert ret == {'flash-m3': return_value}
-    scp.assert_called_once_with(firmware, remote_fw)
-    assert run.call_count == 2
-    run.mock_calls[0].assert_called_with(
-        _MKDIR_DST_CMD.format(os.path.dirname(remote_fw)))
-    run.mock_calls[1].assert_called_with(_UPDATE_M3_CMD.format(remote_fw))
-
-    # Raise an exception
-    run.side_effect = OpenA8SshAuthenticationException('test')
-    ret = flash_m3(config_ssh, _ROOT_NODES, firmware)
-    assert ret == {'flash-m3': {'1': _ROOT_NODES}}
+    scp_site.side_effect = _scp_site
+    run_site.side_effect = _run_site
+
+    with patch('iotlabsshcli.cache.CACHE_DIR', str(tmpdir)):
+        ret = flash_m3(config_ssh, _ROOT_NODES, firmware)
+
+        assert ret == {'flash-m3': {'0': sorted(_ROOT_NODES)}}
+        # One frontend and one nodes execution per site
+        assert scp_site.call_count == len(_SITES)
+        scp_site.assert_called_with(
+            'grenoble', firmware, remote_fw,
+            before=_MKDIR_DST_CMD.format(os.path.dirname(remote_fw)),
+            after=None)
+        assert run_site.call_count == len(_SITES)
+        run_site.assert_called_with(
+            'grenoble', [n for n in _ROOT_NODES if 'grenoble' in n],
+            _flash_m3_cmd(remote_fw, digest), True, on_host=None,
+            capture=ANY)
+
+        def _run_site_marked(marked):
+            """OpenA8Ssh.run_site of nodes with a marker of the firmware
+            in marked."""
+            def _run_site_skipped(site, hosts, command, with_proxy=True,
+                                  **kwargs):
+                for host in hosts:
+                    if host in marked:
+                        kwargs['capture'].buffer(host, 'stdout').append(
+                            _SKIPPED_M3)
+                return _run_site(site, hosts, command, with_proxy)
+            return _run_site_skipped
+
+        # Flashed nodes are skipped once their marker is checked
+        run_site.reset_mock()
+        run_site.side_effect = _run_site_marked(_ROOT_NODES)
+        on_host = Mock()
+        ret = flash_m3(config_ssh, _ROOT_NODES, firmware, on_host=on_host)
+        assert ret == {'flash-m3': {
+            'skipped': dict((n, 'local') for n in _ROOT_NODES)}}
+        assert run_site.call_count == len(_SITES)
+        on_host.assert_any_call(_ROOT_NODES[-1], 0)
+
+        # Nodes recorded locally are flashed when their marker is missing
+        run_site.reset_mock()
+        run_site.side_effect = _run_site
+        ret = flash_m3(config_ssh, _ROOT_NODES, firmware)
+        assert ret == {'flash-m3': {'0': sorted(_ROOT_NODES)}}
+        run_site.assert_called_with(
+            'grenoble', [n for n in _ROOT_NODES if 'grenoble' in n],
+            _flash_m3_cmd(remote_fw, digest), True, on_host=None,
+            capture=ANY)
+
+        # Copy failure on one site fails its nodes
+        scp_site.side_effect = lambda site, *args, **kwargs: (
+            _result([], ['saclay.iot-lab.info'])
+            if site == 'saclay'
+            else _scp_site(site, *args, **kwargs))
+        ret = flash_m3(config_ssh, _ROOT_NODES, firmware, force=True)
+        assert ret == {'flash-m3': {
+            '0': sorted(n for n in _ROOT_NODES if 'grenoble' in n),
+            '1': sorted(n for n in _ROOT_NODES if 'saclay' in n)}}
+        run_site.assert_called_with(
+            'grenoble', [n for n in _ROOT_NODES if 'grenoble' in n],
+            _flash_m3_cmd(remote_fw, digest, force=True), True,
+            on_host=None, capture=ANY)
+
+        # Failed nodes are forgotten locally, only found on the node
+        scp_site.side_effect = _scp_site
+        saclay = sorted(n for n in _ROOT_NODES if 'saclay' in n)
+        grenoble = [n for n in _ROOT_NODES if 'grenoble' in n]
+        run_site.side_effect = _run_site_marked(grenoble + saclay[:1])
+        ret = flash_m3(config_ssh, _ROOT_NODES, firmware)
+        skipped = dict((n, 'local') for n in grenoble)
+        skipped[saclay[0]] = 'node'
+        assert ret == {'flash-m3': {'0': saclay[1:], 'skipped': skipped}}
+
+        # Raise an exception
+        scp_site.side_effect = OpenA8SshAuthenticationException('test')
+        ret = flash_m3(config_ssh, _ROOT_NODES, firmware, force=True)
+        assert ret == {'flash-m3': {'1': _ROOT_NODES}}
+
+        # Compacted firmware is uploaded and flashed under the same name
+        scp_site.side_effect = _scp_site
+        with patch('iotlabsshcli.open_a8.compact_firmware') as compact:
+            compact.return_value = firmware
+            flash_m3(config_ssh, _ROOT_NODES, '/tmp/firmware.elf',
+                     compact=True)
+        compact.assert_called_with('/tmp/firmware.elf')
+        scp_site.assert_called_with(
+            'grenoble', compact.return_value, remote_fw,
+            before=_MKDIR_DST_CMD.format(os.path.dirname(remote_fw)),
+            after=None)
 
 
 @patch('iotlabsshcli.sshlib.OpenA8Ssh.run')
@@ -77,7 +186,8 @@ def test_open_a8_reset_m3(run):
     ret = reset_m3(config_ssh, _ROOT_NODES)
     assert ret == {'reset-m3': return_value}
 
-    run.assert_called_once_with(_RESET_M3_CMD)
+    run.assert_called_once_with(_RESET_M3_CMD, on_host=None)
+    assert _RESET_M3_CMD.startswith('rm -f {};'.format(_M3_MARKER))
 
     # Raise an exception
     run.side_effect = OpenA8SshAuthenticationException('test')
@@ -85,6 +195,24 @@ def test_open_a8_reset_m3(run):
     assert ret == {'reset-m3': {'1': _ROOT_NODES}}
 
 
+@mark.parametrize('update, flashed', [('true', True), ('false', False)])
+def test_open_a8_flash_m3_marker(update, flashed, tmpdir):
+    """Test the node marker is only written once the flash succeeded."""
+    marker = str(tmpdir.join('marker'))
+    with open(marker, 'w') as marker_file:
+        marker_file.write('other\n')
+
+    with patch('iotlabsshcli.open_a8._M3_MARKER', marker), \
+            patch('iotlabsshcli.open_a8._UPDATE_M3_CMD', update + ' {}'):
+        command = _flash_m3_cmd('firmware.elf', 'digest')
+    assert (subprocess.call(['sh', '-c', command]) == 0) == flashed
+    assert os.path.exists(marker) == flashed
+    if flashed:
+        # Marked nodes are skipped
+        output = subprocess.check_output(['sh', '-c', command])
+        assert output.decode().strip() == _SKIPPED_M3
+
+
 @patch('iotlabsshcli.sshlib.OpenA8Ssh.wait')
 def test_open_a8_wait_for_boot(wait):
     """Test wait for A8 boot."""
@@ -98,7 +226,7 @@ def test_open_a8_wait_for_boot(wait):
     ret = wait_for_boot(config_ssh, _ROOT_NODES)
     assert ret == {'wait-for-boot': return_value}
 
-    wait.assert_called_once_with(120)
+    wait.assert_called_once_with(120, on_ready=None)
 
     # Raise an exception
     wait.side_effect = OpenA8SshAuthenticationException('test')
@@ -107,9 +235,9 @@ def test_open_a8_wait_for_boot(wait):
 
 
 @mark.parametrize('run_on_frontend', [False, True])
-@patch('iotlabsshcli.sshlib.OpenA8Ssh.run')
-@patch('iotlabsshcli.sshlib.OpenA8Ssh.scp')
-def test_open_a8_run_script(scp, run, run_on_frontend):
+@patch('iotlabsshcli.sshlib.OpenA8Ssh.run_site')
+@patch('iotlabsshcli.sshlib.OpenA8Ssh.scp_site')
+def test_open_a8_run_script(scp_site, run_site, run_on_frontend):
     """Test run script on A8 nodes."""
     config_ssh = {
         'user': 'username',
@@ -121,39 +249,87 @@ def test_open_a8_run_script(scp, run, run_on_frontend):
                                  os.path.basename(script))
     script_data = {'screen': screen,
                    'path': remote_script}
-    return_value = {'0': 'test'}
-    run.return_value = return_value
+    scp_site.side_effect = _scp_site
+    run_site.side_effect = _run_site
 
     ret = run_script(config_ssh, _ROOT_NODES, script,
                      run_on_frontend=run_on_frontend)
 
-    assert ret == {'run-script': return_value}
-    scp.assert_called_once_with(script, remote_script)
-    assert run.call_count == 4
-
-    run.mock_calls[0].assert_called_with(
-        _MKDIR_DST_CMD.format(os.path.dirname(remote_script)),
-        with_proxy=False)
-    run.mock_calls[1].assert_called_with(
-        _MAKE_EXECUTABLE_CMD.format(os.path.dirname(remote_script)),
-        with_proxy=False)
-    run.mock_calls[2].assert_called_with(
-        _QUIT_SCRIPT_CMD.format(**script_data),
-        with_proxy=not run_on_frontend)
-    run.mock_calls[3].assert_called_with(
-        _RUN_SCRIPT_CMD.format(**script_data),
-        use_pty=False,
-        with_proxy=not run_on_frontend)
+    if run_on_frontend:
+        hosts = ['{}.iot-lab.info'.format(site) for site in _SITES]
+    else:
+        hosts = _ROOT_NODES
+    assert ret == {'run-script': {'0': sorted(hosts)}}
+
+    # mkdir, copy and chmod in one frontend execution
+    assert scp_site.call_count == len(_SITES)
+    scp_site.assert_called_with(
+        'grenoble', script, remote_script,
+        before=_MKDIR_DST_CMD.format(os.path.dirname(remote_script)),
+        after=_MAKE_EXECUTABLE_CMD.format(remote_script))
+    # quit and run in one nodes execution
+    assert run_site.call_count == len(_SITES)
+    run_site.assert_called_with(
+        'grenoble', [n for n in _ROOT_NODES if 'grenoble' in n],
+        '{{ {} || true; }} && {}'.format(
+            _QUIT_SCRIPT_CMD.format(**script_data),
+            _RUN_SCRIPT_CMD.format(**script_data)),
+        not run_on_frontend, on_host=None, use_pty=False)
 
     # Raise an exception
-    run.side_effect = OpenA8SshAuthenticationException('test')
+    scp_site.side_effect = OpenA8SshAuthenticationException('test')
     ret = run_script(config_ssh, _ROOT_NODES, script)
     assert ret == {'run-script': {'1': _ROOT_NODES}}
 
 
-@patch('iotlabsshcli.sshlib.OpenA8Ssh.run')
-@patch('iotlabsshcli.sshlib.OpenA8Ssh.scp')
-def test_open_a8_copy_file(scp, run):
+@patch('iotlabsshcli.sshlib.OpenA8Ssh.run_site')
+@patch('iotlabsshcli.sshlib.OpenA8Ssh.scp_site')
+def test_open_a8_several_experiments(scp_site, run_site):
+    """Test commands run once on nodes of several experiments."""
+    config_ssh = {'user': 'username', 'exp_id': 123}
+    saclay = [n for n in _ROOT_NODES if 'saclay' in n]
+    nodes = OrderedDict([(123, _ROOT_NODES[:3]), (124, _ROOT_NODES[3:])])
+    scp_site.side_effect = _scp_site
+    run_site.side_effect = lambda site, hosts, *args, **kwargs: (
+        _result([h for h in hosts if h != saclay[0]],
+                [h for h in hosts if h == saclay[0]]))
+
+    ret = reset_m3(config_ssh, nodes)
+    assert list(ret) == [123, 124]
+    assert ret[123] == {'reset-m3': {
+        '0': sorted(n for n in _ROOT_NODES[:3] if n != saclay[0]),
+        '1': [saclay[0]]}}
+    assert ret[124] == {'reset-m3': {'0': sorted(_ROOT_NODES[3:])}}
+    # One execution per site for all experiments
+    assert run_site.call_count == len(_SITES)
+
+    # Scripts run in the screen of their experiment
+    run_site.reset_mock()
+    ret = run_script(config_ssh, nodes, '/tmp/script.sh')
+    assert ret[124] == {'run-script': {'0': sorted(_ROOT_NODES[3:])}}
+    assert scp_site.call_count == len(_SITES)
+    run_site.assert_any_call(
+        'saclay', [n for n in _ROOT_NODES[3:] if 'saclay' in n],
+        '{{ {} || true; }} && {}'.format(
+            _QUIT_SCRIPT_CMD.format(screen='username-124',
+                                    path='~/A8/.iotlabsshcli/script.sh'),
+            _RUN_SCRIPT_CMD.format(screen='username-124',
+                                   path='~/A8/.iotlabsshcli/script.sh')),
+        True, on_host=None, use_pty=False)
+    assert run_site.call_count == 2 * len(_SITES)
+
+    # Frontends are given to the experiments with nodes on their site
+    run_site.side_effect = _run_site
+    ret = run_cmd(config_ssh, OrderedDict([(123, saclay), (124, [])]),
+                  'uname', run_on_frontend=True)
+    assert ret == OrderedDict([
+        (123, {'run-cmd': {'0': ['saclay.iot-lab.info']}}),
+        (124, {'run-cmd': {}})])
+
+
+@patch('iotlabsshcli.sshlib.OpenA8Ssh.run_site')
+@patch('iotlabsshcli.sshlib.OpenA8Ssh.scp_site')
+def test_open_a8_copy_file(scp_site, run_site):
     """Test copy file on the SSH frontend."""
     config_ssh = {
         'user': 'username',
@@ -162,22 +338,72 @@ def test_open_a8_copy_file(scp, run):
     file_path = '/tmp/script.sh'
     remote_file = os.path.join('~/A8/.iotlabsshcli',
                                os.path.basename(file_path))
-    return_value = {'0': 'test'}
-    scp.return_value = return_value
+    scp_site.side_effect = _scp_site
 
     ret = copy_file(config_ssh, _ROOT_NODES, file_path)
-    assert ret == {'copy-file': return_value}
+    sites = ['{}.iot-lab.info'.format(site) for site in _SITES]
+    assert ret == {'copy-file': {'0': sorted(sites)}}
 
-    scp.assert_called_once_with(file_path, remote_file)
-    run.assert_called_once_with(
-        _MKDIR_DST_CMD.format(os.path.dirname(remote_file)), with_proxy=False)
+    assert scp_site.call_count == len(_SITES)
+    scp_site.assert_called_with(
+        'grenoble', file_path, remote_file,
+        before=_MKDIR_DST_CMD.format(os.path.dirname(remote_file)),
+        after=None, delta=False)
+    assert not run_site.called
 
     # Raise an exception
-    run.side_effect = OpenA8SshAuthenticationException('test')
+    scp_site.side_effect = OpenA8SshAuthenticationException('test')
     ret = copy_file(config_ssh, _ROOT_NODES, file_path)
     assert ret == {'copy-file': {'1': _ROOT_NODES}}
 
 
+@patch('iotlabsshcli.sshlib.open_a8_ssh._scp_put')
+@patch('iotlabsshcli.sshlib.open_a8_ssh.SSHClient')
+def test_open_a8_copy_file_experiments(ssh_client, scp_put, tmpdir):
+    """Test files of several experiments with the same name are copied."""
+    nodes = ['node-a8-1.saclay.iot-lab.info']
+    first = tmpdir.mkdir('first').join('firmware.elf')
+    first.write(b'first', mode='wb')
+    second = tmpdir.mkdir('second').join('firmware.elf')
+    second.write(b'second', mode='wb')
+    scp_put.return_value = {'size': 10}
+
+    def _exec_command(command, **kwargs):
+        # pylint: disable=unused-argument
+        channel = Mock()
+        # Remote digests never match, only the manifest skips uploads
+        channel.recv_exit_status.return_value = int(
+            command.startswith('test '))
+        return channel, None, None, None, None
+    ssh_client.return_value.exec_command.side_effect = _exec_command
+
+    with patch('iotlabsshcli.cache.CACHE_DIR', str(tmpdir.join('cache'))):
+        for exp_id, path in ((123, first), (124, second), (123, first)):
+            scp_put.reset_mock()
+            config_ssh = {'user': 'username', 'exp_id': exp_id}
+            ret = copy_file(config_ssh, nodes, str(path))
+            assert ret['copy-file']['0'] == ['saclay.iot-lab.info']
+            # dst was overwritten by the other experiment in between
+            scp_put.assert_called_once_with(
+                ANY, str(path), '~/A8/.iotlabsshcli/firmware.elf')
+
+        scp_put.reset_mock()
+        copy_file(config_ssh, nodes, str(first))
+        assert not scp_put.called
+
+        # A stale manifest entry is checked on the frontend again, where
+        # the file was changed or removed
+        ssh_client.return_value.exec_command.reset_mock()
+        with patch('time.time', return_value=time.time() + 61):
+            copy_file(config_ssh, nodes, str(first))
+        ssh_client.return_value.exec_command.assert_any_call(
+            'test "$(sha256sum ~/A8/.iotlabsshcli/firmware.elf 2>/dev/null '
+            '| cut -d" " -f1)" = {}'.format(
+                hashlib.sha256(b'first').hexdigest()), use_pty=False)
+        scp_put.assert_called_once_with(
+            ANY, str(first), '~/A8/.iotlabsshcli/firmware.elf')
+
+
 @mark.parametrize('run_on_frontend', [False, True])
 @patch('iotlabsshcli.sshlib.OpenA8Ssh.run')
 def test_open_a8_run_cmd(run, run_on_frontend):
@@ -192,9 +418,16 @@ def test_open_a8_run_cmd(run, run_on_frontend):
 
     ret = run_cmd(config_ssh, _ROOT_NODES, cmd,
                   run_on_frontend=run_on_frontend)
-    run.assert_called_once_with(cmd, with_proxy=not run_on_frontend)
+    run.assert_called_once_with(cmd, with_proxy=not run_on_frontend,
+                                capture=None, on_host=None)
     assert ret == {'run-cmd': return_value}
 
+    # Capture output
+    run.reset_mock()
+    run_cmd(config_ssh, _ROOT_NODES, cmd, capture_size=10)
+    capture = run.call_args[1]['capture']
+    assert (capture.max_bytes, capture.spill_dir) == (10, None)
+
     # Raise an exception
     run.side_effect = OpenA8SshAuthenticationException('test')
     ret = run_cmd(config_ssh, _ROOT_NODES, cmd, False)
@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+"""Tests for iotlabsshcli.sshlib.pipeline package."""
+
+from iotlabsshcli.open_a8 import _nodes_grouped
+from iotlabsshcli.sshlib import OpenA8Ssh, Pipeline
+from iotlabsshcli.sshlib.result import Result
+from .compat import patch
+
+_SITES = ['saclay', 'grenoble']
+_NODES = ['node-a8-{}.{}.iot-lab.info'.format(n, s)
+          for n in range(1, 4) for s in _SITES]
+
+
+def _result(succeeded, failed=()):
+    """Result of succeeded and failed hosts."""
+    result = Result()
+    for host in succeeded:
+        result.add(host, 0)
+    for host in failed:
+        result.add(host, 1)
+    return result
+
+
+def _ssh():
+    return OpenA8Ssh({'user': 'username', 'exp_id': 123},
+                     _nodes_grouped(_NODES))
+
+
+@patch('iotlabsshcli.sshlib.OpenA8Ssh.run_site')
+def test_fuse_commands(run_site):
+    """Test consecutive commands with same parameters are fused."""
+    run_site.side_effect = lambda site, hosts, *args, **kwargs: (
+        _result(hosts))
+    pipeline = Pipeline(_ssh())
+    pipeline.run('first', check=False)
+    pipeline.run('second')
+    pipeline.run('third', use_pty=False)
+
+    assert pipeline.execute() == {'0': sorted(_NODES)}
+    assert run_site.call_count == 2 * len(_SITES)
+    run_site.assert_any_call('saclay', _nodes_grouped(_NODES)['saclay'],
+                             '{ first || true; } && second', True,
+                             on_host=None)
+    run_site.assert_any_call('saclay', _nodes_grouped(_NODES)['saclay'],
+                             'third', True, on_host=None, use_pty=False)
+
+    # Timings are returned when asked
+    pipeline.ssh.report_timings = True
+    assert 'timings' in pipeline.execute()
+
+
+@patch('iotlabsshcli.sshlib.OpenA8Ssh.run_site')
+def test_failed_nodes_dropped(run_site):
+    """Test nodes failing one execution are not run by the next."""
+    failing = 'node-a8-1.saclay.iot-lab.info'
+    run_site.side_effect = lambda site, hosts, *args, **kwargs: (
+        _result([h for h in hosts if h != failing],
+                [h for h in hosts if h == failing]))
+    pipeline = Pipeline(_ssh())
+    pipeline.run('first')
+    pipeline.run('second', use_pty=False)
+
+    ret = pipeline.execute()
+    assert ret == {'0': sorted(n for n in _NODES if n != failing),
+                   '1': [failing]}
+    for call in run_site.call_args_list:
+        if call[0][2] == 'second':
+            assert failing not in call[0][1]
+
+
+@patch('iotlabsshcli.sshlib.OpenA8Ssh.run_site')
+def test_on_host(run_site):
+    """Test final exit codes of nodes are given once each."""
+    failing = 'node-a8-1.saclay.iot-lab.info'
+
+    def _run_site(site, hosts, *args, **kwargs):
+        # pylint:disable=unused-argument
+        result = Result()
+        for host in hosts:
+            result.add(host, 1 if host == failing else 0)
+            # Nodes succeeding the first execution are not done yet
+            kwargs['on_host'](host, result.exit_code(host))
+        return result
+
+    run_site.side_effect = _run_site
+    pipeline = Pipeline(_ssh())
+    pipeline.run('first')
+    pipeline.run('second', use_pty=False)
+    reported = []
+    pipeline.execute(on_host=lambda *args: reported.append(args))
+    assert sorted(reported) == sorted(
+        (node, 1 if node == failing else 0) for node in _NODES)
+    assert run_site.call_count == 2 * len(_SITES)
+
+
+@patch('iotlabsshcli.sshlib.OpenA8Ssh.run_site')
+def test_hosts(run_site):
+    """Test commands restricted to some nodes, or their frontends."""
+    run_site.side_effect = lambda site, hosts, *args, **kwargs: (
+        _result(hosts))
+    some = ['node-a8-1.saclay.iot-lab.info', 'node-a8-2.saclay.iot-lab.info']
+    pipeline = Pipeline(_ssh())
+    pipeline.run('first', hosts=some)
+    pipeline.run('second', hosts=some)
+    pipeline.run('third', with_proxy=False, hosts=some)
+    pipeline.run('fourth')
+
+    assert pipeline.execute() == {'0': sorted(_NODES)}
+    run_site.assert_any_call('saclay', some, 'first && second', True,
+                             on_host=None)
+    run_site.assert_any_call('saclay', some, 'third', False, on_host=None)
+    run_site.assert_any_call('saclay', _nodes_grouped(_NODES)['saclay'],
+                             'fourth', True, on_host=None)
+    # Sites without any of the nodes skip their commands
+    assert run_site.call_count == 3 + 1
+
+
+@patch('iotlabsshcli.sshlib.OpenA8Ssh.run_site')
+@patch('iotlabsshcli.sshlib.OpenA8Ssh.scp_site')
+def test_frontend_failure(scp_site, run_site):
+    """Test frontend failures are reported on frontends or on nodes."""
+    scp_site.side_effect = lambda site, *args, **kwargs: _result(
+        [], ['{}.iot-lab.info'.format(site)])
+    pipeline = Pipeline(_ssh())
+    pipeline.run('mkdir', with_proxy=False)
+    pipeline.upload('src', 'dst')
+    pipeline.run('chmod', with_proxy=False)
+    assert pipeline.execute() == {
+        '1': ['grenoble.iot-lab.info', 'saclay.iot-lab.info']}
+    scp_site.assert_called_with('grenoble', 'src', 'dst',
+                                before='mkdir', after='chmod')
+
+    pipeline.run('flash')
+    assert pipeline.execute() == {'1': sorted(_NODES)}
+    assert not run_site.called
+
+
+@patch('time.sleep')
+@patch('iotlabsshcli.sshlib.OpenA8Ssh.run_site')
+def test_retry(run_site, sleep):
+    """Test nodes failing to connect are run again, the others are not."""
+    unreachable = 'node-a8-1.saclay.iot-lab.info'
+    attempted = set()
+
+    def _run_site(site, hosts, *args, **kwargs):
+        # pylint:disable=unused-argument
+        result = Result()
+        for host in hosts:
+            # Unreachable on first attempt only
+            result.add(host, None if host == unreachable and
+                       host not in attempted else 0)
+            attempted.add(host)
+        return result
+
+    run_site.side_effect = _run_site
+    ssh = OpenA8Ssh({'user': 'username', 'exp_id': 123,
+                     'retry': {'max_attempts': 2}}, _nodes_grouped(_NODES))
+    pipeline = Pipeline(ssh)
+    pipeline.run('first')
+
+    assert pipeline.execute() == {
+        '0': sorted(_NODES),
+        'attempts': {'node-a8-1.saclay.iot-lab.info': 2}}
+    run_site.assert_any_call('saclay', ['node-a8-1.saclay.iot-lab.info'],
+                             'first', True, on_host=None)
+    assert run_site.call_count == len(_SITES) + 1
+    assert sleep.call_count == 1
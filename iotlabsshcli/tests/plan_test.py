@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+"""Tests for iotlabsshcli.plan package."""
+
+import json
+from collections import OrderedDict
+
+from pytest import raises, importorskip
+
+from iotlabsshcli import plan
+from iotlabsshcli.sshlib.pool import ConnectionPool
+from .compat import patch
+
+_NODES = ['node-a8-{}.{}.iot-lab.info'.format(n, s)
+          for n in range(1, 4) for s in ['saclay', 'lille']]
+
+
+def test_load_plan(tmpdir):
+    """Test reading JSON plan files."""
+    path = tmpdir.join('plan.json')
+    path.write(json.dumps([{'command': 'wait-for-boot', 'max_wait': 10},
+                           {'command': 'run-cmd', 'cmd': 'ls',
+                            'frontend': True}]))
+    assert plan.load_plan(str(path)) == [
+        ('wait-for-boot', {'max_wait': 10}),
+        ('run-cmd', {'cmd': 'ls', 'run_on_frontend': True})]
+
+    path.write(json.dumps({'command': 'reset-m3'}))
+    raises(ValueError, plan.load_plan, str(path))
+    path.write(json.dumps([{'command': 'run-cmd', 'cmd': 'ls', 'id': 1}]))
+    raises(ValueError, plan.load_plan, str(path))
+
+    yaml_path = tmpdir.join('plan.yml')
+    yaml_path.write('- command: reset-m3\n')
+    with patch.dict('sys.modules', {'yaml': None}):
+        raises(ValueError, plan.load_plan, str(yaml_path))
+
+
+def test_load_plan_yaml(tmpdir):
+    """Test reading YAML plan files."""
+    importorskip('yaml')
+    path = tmpdir.join('plan.yaml')
+    path.write('- command: flash-m3\n  firmware: fw.elf\n')
+    assert plan.load_plan(str(path)) == [('flash-m3', {'firmware': 'fw.elf'})]
+
+
+@patch('iotlabsshcli.open_a8.run_cmd')
+@patch('iotlabsshcli.open_a8.copy_file')
+@patch('iotlabsshcli.open_a8.reset_m3')
+def test_run_plan(reset_m3, copy_file, run_cmd):
+    """Test steps run on nodes successful at previous step."""
+    config_ssh = {'user': 'username', 'exp_id': 123}
+    reset_m3.return_value = {'reset-m3': {'0': _NODES[1:],
+                                          '1': _NODES[:1]}}
+    copy_file.return_value = {'copy-file': {'0': ['lille.iot-lab.info'],
+                                            '1': ['saclay.iot-lab.info']}}
+    run_cmd.return_value = {'run-cmd': {'0': _NODES[1:2]}}
+    steps = [('reset-m3', {}), ('copy-file', {'file_path': 'fw.elf'}),
+             ('run-cmd', {'cmd': 'ls'})]
+
+    with patch.object(ConnectionPool, 'close') as close:
+        ret = plan.run_plan(config_ssh, _NODES, steps)
+    assert ret == {'plan': [reset_m3.return_value, copy_file.return_value,
+                            run_cmd.return_value]}
+
+    connections = reset_m3.call_args[1]['connections']
+    reset_m3.assert_called_with(config_ssh, _NODES, verbose=False,
+                                connections=connections, timings=False,
+                                on_host=None)
+    copy_file.assert_called_with(config_ssh, _NODES[1:], verbose=False,
+                                 connections=connections, timings=False,
+                                 on_host=None, file_path='fw.elf')
+    lille_nodes = [node for node in _NODES[1:] if 'lille' in node]
+    run_cmd.assert_called_with(config_ssh, lille_nodes, verbose=False,
+                               connections=connections, timings=False,
+                               on_host=None, cmd='ls')
+    assert close.call_count == 1
+
+
+@patch('iotlabsshcli.open_a8.run_cmd')
+@patch('iotlabsshcli.open_a8.reset_m3')
+def test_run_plan_experiments(reset_m3, run_cmd):
+    """Test plans on several experiments give their results per experiment.
+    """
+    config_ssh = {'user': 'username', 'exp_id': 123}
+    nodes = OrderedDict([(123, _NODES[:3]), (124, _NODES[3:])])
+    reset_m3.return_value = OrderedDict([
+        (123, {'reset-m3': {'0': _NODES[1:3], '1': _NODES[:1]}}),
+        (124, {'reset-m3': {'0': _NODES[3:]}})])
+    run_cmd.return_value = OrderedDict([
+        (123, {'run-cmd': {'0': _NODES[1:3]}}),
+        (124, {'run-cmd': {'1': _NODES[3:]}})])
+    steps = [('reset-m3', {}), ('run-cmd', {'cmd': 'ls'})]
+
+    ret = plan.run_plan(config_ssh, nodes, steps)
+    assert ret == {
+        123: {'plan': [reset_m3.return_value[123], run_cmd.return_value[123]]},
+        124: {'plan': [reset_m3.return_value[124], run_cmd.return_value[124]]}}
+    assert run_cmd.call_args[0][1] == {123: _NODES[1:3], 124: _NODES[3:]}
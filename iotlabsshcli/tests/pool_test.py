@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+"""Tests for iotlabsshcli.sshlib.pool package."""
+
+import gevent
+
+from iotlabsshcli.sshlib.pool import ConnectionPool
+from .compat import Mock, patch
+
+
+def _ssh(alive=True):
+    """Return a mock of a pssh SSHClient."""
+    ssh = Mock()
+    ssh.client.get_transport.return_value.is_active.return_value = alive
+    return ssh
+
+
+def test_get_put():
+    """Test connections are keyed by proxy, host and user."""
+    pool = ConnectionPool()
+    ssh = _ssh()
+    pool.put(ssh, 'node-a8-1', 'user', 'saclay.iot-lab.info')
+
+    assert pool.get('node-a8-1', 'user', 'saclay.iot-lab.info') is ssh
+    assert pool.get('node-a8-1', 'user') is None
+    assert pool.get('node-a8-1', 'other', 'saclay.iot-lab.info') is None
+    assert len(pool) == 1
+
+    # dead connections are closed and dropped
+    ssh.client.get_transport.return_value.is_active.return_value = False
+    assert pool.get('node-a8-1', 'user', 'saclay.iot-lab.info') is None
+    ssh.client.close.assert_called_once_with()
+    ssh.proxy_client.close.assert_called_once_with()
+    assert not pool
+
+
+def test_checkout_checkin():
+    """Test sharing connections with a ParallelSSHClient."""
+    pool = ConnectionPool()
+    ssh_1, ssh_2 = _ssh(), _ssh()
+    pool.put(ssh_1, 'node-a8-1', 'user', 'proxy')
+
+    client = Mock(hosts=['node-a8-1', 'node-a8-2'], host_clients={})
+    pool.checkout(client, 'user', 'proxy')
+    assert client.host_clients == {'node-a8-1': ssh_1}
+
+    client.host_clients['node-a8-2'] = ssh_2
+    client.host_clients['node-a8-3'] = None
+    pool.checkin(client, 'user', 'proxy')
+    assert pool.get('node-a8-2', 'user', 'proxy') is ssh_2
+    assert len(pool) == 2
+
+
+def test_get_or_create():
+    """Test concurrent callers for a host share one new connection."""
+    pool = ConnectionPool()
+    opened = []
+
+    def _factory():
+        gevent.sleep(0.01)
+        opened.append(_ssh())
+        return opened[-1]
+
+    greenlets = [gevent.spawn(pool.get_or_create, _factory,
+                              'saclay.iot-lab.info', 'user')
+                 for _ in range(3)]
+    gevent.joinall(greenlets, raise_error=True)
+    assert len(opened) == 1
+    assert [greenlet.value for greenlet in greenlets] == opened * 3
+
+    # Other hosts get their own connection
+    assert pool.get_or_create(_factory, 'lille.iot-lab.info',
+                              'user') is opened[1]
+    assert len(pool) == 2
+
+
+@patch('time.time')
+def test_evict_close(time):
+    """Test idle eviction and explicit close."""
+    pool = ConnectionPool(max_idle=60)
+    ssh_1, ssh_2 = _ssh(), _ssh()
+    time.return_value = 0
+    pool.put(ssh_1, 'saclay.iot-lab.info', 'user')
+    time.return_value = 50
+    pool.put(ssh_2, 'lille.iot-lab.info', 'user')
+
+    time.return_value = 100
+    pool.evict_idle()
+    ssh_1.client.close.assert_called_once_with()
+    assert not ssh_2.client.close.called
+    assert len(pool) == 1
+
+    pool.close()
+    ssh_2.client.close.assert_called_once_with()
+    assert not pool
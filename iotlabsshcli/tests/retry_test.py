@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+"""Tests for iotlabsshcli.sshlib.retry package."""
+
+from pytest import raises
+
+from iotlabsshcli.sshlib.result import Result
+from iotlabsshcli.sshlib.retry import Backoff, RetryPolicy
+from .compat import patch
+
+_HOSTS = ['node-{}'.format(num) for num in range(1, 5)]
+
+
+class _Attempts(object):  # pylint:disable=too-few-public-methods
+    """Hosts exit codes per attempt, last ones repeated."""
+
+    def __init__(self, exit_codes):
+        self.exit_codes = exit_codes
+        self.calls = []
+
+    def __call__(self, hosts, on_host=None):
+        self.calls.append(list(hosts))
+        result = Result()
+        for host in hosts:
+            codes = self.exit_codes.get(host, [0])
+            attempt = sum(host in call for call in self.calls) - 1
+            result.add(host, codes[min(attempt, len(codes) - 1)])
+            if on_host is not None:
+                on_host(host, result.exit_code(host))
+        return result
+
+
+def _policy(**kwargs):
+    return RetryPolicy(backoff=Backoff(initial=0, jitter=0), **kwargs)
+
+
+def test_retry_failed_hosts():
+    """Test only retryable failed hosts are attempted again."""
+    attempts = _Attempts({'node-1': [None, 0], 'node-2': [1],
+                          'node-3': [None]})
+    result = _policy(max_attempts=3).run(_HOSTS, attempts)
+    assert attempts.calls == [_HOSTS, ['node-1', 'node-3'], ['node-3']]
+    assert result.as_dict() == {'0': ['node-1', 'node-4'],
+                                '1': ['node-2', 'node-3'],
+                                'attempts': {'node-1': 2, 'node-3': 3}}
+
+    # Non-zero exit codes too
+    attempts = _Attempts({'node-2': [1, 1, 0]})
+    result = _policy(retry_on=['connection', 'exit']).run(_HOSTS, attempts)
+    assert result.success('node-2')
+    assert result.attempts('node-2') == 3
+
+
+def test_final_exit_codes():
+    """Test only exit codes of hosts not attempted again are reported."""
+    attempts = _Attempts({'node-1': [None, 0], 'node-2': [1],
+                          'node-3': [None]})
+    reported = []
+    _policy(max_attempts=3).run(_HOSTS, attempts,
+                                on_host=lambda *args: reported.append(args))
+    assert reported == [('node-2', 1), ('node-4', 0), ('node-1', 0),
+                        ('node-3', None)]
+
+
+@patch('iotlabsshcli.sshlib.retry.clock')
+@patch('time.sleep')
+def test_deadline(sleep, clock):
+    """Test no attempt starts after the deadline."""
+    clock.return_value = 100
+    policy = RetryPolicy(max_attempts=5, deadline=30,
+                         backoff=Backoff(initial=10, maximum=100, jitter=0))
+    expires = policy.expires()
+    assert expires == 130
+
+    attempts = _Attempts({'node-1': [None]})
+
+    def _sleep(delay):
+        clock.return_value += delay
+
+    sleep.side_effect = _sleep
+    result = policy.run(_HOSTS, attempts, expires)
+    # Waits of 10 and 20 seconds fit, not the next one of 40
+    assert [call[0][0] for call in sleep.call_args_list] == [10, 20]
+    assert result.attempts('node-1') == 3
+
+
+def test_unknown_failures():
+    """Test retried failures are checked."""
+    with raises(ValueError):
+        RetryPolicy(retry_on=['timeout'])
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+"""Tests for iotlabsshcli.sshlib.scheduler package."""
+
+from collections import OrderedDict
+
+import gevent
+from pytest import raises
+
+from iotlabsshcli.sshlib.scheduler import SiteScheduler
+
+
+def _in_flight_recorder():
+    """Return a task recording the maximum number of concurrent calls."""
+    state = {'current': 0, 'max': 0}
+
+    def _task():
+        state['current'] += 1
+        state['max'] = max(state['max'], state['current'])
+        gevent.sleep(0.01)
+        state['current'] -= 1
+
+    return _task, state
+
+
+def test_sites_run_concurrently():
+    """Test all sites are started before any of them completes."""
+    started = []
+
+    def _site(site, hosts):  # pylint: disable=unused-argument
+        started.append(site)
+        gevent.sleep(0.01)
+        return list(started)
+
+    groups = OrderedDict([('grenoble', []), ('saclay', []), ('lille', [])])
+    ret = SiteScheduler().map(_site, groups)
+    assert list(ret) == ['grenoble', 'saclay', 'lille']
+    for site_started in ret.values():
+        assert site_started == ['grenoble', 'saclay', 'lille']
+
+
+def test_site_exception():
+    """Test exception of one site is raised after all sites ran."""
+    done = []
+
+    def _site(site, hosts):  # pylint: disable=unused-argument
+        if site == 'grenoble':
+            raise ValueError(site)
+        gevent.sleep(0.01)
+        done.append(site)
+
+    groups = OrderedDict([('grenoble', []), ('saclay', [])])
+    with raises(ValueError):
+        SiteScheduler().map(_site, groups)
+    assert done == ['saclay']
+
+
+def test_limits():
+    """Test per-site and global limits of sites pools."""
+    task, state = _in_flight_recorder()
+    pool = SiteScheduler(pool_size=3).site_pool()
+    for _ in range(10):
+        pool.spawn(task)
+    pool.join()
+    assert state['max'] == 3
+
+    task, state = _in_flight_recorder()
+    scheduler = SiteScheduler(pool_size=3, max_sessions=4)
+    pools = [scheduler.site_pool(), scheduler.site_pool()]
+    for _ in range(10):
+        for pool in pools:
+            pool.spawn(task)
+    for pool in pools:
+        pool.join()
+    assert state['max'] == 4
+
+
+def test_adaptive_limit():
+    """Test site pools follow the limit of their frontend."""
+    scheduler = SiteScheduler(pool_size=2, max_pool_size=8)
+    task, state = _in_flight_recorder()
+    pool = scheduler.site_pool('saclay')
+    for _ in range(10):
+        pool.spawn(task)
+    pool.join()
+    assert state['max'] == 2
+
+    # Healthy connections grow the limit, shared by pools of the site
+    limit = scheduler.site_pool('saclay').limit
+    assert limit is scheduler.limits['saclay']
+    for _ in range(5):
+        limit.report(True, 0.5)
+    task, state = _in_flight_recorder()
+    pool = scheduler.site_pool('saclay')
+    for _ in range(10):
+        pool.spawn(task)
+    pool.join()
+    assert state['max'] == 4
+    assert scheduler.site_pool('lille').limit.limit == 2
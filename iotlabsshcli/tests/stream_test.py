@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+
+# This file is a part of IoT-LAB ssh-cli-tools
+# Copyright (C) 2015 INRIA (Contact: admin@iot-lab.info)
+# Contributor(s) : see AUTHORS file
+#
+# This software is governed by the CeCILL license under French law
+# and abiding by the rules of distribution of free software.  You can  use,
+# modify and/ or redistribute the software under the terms of the CeCILL
+# license as circulated by CEA, CNRS and INRIA at the following URL
+# http://www.cecill.info.
+#
+# As a counterpart to the access to the source code and  rights to copy,
+# modify and redistribute granted by the license, users are provided only
+# with a limited warranty  and the software's author,  the holder of the
+# economic rights,  and the successive licensors  have only  limited
+# liability.
+#
+# The fact that you are presently reading this means that you have had
+# knowledge of the CeCILL license and that you accept its terms.
+
+
+"""Tests for iotlabsshcli.stream package."""
+
+import json
+
+from iotlabsshcli.stream import NodeStream
+
+
+class _Output(object):
+    """Standard output stand-in, keeping what is written."""
+
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        """Keep data."""
+        self.written.append(data)
+
+    def flush(self):
+        """Nothing to flush."""
+
+    def lines(self):
+        """Return the JSON lines written."""
+        return [json.loads(line)
+                for line in ''.join(self.written).splitlines()]
+
+
+def test_plan_stream():
+    """Test hosts are written once per step, missing ones at the end."""
+    out = _Output()
+    stream = NodeStream(out)
+    reset = stream.on_host('reset-m3')
+    reset('node-a8-1', 0)
+    reset('node-a8-2', None)
+    reset('node-a8-2', 1)
+    stream.on_host('run-cmd')('node-a8-1', 2)
+    stream.on_host('run-cmd')
+    stream.on_host('flash-m3')
+
+    stream.finish({'plan': [
+        {'reset-m3': {'0': ['node-a8-1'], '1': ['node-a8-2']}},
+        {'run-cmd': {'1': ['node-a8-1']}},
+        {'run-cmd': {'0': ['node-a8-1']}},
+        {'flash-m3': {'skipped': {'node-a8-1': 'local'}}}]})
+    assert out.lines() == [
+        {'command': 'reset-m3', 'host': 'node-a8-1', 'exit_code': 0},
+        {'command': 'reset-m3', 'host': 'node-a8-2', 'exit_code': None},
+        {'command': 'run-cmd', 'host': 'node-a8-1', 'exit_code': 2},
+        {'command': 'run-cmd', 'host': 'node-a8-1', 'exit_code': 0},
+        {'command': 'flash-m3', 'host': 'node-a8-1', 'exit_code': 0}]
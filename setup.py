@@ -54,6 +54,8 @@ SCRIPTS += DEPRECATED_SCRIPTS
 
 INSTALL_REQUIRES = ['argparse', 'iotlabcli>=2.0', 'parallel-ssh==1.5.5',
                     'scp>=0.10', 'gevent<=1.1']
+# The asyncio SSH backend requires Python >= 3.7
+EXTRAS_REQUIRE = {'asyncio': ['asyncssh'], 'zstd': ['zstandard']}
 
 setup(
     name=PACKAGE,
@@ -78,4 +80,5 @@ setup(
                  'Environment :: Console',
                  'Topic :: Utilities', ],
     install_requires=INSTALL_REQUIRES,
+    extras_require=EXTRAS_REQUIRE,
 )
@@ -13,7 +13,7 @@ _iotlab_ssh() {
         -v|--version|-h|--help)
             return 0
             ;;
-        -u|--user|-p|--password)
+        -u|--user|-p|--password|--cache-ttl)
             return 0
             ;;
     esac
@@ -22,7 +22,7 @@ _iotlab_ssh() {
     local subcword cmd
     for (( subcword=1; subcword < ${#words[@]}-1; subcword++ )); do
         [[ ${words[subcword]} != -* && \
-            ! ${words[subcword-1]} =~ -+(jmespath|jp|format|fmt|u(ser)?|p(assword)) ]] && \
+            ! ${words[subcword-1]} =~ -+(jmespath|jp|format|fmt|cache-ttl|backend|retry|retry-on|retry-deadline|u(ser)?|p(assword)) ]] && \
                 { cmd=${words[subcword]}; break; }
     done
 
@@ -30,12 +30,12 @@ _iotlab_ssh() {
         case $cur in
             -*)
                 # No command name, complete with generic flags
-                COMPREPLY=($(compgen -W '-h --help -u --user -p --password -v --version --jmespath --jp --format --fmt -i --id --verbose' -- "$cur" ))
+                COMPREPLY=($(compgen -W '-h --help -u --user -p --password -v --version --jmespath --jp --format --fmt -i --id --cache-ttl --refresh-cache --no-agent --backend --fanout --compress --retry --retry-on --retry-deadline --timings --stream --verbose' -- "$cur" ))
                 return 0
                 ;;
             *)
                 # Complete with a command name
-                COMPREPLY=($(compgen -W 'flash-m3 reset-m3 wait-for-boot run-script run-cmd copy-file' -- "$cur"))
+                COMPREPLY=($(compgen -W 'flash-m3 reset-m3 wait-for-boot run-script run-cmd copy-file plan agent' -- "$cur"))
                 return 0
                 ;;
         esac
@@ -43,7 +43,43 @@ _iotlab_ssh() {
 
     # Complete command arguments
     case $cmd in
-        flash-m3|copy-file)
+        flash-m3)
+            case "$prev" in
+                -u|--user|-p|--password)
+                    # Nothing to complete
+                    ;;
+                -e|--exclude)
+                    _iotlab_resources_list
+                    ;;
+                -l|--list)
+                    _iotlab_resources_list
+                    ;;
+                -*)
+                    COMPREPLY=($(compgen -W '-h --help -u --user -p --password -v --version --compact --force -e --exclude -l --list' -- "$cur" ))
+                    ;;
+                *)
+                    _filedir
+            esac
+            ;;
+        copy-file)
+            case "$prev" in
+                -u|--user|-p|--password)
+                    # Nothing to complete
+                    ;;
+                -e|--exclude)
+                    _iotlab_resources_list
+                    ;;
+                -l|--list)
+                    _iotlab_resources_list
+                    ;;
+                -*)
+                    COMPREPLY=($(compgen -W '-h --help -u --user -p --password -v --version --delta -e --exclude -l --list' -- "$cur" ))
+                    ;;
+                *)
+                    _filedir
+            esac
+            ;;
+        plan)
             case "$prev" in
                 -u|--user|-p|--password)
                     # Nothing to complete
@@ -61,6 +97,15 @@ _iotlab_ssh() {
                     _filedir
             esac
             ;;
+        agent)
+            case "$prev" in
+                -u|--user|-p|--password|--idle-timeout)
+                    # Nothing to complete
+                    ;;
+                *)
+                    COMPREPLY=($(compgen -W '-h --help -u --user -p --password -v --version --idle-timeout' -- "$cur" ))
+            esac
+            ;;
         reset-m3)
             case "$prev" in
                 -u|--user|-p|--password)
@@ -91,7 +136,7 @@ _iotlab_ssh() {
                     COMPREPLY=($(compgen -W '-h --help -u --user -p --password -v --version --max-wait -e --exclude -l --list' -- "$cur" ))
             esac
             ;;
-        run-script|run-cmd)
+        run-script)
             case "$prev" in
                 -u|--user|-p|--password)
                     # Nothing to complete
@@ -108,6 +153,27 @@ _iotlab_ssh() {
                 *)
                     _filedir
             esac
+            ;;
+        run-cmd)
+            case "$prev" in
+                -u|--user|-p|--password|--capture)
+                    # Nothing to complete
+                    ;;
+                -e|--exclude)
+                    _iotlab_resources_list
+                    ;;
+                -l|--list)
+                    _iotlab_resources_list
+                    ;;
+                --capture-dir)
+                    _filedir -d
+                    ;;
+                -*)
+                    COMPREPLY=($(compgen -W '-h --help -u --user -p --password -v --version --frontend --capture --capture-dir -e --exclude -l --list' -- "$cur" ))
+                    ;;
+                *)
+                    _filedir
+            esac
     esac
 }
 